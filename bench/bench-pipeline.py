@@ -0,0 +1,234 @@
+import argparse
+import contextlib
+import datetime as dt
+import json
+import os
+import sys
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import benchlib
+import fake_binance
+import qsec.cache
+import qsec.marketdata
+import qsec.time
+
+
+# End-to-end benchmarks of the trade and bar download paths: json decoding,
+# normalisation, parquet writing per codec, parquet reading, loading through
+# the caches in qsec.cache, and a full fetch against a local stand-in for the
+# Binance REST API.
+#
+# Results are written as JSON lines (one per measurement), e.g.
+#
+#   python bench/bench-pipeline.py --sizes 1k,100k,1M --output bench.jsonl
+
+all_stages = ["decode", "normalise", "write", "read", "cache", "fetch", "klines"]
+all_codecs = ["NONE", "SNAPPY", "GZIP", "ZSTD", "LZ4", "BROTLI"]
+bench_date = dt.date(2022, 1, 13)
+bench_symbol = "TVKUSDT"
+
+
+def decode_pages(pages) -> list:
+    return [pd.DataFrame(json.loads(raw)) for raw in pages]
+
+
+def bench_trades(out, args, trades_tool, n: int, workdir: str):
+    trades = fake_binance.TradeDay(qsec.time.date_to_epoch_ms(bench_date), n)
+    pages = list(trades.iter_day_pages())
+    page_bytes = sum(len(p) for p in pages)
+
+    dfs, samples = benchlib.measure(lambda: decode_pages(pages), args.repeat)
+    if "decode" in args.stages:
+        out.emit("trades.decode", samples, rows=n, bytes=page_bytes)
+    del pages
+
+    raw_df, samples = benchlib.measure(lambda: pd.concat(dfs), args.repeat)
+    if "normalise" in args.stages:
+        out.emit("trades.concat", samples, rows=n)
+    del dfs
+
+    df, samples = benchlib.measure(lambda: trades_tool.normalise(raw_df),
+                                   args.repeat)
+    if "normalise" in args.stages:
+        out.emit("trades.normalise", samples, rows=n)
+    del raw_df
+
+    written = {}
+    if "write" in args.stages or "read" in args.stages:
+        table, samples = benchlib.measure(lambda: pa.Table.from_pandas(df),
+                                          args.repeat)
+        out.emit("trades.to_arrow", samples, rows=n)
+        for codec in args.codecs:
+            fn = os.path.join(workdir, f"trades-{n}-{codec}.parq")
+            _, samples = benchlib.measure(
+                lambda: pq.write_table(table, fn, compression=codec),
+                args.repeat)
+            written[codec] = fn
+            if "write" in args.stages:
+                out.emit("trades.write", samples, rows=n, codec=codec,
+                         file_bytes=os.path.getsize(fn))
+
+    if "write" in args.stages:
+        # the real storage path, including metadata and directory handling
+        common = sys.modules["common"]
+        sid = common.build_assetid(bench_symbol, "BNC", is_cash=True)
+        with benchlib.home_dir(workdir):
+            _, samples = benchlib.measure(
+                lambda: common.save_dateframe(bench_symbol, bench_date, df, sid,
+                                              "binance", "trades"),
+                args.repeat)
+        out.emit("trades.save_dateframe", samples, rows=n)
+
+    if "read" in args.stages:
+        t0 = pd.Timestamp(bench_date) + pd.Timedelta(hours=12)
+        t1 = t0 + pd.Timedelta(hours=1)
+        for codec, fn in written.items():
+            _, samples = benchlib.measure(
+                lambda: pq.read_table(fn).to_pandas(), args.repeat)
+            out.emit("trades.read", samples, rows=n, codec=codec)
+            result, samples = benchlib.measure(
+                lambda: pq.read_table(
+                    fn, columns=["time", "price", "qty"],
+                    filters=[("time", ">=", t0), ("time", "<", t1)],
+                ).to_pandas(),
+                args.repeat)
+            out.emit("trades.read_pushdown", samples, rows=n, codec=codec,
+                     rows_out=len(result))
+
+    if "cache" in args.stages:
+        bench_cache(out, args, df, n, workdir)
+
+    if "fetch" in args.stages and n <= args.fetch_max:
+        with fake_binance.FakeBinanceServer(trades) as server:
+            trades_tool.api = server.url
+            with contextlib.redirect_stdout(sys.stderr):
+                result, samples = benchlib.measure(
+                    lambda: trades_tool.fetch_trades_for_date(bench_symbol,
+                                                              bench_date),
+                    args.repeat)
+            out.emit("trades.fetch", samples, rows=n, rows_out=len(result),
+                     requests=server.request_count // args.repeat,
+                     bytes=server.bytes_sent // args.repeat)
+
+
+def bench_cache(out, args, df, n: int, workdir: str):
+    common = sys.modules["common"]
+    sid = common.build_assetid(bench_symbol, "BNC", is_cash=True)
+    upto = bench_date + dt.timedelta(days=1)
+    with benchlib.home_dir(workdir):
+        common.save_dateframe(bench_symbol, bench_date, df, sid, "binance",
+                              "trades")
+        _, samples = benchlib.measure(
+            lambda: qsec.marketdata.load(sid, bench_date, upto), args.repeat)
+        out.emit("trades.load", samples, rows=n)
+
+        disk = qsec.cache.DiskCache(os.path.join(workdir, "cache"))
+        _, samples = benchlib.measure(
+            lambda: (disk.clear(),
+                     qsec.marketdata.load(sid, bench_date, upto, cache=disk)),
+            args.repeat)
+        out.emit("trades.load_disk_cache_cold", samples, rows=n)
+        _, samples = benchlib.measure(
+            lambda: qsec.marketdata.load(sid, bench_date, upto, cache=disk),
+            args.repeat)
+        out.emit("trades.load_disk_cache", samples, rows=n,
+                 cache_bytes=disk.size_bytes())
+
+        memory = qsec.cache.MemoryCache()
+        _, samples = benchlib.measure(
+            lambda: qsec.marketdata.load(sid, bench_date, upto, cache=memory),
+            args.repeat)
+        out.emit("trades.load_memory_cache", samples, rows=n,
+                 **memory.stats())
+
+
+def bench_klines(out, args, bars_tool, days: int):
+    interval = "1m"
+    start = qsec.time.date_to_epoch_ms(bench_date)
+    end = start + days * fake_binance.DAY_MS
+    step = fake_binance.KLINE_INTERVAL_MS[interval]
+    rows = fake_binance.kline_rows(start, end - 1, interval, (end - start) // step)
+    n = len(rows)
+    pages = [json.dumps(rows[i:i + 1000]).encode() for i in range(0, n, 1000)]
+    del rows
+
+    dfs, samples = benchlib.measure(lambda: decode_pages(pages), args.repeat)
+    out.emit("klines.decode", samples, rows=n, interval=interval,
+             bytes=sum(len(p) for p in pages))
+    raw_df = pd.concat(dfs)
+    _, samples = benchlib.measure(lambda: bars_tool.normalise_klines(raw_df),
+                                  args.repeat)
+    out.emit("klines.normalise", samples, rows=n, interval=interval)
+
+    if "fetch" in args.stages and days == 1:
+        with fake_binance.FakeBinanceServer() as server:
+            bars_tool.api = server.url
+            result, samples = benchlib.measure(
+                lambda: bars_tool.fetch_klines_for_date(bench_symbol, bench_date,
+                                                        interval),
+                args.repeat)
+            out.emit("klines.fetch", samples, rows=n, rows_out=len(result),
+                     interval=interval,
+                     requests=server.request_count // args.repeat)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", type=str, default="1k,10k,100k",
+        help="comma separated trades-per-day sizes, e.g. 1k,100k,1M,10M",
+    )
+    parser.add_argument(
+        "--kline-days", dest="kline_days", type=str, default="1,30",
+        help="comma separated number of days of 1m bars",
+    )
+    parser.add_argument(
+        "--stages", type=str, default=",".join(all_stages),
+        help="comma separated stages to run; any of {}".format(all_stages),
+    )
+    parser.add_argument(
+        "--codecs", type=str, default=",".join(all_codecs),
+        help="comma separated parquet compression codecs",
+    )
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="repetitions per measurement, best is reported")
+    parser.add_argument(
+        "--fetch-max", dest="fetch_max", type=str, default="1M",
+        help="largest size to run the full fetch stage for",
+    )
+    parser.add_argument("--output", type=str, default=None,
+                        help="append JSON lines to file, rather than stdout")
+    args = parser.parse_args()
+    args.sizes = [benchlib.parse_size(s) for s in args.sizes.split(",")]
+    args.kline_days = [int(s) for s in args.kline_days.split(",") if s]
+    args.stages = set(args.stages.split(","))
+    args.codecs = [c.upper() for c in args.codecs.split(",") if c]
+    args.fetch_max = benchlib.parse_size(args.fetch_max)
+    unknown = args.stages - set(all_stages)
+    if unknown:
+        parser.error("unknown stages: {}".format(sorted(unknown)))
+    return args
+
+
+def main():
+    args = parse_args()
+    trades_tool = benchlib.load_tool("binance-fetch-trades")
+    bars_tool = benchlib.load_tool("binance-fetch-bars")
+    out = benchlib.ResultWriter(args.output)
+    try:
+        with tempfile.TemporaryDirectory(prefix="qsec-bench-") as workdir:
+            for n in args.sizes:
+                bench_trades(out, args, trades_tool, n, workdir)
+            if "klines" in args.stages:
+                for days in args.kline_days:
+                    bench_klines(out, args, bars_tool, days)
+    finally:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import benchlib
+
+
+# Startup-time benchmark for the command line tools.  Each tool is run with
+# --help, which exercises module import and argument parsing only, and its
+# wall time is compared with a bare interpreter start.  The tools must not
+# import any of the heavy dependencies before they are needed; the run fails
+# (exit code 1) if one does, or if startup overhead exceeds the budget.
+#
+#   python bench/bench-startup.py --budget-ms 100 --output bench.jsonl
+
+heavy_modules = ["numpy", "pandas", "pyarrow", "requests"]
+
+# Print which heavy modules get imported by loading a tool as a module
+probe = """
+import importlib.util, json, sys
+sys.argv = [sys.argv[1]]
+spec = importlib.util.spec_from_file_location("tool", sys.argv[0])
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+print(json.dumps(sorted(m for m in {heavy} if m in sys.modules)))
+"""
+
+
+def child_env() -> dict:
+    env = dict(os.environ)
+    paths = [benchlib.qsec_home, benchlib.tools_dir]
+    if env.get("PYTHONPATH"):
+        paths.append(env["PYTHONPATH"])
+    env["PYTHONPATH"] = os.pathsep.join(paths)
+    return env
+
+
+def wall_times(cmd: list, repeat: int, env: dict) -> list:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       env=env, check=True)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def top_imports(tool: str, env: dict, n: int = 5) -> list:
+    # parse 'python -X importtime' for the slowest top-level imports
+    out = subprocess.run([sys.executable, "-X", "importtime", tool, "--help"],
+                         capture_output=True, text=True, env=env)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        rows.append((int(cumulative), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "ms": round(us / 1000.0, 2)} for us, name in rows[:n]]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs per tool, the median is reported")
+    parser.add_argument(
+        "--budget-ms", dest="budget_ms", type=float, default=100.0,
+        help="allowed startup overhead over a bare interpreter, in ms",
+    )
+    parser.add_argument("--output", type=str, default=None,
+                        help="append JSON lines to file, rather than stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    env = child_env()
+    out = benchlib.ResultWriter(args.output)
+    failures = []
+    try:
+        bare = wall_times([sys.executable, "-c", "pass"], args.repeat, env)
+        out.emit("startup.python", bare)
+        baseline = statistics.median(bare)
+
+        for tool in sorted(glob.glob(os.path.join(benchlib.tools_dir, "*-*.py"))):
+            name = os.path.basename(tool)[:-3]
+            samples = wall_times([sys.executable, tool, "--help"], args.repeat,
+                                 env)
+            overhead_ms = round((statistics.median(samples) - baseline) * 1000, 1)
+            loaded = subprocess.run(
+                [sys.executable, "-c", probe.format(heavy=heavy_modules), tool],
+                capture_output=True, text=True, env=env, check=True,
+            )
+            loaded = json.loads(loaded.stdout.strip().splitlines()[-1])
+            out.emit("startup.tool", samples, tool=name,
+                     overhead_ms=overhead_ms, heavy_imports=loaded,
+                     top_imports=top_imports(tool, env))
+            if loaded:
+                failures.append(f"{name}: imports {loaded} at load time")
+            if overhead_ms > args.budget_ms:
+                failures.append(
+                    f"{name}: startup overhead {overhead_ms}ms exceeds "
+                    f"budget of {args.budget_ms}ms"
+                )
+    finally:
+        out.close()
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import contextlib
+import datetime as dt
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+# Helpers shared by the benchmark scripts: loading the tools as modules,
+# timing, and writing results as JSON lines for tracking over time.
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+qsec_home = os.path.dirname(bench_dir)
+tools_dir = os.path.join(qsec_home, "tools")
+
+if qsec_home not in sys.path:
+    sys.path.insert(0, qsec_home)
+
+
+def load_tool(name: str):
+    """Import a tools/ script (e.g. 'binance-fetch-trades') as a module"""
+    if tools_dir not in sys.path:
+        sys.path.insert(0, tools_dir)
+    fn = os.path.join(tools_dir, f"{name}.py")
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), fn)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_size(s: str) -> int:
+    s = s.strip().lower()
+    for suffix, mult in [("k", 1000), ("m", 1000000)]:
+        if s.endswith(suffix):
+            return int(float(s[:-1]) * mult)
+    return int(float(s))
+
+
+def git_revision():
+    try:
+        out = subprocess.run(
+            ["git", "-C", qsec_home, "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=10,
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_info() -> dict:
+    info = {
+        "utc": dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "git": git_revision(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+    }
+    for mod in ["numpy", "pandas", "pyarrow", "requests"]:
+        if mod in sys.modules:
+            info[mod] = getattr(sys.modules[mod], "__version__", None)
+    return info
+
+
+class Stopwatch:
+    def __init__(self):
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed += time.perf_counter() - self._t0
+
+
+def measure(fn, repeat: int = 1):
+    """Call fn() `repeat` times, returning (last result, list of seconds)"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - t0)
+    return result, samples
+
+
+class ResultWriter:
+    """Write one JSON object per benchmark measurement"""
+
+    def __init__(self, fn: str = None):
+        self._fn = fn
+        self._stream = open(fn, "a") if fn else sys.stdout
+        self.run = run_info()
+
+    def emit(self, stage: str, samples: list, **fields):
+        record = {"stage": stage, **fields}
+        record["seconds"] = min(samples)
+        record["median"] = statistics.median(samples)
+        record["repeat"] = len(samples)
+        rows = fields.get("rows")
+        if rows and record["seconds"] > 0:
+            record["rows_per_sec"] = round(rows / record["seconds"], 1)
+        record["run"] = self.run
+        self._stream.write(json.dumps(record) + "\n")
+        self._stream.flush()
+        print(
+            "{:<24} {:>10} {:>10.4f}s  {}".format(
+                stage, rows or "", record["seconds"],
+                " ".join(f"{k}={v}" for k, v in fields.items() if k != "rows"),
+            ),
+            file=sys.stderr,
+        )
+
+    def close(self):
+        if self._fn:
+            self._stream.close()
+
+
+@contextlib.contextmanager
+def home_dir(path: str):
+    # MDHOME lives under the user's home directory, so redirect HOME to keep
+    # benchmark output away from real data
+    saved = os.environ.get("HOME")
+    os.environ["HOME"] = path
+    try:
+        yield
+    finally:
+        if saved is None:
+            del os.environ["HOME"]
+        else:
+            os.environ["HOME"] = saved
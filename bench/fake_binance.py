@@ -0,0 +1,204 @@
+import json
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+
+# A local stand-in for the Binance REST endpoints used by the fetch tools.
+# Only the aggTrades and klines endpoints are served, and only with the
+# parameters the tools actually send.  Data is synthetic but shaped like the
+# real replies, so the tools can be run end-to-end without network access.
+
+DAY_MS = 24 * 60 * 60 * 1000
+FIRST_TRADE_ID = 1000000000
+FIRST_FILL_ID = 5000000000
+
+KLINE_INTERVAL_MS = {
+    "1m": 60 * 1000,
+    "3m": 3 * 60 * 1000,
+    "5m": 5 * 60 * 1000,
+    "15m": 15 * 60 * 1000,
+    "30m": 30 * 60 * 1000,
+    "1h": 60 * 60 * 1000,
+    "2h": 2 * 60 * 60 * 1000,
+    "4h": 4 * 60 * 60 * 1000,
+    "6h": 6 * 60 * 60 * 1000,
+    "8h": 8 * 60 * 60 * 1000,
+    "12h": 12 * 60 * 60 * 1000,
+    "1d": DAY_MS,
+    "3d": 3 * DAY_MS,
+    "1w": 7 * DAY_MS,
+}
+
+
+class TradeDay:
+    """Synthetic aggTrade history for one UTC day.
+
+    A number of padding trades are generated in the hour either side of the
+    day, because the fetch tools detect the end of a day by reading past it.
+    """
+
+    def __init__(self, day_start_ms: int, n_trades: int, padding: int = 2000,
+                 seed: int = 1):
+        rng = np.random.default_rng(seed)
+        one_hour = 60 * 60 * 1000
+        day_end_ms = day_start_ms + DAY_MS
+        self.day_start_ms = day_start_ms
+        self.day_end_ms = day_end_ms
+        self.n_trades = n_trades
+        self.padding = padding
+        times = [
+            rng.integers(day_start_ms - one_hour, day_start_ms, padding),
+            rng.integers(day_start_ms, day_end_ms, n_trades),
+            rng.integers(day_end_ms, day_end_ms + one_hour, padding),
+        ]
+        self.T = np.concatenate([np.sort(t) for t in times])
+        total = len(self.T)
+        self.a = np.arange(FIRST_TRADE_ID, FIRST_TRADE_ID + total)
+        self.p = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 1e-4, total)))
+        self.q = np.round(rng.exponential(0.5, total), 5)
+        self.m = rng.random(total) < 0.5
+        fills = rng.integers(1, 4, total)
+        self.l = FIRST_FILL_ID + np.cumsum(fills)
+        self.f = self.l - fills + 1
+
+    def __len__(self):
+        return len(self.a)
+
+    def day_slice(self):
+        return self.padding, self.padding + self.n_trades
+
+    def rows(self, lo: int, hi: int) -> list:
+        return [
+            {"a": a, "p": "%.8f" % p, "q": "%.8f" % q, "f": f, "l": l, "T": T,
+             "m": m, "M": True}
+            for a, p, q, f, l, T, m in zip(
+                self.a[lo:hi].tolist(),
+                self.p[lo:hi].tolist(),
+                self.q[lo:hi].tolist(),
+                self.f[lo:hi].tolist(),
+                self.l[lo:hi].tolist(),
+                self.T[lo:hi].tolist(),
+                self.m[lo:hi].tolist(),
+            )
+        ]
+
+    def page(self, lo: int, hi: int) -> bytes:
+        return json.dumps(self.rows(lo, hi)).encode()
+
+    def iter_day_pages(self, limit: int = 1000):
+        # yield the raw json pages covering just the day, as fetched by ID walk
+        lo, hi = self.day_slice()
+        for i in range(lo, hi, limit):
+            yield self.page(i, min(i + limit, hi))
+
+    def agg_trades(self, params: dict) -> bytes:
+        limit = min(int(params.get("limit", 500)), 1000)
+        if "fromId" in params:
+            lo = int(np.searchsorted(self.a, int(params["fromId"]), "left"))
+            hi = lo + limit
+        elif "startTime" in params:
+            lo = int(np.searchsorted(self.T, int(params["startTime"]), "left"))
+            hi = lo + limit
+            if "endTime" in params:
+                hi = min(hi, int(np.searchsorted(self.T, int(params["endTime"]),
+                                                 "right")))
+        else:
+            hi = len(self)
+            lo = max(0, hi - limit)
+        return self.page(lo, min(hi, len(self)))
+
+
+def kline_rows(start_ms: int, end_ms: int, interval: str, limit: int,
+               seed: int = 1) -> list:
+    step = KLINE_INTERVAL_MS[interval]
+    first = ((start_ms + step - 1) // step) * step
+    open_times = np.arange(first, end_ms + 1, step, dtype=np.int64)[:limit]
+    n = len(open_times)
+    rng = np.random.default_rng(seed + first)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 1e-3, n)))
+    open_ = np.concatenate([[100.0], close[:-1]])
+    spread = np.abs(rng.normal(0.0, 1e-3, n)) * close
+    high = np.maximum(open_, close) + spread
+    low = np.minimum(open_, close) - spread
+    volume = rng.exponential(50.0, n)
+    taker = volume * rng.random(n)
+    trades = rng.integers(1, 500, n)
+    return [
+        [t, "%.8f" % o, "%.8f" % h, "%.8f" % lo, "%.8f" % c, "%.8f" % v,
+         t + step - 1, "%.8f" % (v * c), nt, "%.8f" % tb, "%.8f" % (tb * c), "0"]
+        for t, o, h, lo, c, v, nt, tb in zip(
+            open_times.tolist(), open_.tolist(), high.tolist(), low.tolist(),
+            close.tolist(), volume.tolist(), trades.tolist(), taker.tolist())
+    ]
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = dict(parse_qsl(url.query))
+            if url.path.endswith("/aggTrades") and server.trades is not None:
+                body = server.trades.agg_trades(params)
+            elif url.path.endswith("/klines"):
+                limit = min(int(params.get("limit", 500)), 1500)
+                body = json.dumps(kline_rows(
+                    int(params["startTime"]), int(params["endTime"]),
+                    params.get("interval", "1m"), limit)).encode()
+            else:
+                self.send_error(404)
+                return
+            with server.lock:
+                server.request_count += 1
+                server.bytes_sent += len(body)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class FakeBinanceServer:
+    """Serve a TradeDay (and synthetic klines) over HTTP on localhost."""
+
+    def __init__(self, trades: TradeDay = None, host: str = "127.0.0.1",
+                 port: int = 0):
+        self.trades = trades
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.bytes_sent = 0
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset_counters(self):
+        with self.lock:
+            self.request_count = 0
+            self.bytes_sent = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -6,22 +6,9 @@ script_dir=$(dirname "$(realpath -s "$0")")
 
 qsec_home=$(dirname "$script_dir")
 
-rm -v -f \
-   binance_exchange-info.json \
-   binance_usdfut_exchange-info.json \
-   binance_coinfut_exchange-info.json \
-   binance_assets.csv
-
 export PYTHONPATH="${qsec_home}"
 
-python ${qsec_home}/qsec/data/binance/fetch_binance_refdata.py
-python ${qsec_home}/qsec/data/binance/parse_binance_refdata.py
-
-# install into MDHOME
-
-path=~/MDHOME/ref/assets/$(date +%Y%m%d)/assets-$(date +%Y%m%d).csv
-lnk=~/MDHOME/ref/assets/latest
-
-mkdir -p $(dirname $path)
-cp -v binance_assets.csv $path
-cd ~/MDHOME/ref/assets && ln -vsnf $path assets-latest.csv
+# Fetch exchangeInfo for all venues concurrently and, if any symbol changed,
+# install a new snapshot under ~/MDHOME/ref/assets and extend the history.
+# Pass --force to rebuild today's snapshot regardless.
+python ${qsec_home}/qsec/data/binance/refresh_binance_refdata.py "$@"
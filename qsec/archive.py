@@ -0,0 +1,119 @@
+import datetime as dt
+import fnmatch
+import gzip
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import qsec.time
+
+
+# Archive of the raw REST replies behind each stored day, so the day can be
+# rebuilt, e.g. after a change to a tool's normalisation, without fetching it
+# again.
+#
+# Pages are stored gzip compressed and content addressed, under the sha256 of
+# the reply text, so a page fetched twice is kept once:
+#
+#   {root}/objects/{sha[:2]}/{sha}.json.gz
+#
+# and each day has a manifest listing its pages, in order, with the request
+# window of each:
+#
+#   {root}/days/{dtype}/{venue}/{symbol}/{YYYYMMDD}.json
+
+
+def _write_atomic(fn: str, data: bytes):
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp = f"{fn}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, fn)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class RawArchive:
+    def __init__(self, root: str = None):
+        self.root = root or f"{Path.home()}/MDHOME/raw"
+
+    def object_filename(self, digest: str) -> str:
+        return f"{self.root}/objects/{digest[:2]}/{digest}.json.gz"
+
+    def manifest_filename(self, venue: str, dtype: str, symbol: str,
+                          date: dt.date) -> str:
+        return "{}/days/{}/{}/{}/{}.json".format(
+            self.root, dtype, venue, symbol, date.strftime("%Y%m%d"))
+
+    def _put(self, raw: str) -> str:
+        data = raw.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        fn = self.object_filename(digest)
+        if not os.path.exists(fn):
+            _write_atomic(fn, gzip.compress(data, compresslevel=6))
+        return digest
+
+    def _get(self, digest: str) -> str:
+        with open(self.object_filename(digest), "rb") as f:
+            return gzip.decompress(f.read()).decode()
+
+    def store(self, venue: str, dtype: str, symbol: str, date: dt.date,
+              pages: list, **meta):
+        """Archive a day's pages, a list of (lo, hi, raw), replacing any
+        previous manifest for the day.  `meta` (e.g. sid) is kept with it."""
+        manifest = {
+            "venue": venue,
+            "dtype": dtype,
+            "symbol": symbol,
+            "date": date.strftime("%Y%m%d"),
+            **meta,
+            "fetched": qsec.time.now_epoch_ms(),
+            "pages": [
+                {"lo": int(lo), "hi": int(hi), "sha256": self._put(raw)}
+                for lo, hi, raw in pages
+            ],
+        }
+        fn = self.manifest_filename(venue, dtype, symbol, date)
+        _write_atomic(fn, json.dumps(manifest).encode())
+
+    def manifest(self, venue: str, dtype: str, symbol: str,
+                 date: dt.date) -> dict:
+        with open(self.manifest_filename(venue, dtype, symbol, date)) as f:
+            return json.load(f)
+
+    def load(self, manifest: dict) -> list:
+        """The (lo, hi, raw) pages of a day's manifest"""
+        return [(p["lo"], p["hi"], self._get(p["sha256"]))
+                for p in manifest["pages"]]
+
+    def days(self, venue: str = "*", dtype: str = "*", symbol: str = "*",
+             from_date: dt.date = None, upto_date: dt.date = None) -> list:
+        """Manifests matching the (glob) patterns, for dates in [from, upto)"""
+        found = []
+        top = f"{self.root}/days"
+        for dirpath, _, filenames in os.walk(top):
+            parts = os.path.relpath(dirpath, top).split(os.sep)
+            if len(parts) != 3:
+                continue
+            p_dtype, p_venue, p_symbol = parts
+            if not (fnmatch.fnmatch(p_dtype, dtype)
+                    and fnmatch.fnmatch(p_venue, venue)
+                    and fnmatch.fnmatch(p_symbol, symbol)):
+                continue
+            for name in sorted(filenames):
+                if not name.endswith(".json"):
+                    continue
+                date = qsec.time.to_date(name[:-len(".json")])
+                if from_date is not None and date < from_date:
+                    continue
+                if upto_date is not None and date >= upto_date:
+                    continue
+                with open(os.path.join(dirpath, name)) as f:
+                    found.append(json.load(f))
+        found.sort(key=lambda m: (m["dtype"], m["venue"], m["symbol"], m["date"]))
+        return found
@@ -0,0 +1,105 @@
+import qsec.lazy
+import qsec.time
+
+np = qsec.lazy.lazy_import("numpy")
+pd = qsec.lazy.lazy_import("pandas")
+
+
+# Roll-up of stored bars into bars of a coarser interval, so that only the
+# finest resolution, 1m, has to be fetched and the rest can be derived.
+#
+# Bars are as written by the fetch tools' normalise_klines: indexed by close
+# time, with the columns below.  A coarser bar covers the bars opening within
+# its interval: open and close are taken from the first and last of them,
+# high and low are the extremes, and volumes and trade counts are summed.
+# Each of these is associative, so a coarse interval can be built from any
+# finer one that divides it (1w from 1d, 1d from 1h, ...), and rolling up a
+# pyramid of intervals, each from the previous, gives the same bars as
+# rolling each up from 1m.
+
+columns = [
+    "openTime",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "closeTime",
+    "quoteAssetVolume",
+    "numberOfTrades",
+    "takerBuyBaseAssetVolume",
+    "takerBuyQuoteAssetVolume",
+]
+
+sum_columns = [
+    "volume",
+    "quoteAssetVolume",
+    "numberOfTrades",
+    "takerBuyBaseAssetVolume",
+    "takerBuyQuoteAssetVolume",
+]
+
+# intervals that can be derived from 1m bars, finest first
+derived_intervals = [i for i in qsec.time.KLINE_INTERVALS if i not in ("1s", "1m")]
+
+
+def divides(source: str, interval: str) -> bool:
+    """Whether each bar of `interval` is a union of whole `source` bars"""
+    if source == interval or source == "1M":
+        return False
+    step = qsec.time.interval_ms(source)
+    if interval == "1M":
+        return qsec.time.DAY_MS % step == 0
+    offset = qsec.time.WEEK_OFFSET_MS if interval == "1w" else 0
+    return qsec.time.interval_ms(interval) % step == 0 and offset % step == 0
+
+
+def source_interval(interval: str, available) -> str:
+    """The coarsest of the `available` intervals that `interval` can be
+    rolled up from"""
+    found = [s for s in available if divides(s, interval)]
+    if not found:
+        raise Exception(f"cannot derive '{interval}' bars from {list(available)}")
+    return max(found, key=qsec.time.interval_ms)
+
+
+def rollup(df: "pd.DataFrame", interval: str) -> "pd.DataFrame":
+    """Roll bars, sorted by time, up into bars of a coarser interval"""
+    if df.empty:
+        return df[columns].iloc[0:0]
+    opens = qsec.time.datetime64_to_epoch_ms(df["openTime"].values)
+    buckets = qsec.time.interval_floor(opens, interval)
+    starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+    ends = np.append(starts[1:], len(buckets)) - 1
+    bar_opens = buckets[starts]
+    time_dtype = df["openTime"].dtype
+    close_times = qsec.time.epoch_ms_to_datetime64(
+        qsec.time.interval_add(bar_opens, interval, 1) - 1).astype(time_dtype)
+    out = {
+        "openTime": qsec.time.epoch_ms_to_datetime64(bar_opens).astype(time_dtype),
+        "open": df["open"].values[starts],
+        "high": np.maximum.reduceat(df["high"].values, starts),
+        "low": np.minimum.reduceat(df["low"].values, starts),
+        "close": df["close"].values[ends],
+        "closeTime": close_times,
+    }
+    for col in sum_columns:
+        out[col] = np.add.reduceat(df[col].values, starts)
+    return pd.DataFrame(
+        {col: out[col] for col in columns},
+        index=pd.Index(close_times, name="time"),
+    )
+
+
+def missing_source_bars(bars: "pd.DataFrame", source: "pd.DataFrame",
+                        source_interval: str) -> "np.ndarray":
+    """For each of `bars`, the number of `source_interval` bars within it
+    that are absent from `source`"""
+    if bars.empty:
+        return np.zeros(0, dtype=np.int64)
+    opens = qsec.time.datetime64_to_epoch_ms(bars["openTime"].values)
+    ends = qsec.time.datetime64_to_epoch_ms(bars["closeTime"].values) + 1
+    source_opens = qsec.time.datetime64_to_epoch_ms(source["openTime"].values)
+    found = (np.searchsorted(source_opens, ends)
+             - np.searchsorted(source_opens, opens))
+    return (ends - opens) // qsec.time.interval_ms(source_interval) - found
@@ -0,0 +1,317 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import qsec.lazy
+import qsec.metrics
+
+pa = qsec.lazy.lazy_import("pyarrow")
+
+
+# Caches for tables read from MDHOME, for use with qsec.marketdata.load.
+#
+# DiskCache keeps uncompressed Arrow IPC (Feather v2) copies of the GZIP
+# parquet files.  Later reads memory map the copy, which is zero-copy into
+# Arrow, instead of decompressing and decoding the parquet again.  Entries are
+# keyed on the checksum of the source file and the columns read, so a
+# rewritten source file is never served stale.  Total size, including the
+# small files remembering source checksums, is kept within a disk budget by
+# evicting the least recently used files.  The size is counted once per
+# process and then tracked as files are added; the cache is only scanned
+# again to evict, when the budget is crossed, and then down to a fraction of
+# it, so a full cache is not scanned on every miss.
+#
+# MemoryCache keeps decoded tables in process, within a byte budget, so that
+# code loading overlapping windows, such as a parameter sweep, decodes each
+# file once.  Its misses can be served from a DiskCache.
+
+
+def _sha256_file(fn: str) -> str:
+    h = hashlib.sha256()
+    with open(fn, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _write_atomic(fn: str, write):
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp = f"{fn}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        write(tmp)
+        os.replace(tmp, fn)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class DiskCache:
+    """Memory-mapped Arrow IPC copies of parquet files, within a disk budget"""
+
+    suffix = ".arrow"
+
+    # eviction removes files until the cache is within this fraction of the
+    # budget
+    evict_fraction = 0.9
+
+    def __init__(self, root: str = None, budget_bytes: int = 10 * 2**30):
+        self.root = root or f"{Path.home()}/MDHOME/cache/arrow"
+        self.budget_bytes = budget_bytes
+        self.hits = 0
+        self.misses = 0
+        self._sums = {}
+        # bytes on disk, as last counted plus those added since; None until
+        # first counted
+        self._total = None
+        self._lock = threading.Lock()
+
+    def checksum(self, fn: str) -> str:
+        """sha256 of a source file, recomputed only when its stat changes.
+
+        Checksums are remembered in memory and in a small file per source
+        under the cache root, so they survive across processes.
+        """
+        path = os.path.realpath(fn)
+        st = os.stat(path)
+        stamp = [st.st_mtime_ns, st.st_size]
+        with self._lock:
+            known = self._sums.get(path)
+        if known is not None and known[0] == stamp:
+            return known[1]
+        memo = "{}/sums/{}.json".format(
+            self.root, hashlib.sha1(path.encode()).hexdigest()
+        )
+        try:
+            with open(memo) as f:
+                saved = json.load(f)
+            checksum = saved["sha256"] if saved["stamp"] == stamp else None
+            if checksum is not None:
+                # its mtime records its last use, as for entries
+                os.utime(memo)
+        except (OSError, ValueError, KeyError):
+            checksum = None
+        if checksum is None:
+            checksum = _sha256_file(path)
+
+            def write(tmp):
+                with open(tmp, "w") as f:
+                    json.dump({"path": path, "stamp": stamp, "sha256": checksum}, f)
+
+            _write_atomic(memo, write)
+            self._added(memo)
+        with self._lock:
+            self._sums[path] = (stamp, checksum)
+        return checksum
+
+    def entry_filename(self, checksum: str, columns: list = None) -> str:
+        key = json.dumps([checksum, columns])
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f"{self.root}/{digest[:2]}/{digest}{self.suffix}"
+
+    def read(self, fn: str, columns: list = None, loader=None) -> "pa.Table":
+        """Return the table for a source file, loading it with
+        `loader(fn, columns)` and storing a copy on a miss"""
+        entry = self.entry_filename(self.checksum(fn), columns)
+        try:
+            table = self._map(entry)
+            # the entry's mtime records its last use, for LRU eviction
+            os.utime(entry)
+        except FileNotFoundError:
+            # absent, or evicted by another process meanwhile
+            pass
+        else:
+            with self._lock:
+                self.hits += 1
+            qsec.metrics.inc("cache_hits_total", cache="disk")
+            return table
+
+        with self._lock:
+            self.misses += 1
+        qsec.metrics.inc("cache_misses_total", cache="disk")
+        table = loader(fn, columns)
+        self._store(entry, table)
+        self._added(entry)
+        if self._over_budget():
+            self.evict()
+        return table
+
+    def _map(self, entry: str) -> "pa.Table":
+        source = pa.memory_map(entry, "r")
+        return pa.ipc.open_file(source).read_all()
+
+    def _store(self, entry: str, table: "pa.Table"):
+        def write(tmp):
+            with pa.OSFile(tmp, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+        _write_atomic(entry, write)
+        logging.debug("cached %d rows in '%s'", table.num_rows, entry)
+
+    def _added(self, fn: str):
+        try:
+            size = os.path.getsize(fn)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._total is not None:
+                self._total += size
+
+    def _over_budget(self) -> bool:
+        with self._lock:
+            total = self._total
+        if total is None:
+            total = self.size_bytes()
+            with self._lock:
+                self._total = total
+        return total > self.budget_bytes
+
+    def entries(self) -> list:
+        """(mtime, size, filename) of each entry and checksum file, oldest
+        first"""
+        found = []
+        sums = os.path.join(self.root, "sums")
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not (name.endswith(self.suffix)
+                        or (dirpath == sums and name.endswith(".json"))):
+                    continue
+                fn = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(fn)
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_mtime, st.st_size, fn))
+        found.sort()
+        return found
+
+    def size_bytes(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove least recently used files until within evict_fraction of
+        the budget"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.budget_bytes:
+            with self._lock:
+                self._total = total
+            return
+        target = self.budget_bytes * self.evict_fraction
+        for _, size, fn in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(fn)
+            except FileNotFoundError:
+                pass
+            total -= size
+            qsec.metrics.inc("cache_evictions_total", cache="disk")
+            logging.debug("evicted '%s' from cache", fn)
+        with self._lock:
+            self._total = total
+
+    def clear(self):
+        for _, _, fn in self.entries():
+            os.remove(fn)
+        with self._lock:
+            self._total = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class MemoryCache:
+    """In-process LRU cache of decoded tables, within a byte budget.
+
+    Entries are keyed on the source file's path, mtime and size, and the
+    columns read, so a rewritten file is reloaded.  If `backing` is given,
+    e.g. a DiskCache, misses are read through it.
+    """
+
+    def __init__(self, budget_bytes: int = 2 * 2**30, backing=None):
+        self.budget_bytes = budget_bytes
+        self.backing = backing
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(fn: str, columns: list = None) -> tuple:
+        path = os.path.realpath(fn)
+        st = os.stat(path)
+        return path, st.st_mtime_ns, st.st_size, tuple(columns or ())
+
+    def read(self, fn: str, columns: list = None, loader=None) -> "pa.Table":
+        key = self.key(fn, columns)
+        with self._lock:
+            table = self._entries.get(key)
+            if table is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if table is not None:
+            qsec.metrics.inc("cache_hits_total", cache="memory")
+            return table
+
+        with self._lock:
+            self.misses += 1
+        qsec.metrics.inc("cache_misses_total", cache="memory")
+        if self.backing is not None:
+            table = self.backing.read(fn, columns, loader)
+        else:
+            table = loader(fn, columns)
+        self._insert(key, table)
+        return table
+
+    def _insert(self, key: tuple, table: "pa.Table"):
+        size = table.nbytes
+        if size > self.budget_bytes:
+            return
+        with self._lock:
+            # drop this entry and any for an older version of the file
+            stale = [
+                k for k in self._entries
+                if k[0] == key[0] and k[3] == key[3]
+            ]
+            for k in stale:
+                self.nbytes -= self._entries.pop(k).nbytes
+            self._entries[key] = table
+            self.nbytes += size
+            evicted = 0
+            while self.nbytes > self.budget_bytes:
+                _, victim = self._entries.popitem(last=False)
+                self.nbytes -= victim.nbytes
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            qsec.metrics.inc("cache_evictions_total", evicted, cache="memory")
+        qsec.metrics.gauge("cache_bytes", self.nbytes, cache="memory")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+            }
@@ -0,0 +1,252 @@
+import datetime as dt
+import fnmatch
+import json
+import logging
+import os
+
+import qsec.lazy
+import qsec.marketdata
+import qsec.mdmap
+
+np = qsec.lazy.lazy_import("numpy")
+pa = qsec.lazy.lazy_import("pyarrow")
+pc = qsec.lazy.lazy_import("pyarrow.compute")
+pq = qsec.lazy.lazy_import("pyarrow.parquet")
+pd = qsec.lazy.lazy_import("pandas")
+
+
+# Daily summary statistics of the stored data, for screening a universe
+# without loading it.
+#
+# When a day file is written, a summary of it (volume, trade count, VWAP,
+# open/high/low/close, buy volume and imbalance) is stored with it, under
+# 'summary' in its 'qsec' metadata; a file of many assets (the UNIVERSE
+# layout) has one per asset, under 'summaries'.  panel() returns these for
+# many files as one DataFrame, from a catalog kept under MDHOME/catalog, one
+# parquet file per dtype and one row per file and asset.  A query refreshes
+# only the part of the catalog it asks for: it lists just the matching
+# directories, and reads the footers of only those files added or changed,
+# by mtime and size, since the catalog was last written.  Files stored before
+# summaries existed are summarised once, from their data.
+
+stats = [
+    "rows",
+    "trades",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "notional",
+    "vwap",
+    "buy_volume",
+    "imbalance",
+]
+
+
+def _first(column: "pa.ChunkedArray"):
+    return column[0].as_py()
+
+
+def _last(column: "pa.ChunkedArray"):
+    return column[len(column) - 1].as_py()
+
+
+def summarise(table: "pa.Table", dtype: str) -> dict:
+    """Summary statistics of a day's trades or bars, sorted by time"""
+    summary = dict.fromkeys(stats)
+    summary.update(rows=table.num_rows, trades=0, volume=0.0, notional=0.0)
+    if table.num_rows == 0:
+        return summary
+    if dtype == "trades":
+        price, qty = table["price"], table["qty"]
+        summary.update(
+            trades=table.num_rows,
+            open=_first(price),
+            high=pc.max(price).as_py(),
+            low=pc.min(price).as_py(),
+            close=_last(price),
+            volume=pc.sum(qty).as_py(),
+            notional=pc.sum(pc.multiply(price, qty)).as_py(),
+        )
+        if "side" in table.column_names:
+            buys = pc.if_else(pc.greater(table["side"], 0), qty, 0.0)
+            summary["buy_volume"] = pc.sum(buys).as_py()
+    elif dtype.startswith("bars"):
+        summary.update(
+            trades=pc.sum(table["numberOfTrades"]).as_py(),
+            open=_first(table["open"]),
+            high=pc.max(table["high"]).as_py(),
+            low=pc.min(table["low"]).as_py(),
+            close=_last(table["close"]),
+            volume=pc.sum(table["volume"]).as_py(),
+            notional=pc.sum(table["quoteAssetVolume"]).as_py(),
+            buy_volume=pc.sum(table["takerBuyBaseAssetVolume"]).as_py(),
+        )
+    else:
+        return summary
+    volume = summary["volume"]
+    if volume:
+        summary["vwap"] = summary["notional"] / volume
+        if summary["buy_volume"] is not None:
+            summary["imbalance"] = (2 * summary["buy_volume"] - volume) / volume
+    return summary
+
+
+def summary_meta(table: "pa.Table", dtype: str) -> dict:
+    """The summary metadata of a day file: {'summary': ...}, or, for a file
+    of many assets with an 'assetid' column, {'summaries': {assetid: ...}}"""
+    if "assetid" not in table.column_names:
+        return {"summary": summarise(table, dtype)}
+    # a stable sort, so each asset's rows stay in time order
+    table = table.take(pc.sort_indices(table, [("assetid", "ascending")]))
+    summaries = {}
+    offset = 0
+    for v in pc.value_counts(table["assetid"]).to_pylist():
+        rows = table.slice(offset, v["counts"])
+        summaries[v["values"]] = summarise(rows, dtype)
+        offset += v["counts"]
+    return {"summaries": summaries}
+
+
+def catalog_filename(dtype: str) -> str:
+    return os.path.normpath(
+        "{}/../catalog/{}.parquet".format(qsec.marketdata.md_home(), dtype))
+
+
+columns = ["file", "venue", "assetid", "date", "mtime_ns", "size"] + stats
+
+
+def _frame(rows: list) -> "pd.DataFrame":
+    df = pd.DataFrame(rows, columns=columns)
+    df[stats[:2]] = df[stats[:2]].astype("int64")
+    df[stats[2:]] = df[stats[2:]].astype("float64")
+    return df
+
+
+def read(dtype: str) -> "pd.DataFrame":
+    """The catalog of a dtype as last written, one row per file and asset"""
+    fn = catalog_filename(dtype)
+    if not os.path.exists(fn):
+        return _frame([])
+    return pq.read_table(fn).to_pandas()
+
+
+def _read_summaries(item: "qsec.mdmap.Item") -> dict:
+    # {assetid: summary} of a file
+    schema = pq.read_schema(item.fn)
+    meta = json.loads((schema.metadata or {}).get(qsec.mdmap.metadata_key,
+                                                  b"{}"))
+    key = "summaries" if "assetid" in schema.names else "summary"
+    if key not in meta:
+        # stored before summaries were kept, or before they were kept per
+        # asset
+        meta = summary_meta(pq.read_table(item.fn), item.dtype)
+    if "summaries" in meta:
+        return meta["summaries"]
+    return {item.assetid: meta["summary"]}
+
+
+def _asset_dir(fn: str) -> str:
+    return os.path.basename(os.path.dirname(os.path.dirname(fn)))
+
+
+def refresh(dtype: str, venue: str = "*", assetid: str = "*",
+            from_date: dt.date = None, upto_date: dt.date = None
+            ) -> "pd.DataFrame":
+    """The catalog of a dtype, with the rows of the files matching the
+    (glob) patterns, for dates in [from, upto), brought up to date with
+    MDHOME; rows of other files are as last written.  Multi-asset files are
+    always included, as they may hold matching assets."""
+    fn = catalog_filename(dtype)
+    items = {}
+    for pattern in {assetid, qsec.marketdata.universe_assetid}:
+        for item in qsec.mdmap.find_items(dtype, venue, pattern, from_date,
+                                          upto_date):
+            items[item.fn] = item
+
+    def in_scope(row):
+        return (fnmatch.fnmatch(row["venue"], venue)
+                and (from_date is None or row["date"] >= from_date)
+                and (upto_date is None or row["date"] < upto_date)
+                and (fnmatch.fnmatch(_asset_dir(row["file"]), assetid)
+                     or _asset_dir(row["file"]) == qsec.marketdata.universe_assetid))
+
+    cached = {}
+    rows = []
+    removed = 0
+    for row in read(dtype).to_dict("records"):
+        if row["file"] in items:
+            cached.setdefault(row["file"], []).append(row)
+        elif in_scope(row):
+            removed += 1
+        else:
+            rows.append(row)
+    updated = 0
+    for item in items.values():
+        st = os.stat(item.fn)
+        stamp = [st.st_mtime_ns, st.st_size]
+        item_rows = cached.get(item.fn)
+        if (not item_rows
+                or [item_rows[0]["mtime_ns"], item_rows[0]["size"]] != stamp
+                or item_rows[0]["assetid"] == qsec.marketdata.universe_assetid):
+            item_rows = [
+                {
+                    "file": item.fn,
+                    "venue": item.venue,
+                    "assetid": asset,
+                    "date": item.date,
+                    "mtime_ns": st.st_mtime_ns,
+                    "size": st.st_size,
+                    **summary,
+                }
+                for asset, summary in _read_summaries(item).items()
+            ]
+            updated += 1
+        rows.extend(item_rows)
+    df = _frame(rows).sort_values(["file", "assetid"], ignore_index=True)
+    if updated or removed:
+        logging.info(f"catalog '{dtype}': {updated} of {len(items)} files "
+                     f"updated, {removed} rows removed")
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        qsec.mdmap.write_atomic(table, fn)
+    return df
+
+
+def panel(
+    dtype: str = "bars1m",
+    stat: str = None,
+    venue: str = "*",
+    assetid: str = "*",
+    from_date: dt.date = None,
+    upto_date: dt.date = None,
+    update: bool = True,
+) -> "pd.DataFrame":
+    """Summary statistics of the matching day files, for dates in [from,
+    upto), indexed by (date, assetid); or, if `stat` is given, that
+    statistic as a date x assetid panel.  venue and assetid are globs.
+    Unless `update` is false, the catalog is first refreshed for the
+    query."""
+    if update:
+        df = refresh(dtype, venue, assetid, from_date, upto_date)
+    else:
+        df = read(dtype)
+    keep = (df["venue"].map(lambda v: fnmatch.fnmatch(v, venue))
+            & df["assetid"].map(lambda a: fnmatch.fnmatch(a, assetid)))
+    if from_date is not None:
+        keep &= df["date"] >= from_date
+    if upto_date is not None:
+        keep &= df["date"] < upto_date
+    df = df.loc[keep]
+    # an asset both in its own file and a multi-asset file is taken from
+    # its own
+    multi = df["file"].map(_asset_dir) == qsec.marketdata.universe_assetid
+    df = df.iloc[np.argsort(multi.to_numpy(), kind="stable")]
+    df = df.drop_duplicates(["date", "assetid"])
+    df = df[["date", "assetid", "venue"] + stats]
+    df = df.set_index(["date", "assetid"]).sort_index()
+    if stat is not None:
+        return df[stat].unstack("assetid")
+    return df
+
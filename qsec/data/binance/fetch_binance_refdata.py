@@ -1,9 +1,10 @@
-import requests
 import json
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import qsec.logging
+import qsec.rest
 
 
 spot_api = "https://api.binance.com"
@@ -15,37 +16,51 @@ usdfut_path = "/fapi/v1/exchangeInfo"
 coinfut_api = "https://dapi.binance.com"
 coinfut_path = "/dapi/v1/exchangeInfo"
 
+# venue -> (api, path, local filename)
+venues = {
+    "binance": (spot_api, spot_path, "binance_exchange-info.json"),
+    "binance_usdfut": (usdfut_api, usdfut_path, "binance_usdfut_exchange-info.json"),
+    "binance_coinfut": (coinfut_api, coinfut_path, "binance_coinfut_exchange-info.json"),
+}
 
-def perform_http_request(api, path):
+
+def fetch_exchange_info(venue, etag=None):
+    """Fetch one venue's exchangeInfo, returning (content, etag).
+
+    If `etag` is given and the server reports the payload as unchanged, the
+    returned content is None.
+    """
+    api, path, _ = venues[venue]
     url = f"{api}{path}"
     logging.info("making HTTP GET request: {}".format(url))
-    reply = requests.get(url, params=None)
+    headers = {"If-None-Match": etag} if etag else None
+    reply = qsec.rest.request(url, endpoint=path, headers=headers)
+    if reply.status_code == 304:
+        logging.info("exchange info for '{}' not modified".format(venue))
+        return None, etag
+    return reply.content, reply.headers.get("ETag")
+
 
-    if reply.status_code != 200:
-        raise Exception("http request failed: {}".format(reply.status_code))
-    return reply.text
+def fetch_all_exchange_info(etags=None):
+    """Fetch exchangeInfo for all venues concurrently"""
+    etags = etags or {}
+    with ThreadPoolExecutor(max_workers=len(venues)) as pool:
+        futures = {
+            venue: pool.submit(fetch_exchange_info, venue, etags.get(venue))
+            for venue in venues
+        }
+        return {venue: future.result() for venue, future in futures.items()}
 
 
 def main():
     qsec.logging.init_logging()
 
-    reply = perform_http_request(usdfut_api, usdfut_path)
-    fn = "binance_usdfut_exchange-info.json"
-    logging.info("writing to file '{}'".format(fn))
-    with open(fn, "w") as f:
-        f.write(reply)
-
-    reply = perform_http_request(coinfut_api, coinfut_path)
-    fn = "binance_coinfut_exchange-info.json"
-    logging.info("writing to file '{}'".format(fn))
-    with open(fn, "w") as f:
-        f.write(reply)
-
-    reply = perform_http_request(spot_api, spot_path)
-    fn = "binance_exchange-info.json"
-    logging.info("writing to file '{}'".format(fn))
-    with open(fn, "w") as f:
-        f.write(reply)
+    replies = fetch_all_exchange_info()
+    for venue, (content, _) in replies.items():
+        fn = venues[venue][2]
+        logging.info("writing to file '{}'".format(fn))
+        with open(fn, "wb") as f:
+            f.write(content)
 
 
 if __name__ == "__main__":
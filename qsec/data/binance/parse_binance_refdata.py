@@ -1,73 +1,173 @@
 import json
 import logging
-import sys
-import pandas as pd
 
+import qsec.lazy
 import qsec.logging
 
-def parse_binance_spot_exchange_info(fn):
-    venue = "binance"
-    assetType = "coinpair"
+pd = qsec.lazy.lazy_import("pandas")
+
+
+# Parse Binance exchangeInfo replies, for spot, USD-M and COIN-M futures, into
+# one asset row per symbol.  Symbols and their filters are flattened in bulk:
+# every field of every filter becomes a column, so filter types added by the
+# exchange are picked up without code changes.  The well known filter fields
+# keep their established column names (see filter_columns); the others are
+# named by joining filter type and field in camel case, for example
+# PERCENT_PRICE.multiplierUp becomes percentPriceMultiplierUp.
+#
+# Binance sends prices and quantities as decimal strings, and counts and
+# precisions as integers.  Decimal strings are parsed to float64 and integers
+# to nullable Int64; anything else (flags, enum strings) is left as is.
+
+# (filterType, field) -> column name
+filter_columns = {
+    ("PRICE_FILTER", "tickSize"): "tickSize",
+    ("LOT_SIZE", "minQty"): "minQty",
+    ("LOT_SIZE", "maxQty"): "maxQty",
+    ("LOT_SIZE", "stepSize"): "lotQty",
+    ("MIN_NOTIONAL", "minNotional"): "minNotional",  # spot
+    ("MIN_NOTIONAL", "notional"): "minNotional",  # futures
+    ("MAX_NUM_ORDERS", "maxNumOrders"): "maxNumOrders",  # spot
+    ("MAX_NUM_ORDERS", "limit"): "maxNumOrders",  # futures
+}
+
+# exchangeInfo symbol field -> column name, per market
+spot_fields = {
+    "symbol": "symbol",
+    "baseAsset": "baseAsset",
+    "quoteAsset": "quoteAsset",
+    "quoteAssetPrecision": "quoteAssetPrecision",
+    "baseAssetPrecision": "baseAssetPrecision",
+    "status": "status",
+}
+
+futures_fields = {
+    "symbol": "symbol",
+    "baseAsset": "baseAsset",
+    "quoteAsset": "quoteAsset",
+    "marginAsset": "marginAsset",
+    "quotePrecision": "quoteAssetPrecision",
+    "baseAssetPrecision": "baseAssetPrecision",
+    "status": "status",  # USD-M
+    "contractStatus": "status",  # COIN-M
+    "underlyingType": "underlyingType",
+    "contractType": "contractType",
+    "contractSize": "contractSize",
+}
+
+# futures contractType -> asset type
+contract_types = {
+    "PERPETUAL": "perp",
+    "CURRENT_QUARTER": "future",
+    "NEXT_QUARTER": "future",
+}
+
+
+def read_exchange_info(fn):
     logging.info("reading file '{}'".format(fn))
-    # read json
     with open(fn) as f:
-        data = json.load(f)
-    symbols = data["symbols"]
-    logging.info("file has {} symbols".format(len(symbols)))
-    rows = []
-
-    filters_to_ignore = set(
-        ['MAX_NUM_ALGO_ORDERS',
-         'ICEBERG_PARTS',
-         'MARKET_LOT_SIZE',
-         'PERCENT_PRICE'
-        ])
-
-    logging.info("ignoring following filters: {}".format(filters_to_ignore))
-    for item in symbols:
-        #     import ipdb; ipdb.set_trace();
-        row = dict()
-        row["symbol"] = item["symbol"]
-        row["assetid"] = item["symbol"] + "_BNC"
-        row["type"] = assetType
-        row["venue"] = venue
-        row["baseAsset"] = item["baseAsset"]
-        row["quoteAsset"] = item["quoteAsset"]
-        row["quoteAsset"] = item["quoteAsset"]
-        row["quoteAssetPrecision"] = item["quoteAssetPrecision"]
-        row["baseAssetPrecision"] = item["baseAssetPrecision"]
-        row["status"] = item["status"]
-
-        # TODO: here I am not supporting the MARKET_LOT_SIZE filter
-        for filter in item['filters'] :
-            filterType = filter['filterType']
-            if filterType == 'LOT_SIZE':
-                row["minQty"] = filter['minQty']
-                row["maxQty"] = filter['maxQty']
-                row["lotQty"] = filter['stepSize']
-            elif filterType == 'MIN_NOTIONAL':
-                row['minNotional'] = filter['minNotional']
-            elif filterType == 'PRICE_FILTER':
-                row['tickSize'] = filter['tickSize']
-            elif filterType == "MAX_NUM_ORDERS":
-                row['maxNumOrders'] = filter['maxNumOrders']
-            elif filterType in filters_to_ignore:
-                pass
-            else:
-                logging.warn("ignoring binance filter '{}'".format(filterType))
-        rows.append(row)
-
-    df = pd.DataFrame(rows)
+        return json.load(f)
+
+
+def _filter_column(filter_type: str, field: str) -> str:
+    key = (filter_type, field)
+    if key in filter_columns:
+        return filter_columns[key]
+    words = filter_type.lower().split("_")
+    return words[0] + "".join(w.capitalize() for w in words[1:]) + \
+        field[0].upper() + field[1:]
+
+
+def _parse_values(col: "pd.Series") -> "pd.Series":
+    values = col.dropna()
+    if values.empty:
+        return col
+    kinds = set(values.map(type))
+    if kinds == {int}:
+        return col.astype("Int64")
+    if kinds <= {str, int, float}:
+        try:
+            return pd.to_numeric(col).astype("float64")
+        except (ValueError, TypeError):
+            pass
+    return col
+
+
+def _filters_frame(symbols: list) -> "pd.DataFrame":
+    """One row per symbol and one column per filter field"""
+    # flatten to (symbol, filterType, field, value); building the records
+    # directly, rather than via json_normalize, keeps integers as integers
+    long = pd.DataFrame.from_records(
+        [
+            (item["symbol"], f["filterType"], field, value)
+            for item in symbols
+            for f in item.get("filters", ())
+            for field, value in f.items()
+            if field != "filterType" and value is not None
+        ],
+        columns=["symbol", "filterType", "field", "value"],
+    )
+    if long.empty:
+        return pd.DataFrame(index=pd.Index([], name="symbol"))
+    pairs = long[["filterType", "field"]].drop_duplicates()
+    pairs["column"] = [
+        _filter_column(t, f) for t, f in zip(pairs["filterType"], pairs["field"])
+    ]
+    long = long.merge(pairs, on=["filterType", "field"])
+    long = long.drop_duplicates(["symbol", "column"])
+    wide = long.pivot(index="symbol", columns="column", values="value")
+    wide.columns.name = None
+    return wide
+
+
+def _symbols_frame(symbols: list, fields: dict) -> "pd.DataFrame":
+    raw = pd.DataFrame.from_records(symbols, exclude=["filters"])
+    df = pd.DataFrame(index=raw.index)
+    for field, column in fields.items():
+        if field not in raw.columns:
+            continue
+        if column in df.columns:
+            df[column] = df[column].fillna(raw[field])
+        else:
+            df[column] = raw[field]
     return df
 
 
-def normalise_contractType(contractType: str) -> str:
-    if (contractType == "PERPETUAL"):
-        return "perp", "PF"
-    if (contractType in ["CURRENT_QUARTER", "NEXT_QUARTER"]):
-        return "future", ""
-    print(f"unhandled contract type: {contractType}")
-    return None, None
+def parse_symbols(data: dict, venue: str) -> "pd.DataFrame":
+    """Parse the symbols of an exchangeInfo reply for any Binance venue"""
+    symbols = data["symbols"]
+    logging.info("'{}' has {} symbols".format(venue, len(symbols)))
+    if not symbols:
+        return pd.DataFrame()
+
+    futures = venue != "binance"
+    df = _symbols_frame(symbols, futures_fields if futures else spot_fields)
+
+    if futures:
+        df.insert(1, "type", df["contractType"].map(contract_types))
+        unknown = df["type"].isna()
+        if unknown.any():
+            counts = df.loc[unknown, "contractType"].value_counts()
+            logging.info("skipping {} '{}' symbols with unhandled contract "
+                         "types: {}".format(unknown.sum(), venue,
+                                            counts.to_dict()))
+            df = df[~unknown]
+        perp = df["type"] == "perp"
+        assetid = df["symbol"].str.replace(r"_PERP$", "", regex=True) + "_PF_BNC"
+        assetid[~perp] = df.loc[~perp, "symbol"].map(simplify_future_native_code)
+    else:
+        df.insert(1, "type", "coinpair")
+        assetid = df["symbol"] + "_BNC"
+
+    df.insert(0, "assetid", assetid)
+    df.insert(3, "venue", venue)
+    if "status" not in df.columns:
+        df["status"] = "unknown"
+
+    df = df.join(_filters_frame(symbols), on="symbol")
+    for column in df.columns:
+        df[column] = _parse_values(df[column])
+    return df.reset_index(drop=True)
 
 
 def simplify_future_native_code(symbol):
@@ -82,107 +182,27 @@ def simplify_future_native_code(symbol):
     mnthcode = ['F','G','H','K','M','N','Q','U','V','X','Z'][mnth-1]
     return "_".join([parts[0],mnthcode+year[1],'BNC'])
 
-def parse_binance_usdfut_exchange_info(fn, venue):
-    logging.info("reading file '{}'".format(fn))
-    # read json
-    with open(fn) as f:
-        data = json.load(f)
-    symbols = data["symbols"]
-    logging.info("file has {} symbols".format(len(symbols)))
-    rows = []
-
-    filters_to_ignore = set(
-        ['MAX_NUM_ALGO_ORDERS',
-         'ICEBERG_PARTS',
-         'MARKET_LOT_SIZE',
-         'PERCENT_PRICE'   # <=== could be useful to enable
-        ])
-
-    logging.info("ignoring following filters: {}".format(filters_to_ignore))
-    for item in symbols:
-        row = dict()
-        symbol = item["symbol"]
-        row["symbol"] = symbol
-
-        assetType, assetShortType = normalise_contractType(item['contractType'])
-        if (assetType is None):
-            logging.info(f"skipping asset '{symbol}'")
-            continue
 
-        row["assetid"] = symbol
-        if assetType == "perp" and not symbol.endswith("_PERP"):
-            row["assetid"] = f"{symbol}_PF_BNC"
-        elif assetType == "perp" and symbol.endswith("_PERP"):
-            row["assetid"] = symbol.replace("_PERP","_PF") + "_BNC"
-        else:
-            row["assetid"] = f"{symbol}_BNC"
-
-        if assetType == "future":
-            row["assetid"] = simplify_future_native_code(symbol)
-
-
-        row["type"] = assetType
-        row["venue"] = venue
-        row["baseAsset"] = item["baseAsset"]
-        row["quoteAsset"] = item["quoteAsset"]
-        row["marginAsset"] = item["marginAsset"]
-        row["quoteAssetPrecision"] = item["quotePrecision"]
-        row["baseAssetPrecision"] = item["baseAssetPrecision"]
-
-        if "status" in item:
-            row["status"] = item["status"]
-        elif "contractStatus" in item:
-            row["status"] = item["contractStatus"]
-        else:
-            row["status"] = "unknown"
-
-        row["underlyingType"] = item.get("underlyingType", None)
-        row["contractType"] = item.get("contractType", None)
-
-        # TODO: here I am not supporting the MARKET_LOT_SIZE filter
-        for filter in item['filters'] :
-            filterType = filter['filterType']
-            if filterType == 'LOT_SIZE':
-                row["minQty"] = filter['minQty']
-                row["maxQty"] = filter['maxQty']
-                row["lotQty"] = filter['stepSize']
-            elif filterType == 'MIN_NOTIONAL':
-                row['minNotional'] = filter['notional']
-            elif filterType == 'PRICE_FILTER':
-                row['tickSize'] = filter['tickSize']
-            elif filterType == "MAX_NUM_ORDERS":
-                row['maxNumOrders'] = filter['limit']
-            elif filterType in filters_to_ignore:
-                pass
-            else:
-                logging.warn("ignoring binance filter '{}'".format(filterType))
-
-        rows.append(row)
-
-    df = pd.DataFrame(rows)
+def combine_assets(dfs):
+    df = pd.concat(dfs, sort=False)
+    if not df["assetid"].is_unique:
+        raise Exception("duplicate assetids across venues")
+    df.set_index("assetid", inplace=True)
     return df
 
 
 def main():
     qsec.logging.init_logging()
 
-    fn = "binance_exchange-info.json"
-    coin_df = parse_binance_spot_exchange_info(fn)
-
-    fn = "binance_usdfut_exchange-info.json"
-    futures_df = parse_binance_usdfut_exchange_info(fn,
-                                                    venue = "binance_usdfut")
-
-    fn = "binance_coinfut_exchange-info.json"
-    coinfut_df = parse_binance_usdfut_exchange_info(fn,
-                                                    venue = "binance_coinfut")
-
-    df = pd.concat([coin_df, futures_df, coinfut_df], sort=False)
-    df.set_index("assetid", inplace=True, verify_integrity=True)
+    dfs = [
+        parse_symbols(read_exchange_info(f"{venue}_exchange-info.json"), venue)
+        for venue in ["binance", "binance_usdfut", "binance_coinfut"]
+    ]
+    df = combine_assets(dfs)
 
-    outfn = "binance_assets.csv"
-    logging.info("writing csv file to '{}'".format(outfn))
-    df.to_csv(outfn)
+    outfn = "binance_assets.parq"
+    logging.info("writing parquet file to '{}'".format(outfn))
+    df.to_parquet(outfn)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,112 @@
+import datetime as dt
+import hashlib
+import json
+import logging
+import os
+import argparse
+
+import qsec.logging
+import qsec.refdata
+import qsec.time
+from qsec.data.binance import fetch_binance_refdata
+from qsec.data.binance import parse_binance_refdata
+
+
+# Single step reference data refresh: fetch exchangeInfo for all Binance
+# venues concurrently, and if any venue's symbols changed since the last run,
+# parse the payloads in memory and install a new snapshot plus history update
+# in MDHOME.  Cheap enough to run every few minutes.
+
+
+def raw_dir() -> str:
+    return f"{qsec.refdata.refdata_home()}/raw"
+
+
+def state_filename() -> str:
+    return f"{raw_dir()}/state.json"
+
+
+def raw_filename(venue: str) -> str:
+    return f"{raw_dir()}/{venue}_exchange-info.json"
+
+
+def load_state() -> dict:
+    try:
+        with open(state_filename()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_atomic(fn: str, content: bytes):
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp = f"{fn}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(content)
+    os.replace(tmp, fn)
+
+
+def symbols_digest(data: dict) -> str:
+    # exchangeInfo embeds the server time, so only the symbols are hashed
+    text = json.dumps(data["symbols"], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def refresh(force: bool = False, date: dt.date = None) -> bool:
+    """Returns True if a new snapshot was installed"""
+    date = date or dt.datetime.now(dt.timezone.utc).date()
+    state = load_state()
+    etags = {
+        v: s.get("etag")
+        for v, s in state.items()
+        if not force and os.path.exists(raw_filename(v))
+    }
+    replies = fetch_binance_refdata.fetch_all_exchange_info(etags)
+
+    payloads = {}
+    changed = []
+    for venue, (content, etag) in replies.items():
+        if content is None:
+            with open(raw_filename(venue), "rb") as f:
+                content = f.read()
+        data = json.loads(content)
+        digest = symbols_digest(data)
+        previous = state.get(venue, {})
+        if force or digest != previous.get("sha256"):
+            changed.append(venue)
+            write_atomic(raw_filename(venue), content)
+        state[venue] = {"etag": etag, "sha256": digest}
+        payloads[venue] = data
+
+    snapshot_fn = qsec.refdata.snapshot_filename(qsec.time.short_fmt(date))
+    if not changed and os.path.exists(snapshot_fn):
+        logging.info("exchange info unchanged, no new snapshot required")
+        return False
+    logging.info("exchange info changed for venues: {}".format(changed))
+
+    dfs = [parse_binance_refdata.parse_symbols(d, v) for v, d in payloads.items()]
+    df = parse_binance_refdata.combine_assets(dfs)
+    qsec.refdata.write_snapshot(df, qsec.time.short_fmt(date))
+    qsec.refdata.update_history(df, date)
+    write_atomic(state_filename(), json.dumps(state, indent=2).encode())
+    return True
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="install a snapshot even if exchange info is unchanged",
+    )
+    return parser.parse_args()
+
+
+def main():
+    qsec.logging.init_logging()
+    args = parse_args()
+    refresh(force=args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import atexit
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import qsec.lazy
+
+pa = qsec.lazy.lazy_import("pyarrow")
+pc = qsec.lazy.lazy_import("pyarrow.compute")
+
+
+# Decoding of raw Binance REST replies (aggTrades and klines pages) into
+# DataFrames, optionally spread over a pool of worker processes.
+#
+# json.loads and building Python objects hold the GIL, so once fetching is
+# concurrent, decoding a busy day's hundreds of pages on one core becomes the
+# bottleneck.  With set_workers(n), chunks of raw pages are sent to worker
+# processes, which decode them straight into Arrow columns and send back an
+# Arrow IPC stream: a single bytes buffer, so nothing but the raw text and
+# the finished columns cross the process boundary.
+#
+# Each page is given as (lo, hi, raw), and only rows whose key, the trade
+# time 'T' or the kline open time, is in [lo, hi) are kept.  Columns are
+# named and typed as pd.DataFrame(json.loads(raw)) would, except that
+# numbers sent as strings (prices, quantities) are decoded as float64.
+
+pages_per_task = 32
+
+_workers = 0
+_pool = None
+
+
+def set_workers(workers: int):
+    """Decode in `workers` processes; 0 decodes in the calling thread"""
+    global _workers, _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+    _workers = workers or 0
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # a clean forkserver, rather than forking a process that is running
+        # fetch threads
+        methods = multiprocessing.get_all_start_methods()
+        method = "forkserver" if "forkserver" in methods else "spawn"
+        _pool = ProcessPoolExecutor(
+            max_workers=_workers, mp_context=multiprocessing.get_context(method)
+        )
+        atexit.register(_pool.shutdown)
+        logging.info(f"decoding with {_workers} worker processes")
+    return _pool
+
+
+def _column(values: list) -> "pa.Array":
+    arr = pa.array(values)
+    if pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type):
+        arr = pc.cast(arr, pa.float64())
+    return arr
+
+
+def _decode_table(kind: str, pages: list) -> tuple:
+    """(table, rows per page) for a list of (lo, hi, raw) pages"""
+    tables = []
+    page_rows = []
+    for lo, hi, raw in pages:
+        rows = json.loads(raw)
+        page_rows.append(len(rows))
+        if not rows:
+            continue
+        if kind == "aggTrades":
+            names = list(rows[0])
+            columns = [_column([r[k] for r in rows]) for k in names]
+            key = names.index("T")
+        elif kind == "klines":
+            names = [str(i) for i in range(len(rows[0]))]
+            columns = [_column(list(c)) for c in zip(*rows)]
+            key = 0
+        else:
+            raise Exception(f"unknown page kind '{kind}'")
+        table = pa.Table.from_arrays(columns, names=names)
+        times = table.column(key)
+        keep = pc.and_(pc.greater_equal(times, lo), pc.less(times, hi))
+        tables.append(table.filter(keep))
+    if not tables:
+        return None, page_rows
+    return pa.concat_tables(tables, promote_options="default"), page_rows
+
+
+def _decode_ipc(kind: str, pages: list) -> tuple:
+    # runs in a worker process
+    table, page_rows = _decode_table(kind, pages)
+    if table is None:
+        return None, page_rows
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes(), page_rows
+
+
+def decode(kind: str, pages: list) -> tuple:
+    """Decode 'aggTrades' or 'klines' pages; returns (DataFrame, list of rows
+    per page), the DataFrame being None if no rows were kept"""
+    if _workers <= 0 or len(pages) <= 1:
+        table, page_rows = _decode_table(kind, pages)
+    else:
+        pool = _get_pool()
+        futures = [
+            pool.submit(_decode_ipc, kind, pages[i:i + pages_per_task])
+            for i in range(0, len(pages), pages_per_task)
+        ]
+        tables = []
+        page_rows = []
+        for future in futures:
+            buf, counts = future.result()
+            page_rows.extend(counts)
+            if buf is not None:
+                tables.append(pa.ipc.open_stream(buf).read_all())
+        table = (pa.concat_tables(tables, promote_options="default")
+                 if tables else None)
+    if table is None:
+        return None, page_rows
+    df = table.to_pandas()
+    if kind == "klines":
+        df.columns = [int(c) for c in df.columns]
+    return df, page_rows
+
+
+def peek_agg_trades(raw: str) -> tuple:
+    """(number of trades, first trade, last trade) of an aggTrades page,
+    decoding only its ends; trades are flat objects, so braces delimit them"""
+    n = raw.count("{")
+    if n == 0:
+        return 0, None, None
+    first = json.loads(raw[raw.index("{"):raw.index("}") + 1])
+    last = json.loads(raw[raw.rindex("{"):raw.rindex("}") + 1])
+    return n, first, last
@@ -0,0 +1,301 @@
+import datetime as dt
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import qsec.lazy
+import qsec.logging
+import qsec.marketdata
+import qsec.time
+
+np = qsec.lazy.lazy_import("numpy")
+pa = qsec.lazy.lazy_import("pyarrow")
+pq = qsec.lazy.lazy_import("pyarrow.parquet")
+pd = qsec.lazy.lazy_import("pandas")
+
+
+# Order-flow features computed from stored trades in bulk.
+#
+# Trades are first sampled on a clock: a time clock, buckets of a kline
+# interval (e.g. '1m'), or a volume clock, buckets of a fixed traded
+# quantity.  One pass over a day's trades, with numpy reduceat kernels,
+# gives the buckets' prices, volumes, signed (aggressor) volume, notional
+# and trade counts.  These buckets are cached per (assetid, day, clock,
+# size) under MDHOME/features, and are rebuilt only when the trade file
+# changes, so a day's ticks are decoded once however many features or
+# windows are tried.  A volume bucket does not span midnight.
+#
+# Features are registered functions of the buckets of a whole date range
+# and a rolling window, in buckets, so windows carry across days:
+#
+#   @qsec.features.feature("name")
+#   def _name(b: pd.DataFrame, window: int) -> np.ndarray: ...
+
+clocks = ["time", "volume"]
+
+bucket_columns = [
+    "start",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "buy_volume",
+    "signed_volume",
+    "notional",
+    "trades",
+]
+
+features = {}
+
+
+def feature(name: str):
+    """Decorator registering a feature function under `name`"""
+
+    def register(fn):
+        features[name] = fn
+        return fn
+
+    return register
+
+
+def cache_root() -> str:
+    return f"{Path.home()}/MDHOME/features"
+
+
+def clock_key(clock: str, size) -> str:
+    """The name of a clock's buckets in the cache, raising if it is invalid"""
+    if clock not in clocks:
+        raise Exception(f"unknown clock '{clock}', known: {clocks}")
+    if clock == "time" and size not in qsec.time.KLINE_INTERVALS:
+        raise Exception(f"time clock size must be an interval, not '{size}'")
+    if clock == "volume":
+        if not float(size) > 0:
+            raise Exception("volume clock size must be positive")
+        return f"{clock}-{float(size):g}"
+    return f"{clock}-{size}"
+
+
+def bucket_filename(venue: str, assetid: str, date: dt.date, clock: str,
+                    size) -> str:
+    return "{}/{}/{}/{}/{}.parquet".format(
+        cache_root(), venue, assetid, clock_key(clock, size),
+        date.strftime("%Y%m%d"))
+
+
+# --- Bucketing ---
+
+
+def bucket(table: "pa.Table", clock: str, size) -> "pd.DataFrame":
+    """Sample a day's trades, sorted by time, on a clock.
+
+    Returns one row per non-empty bucket, indexed by bucket close time, with
+    the bucket's start time and its columns as listed in bucket_columns.
+    """
+    clock_key(clock, size)
+    times = qsec.time.datetime64_to_epoch_ms(table.column("time").to_numpy())
+    price = table.column("price").to_numpy()
+    qty = table.column("qty").to_numpy()
+    side = table.column("side").to_numpy().astype(np.float64)
+    if clock == "time":
+        keys = qsec.time.interval_floor(times, size)
+    else:
+        # a trade is in the bucket its cumulative volume starts in
+        keys = (np.cumsum(qty) - qty) // float(size)
+    if len(keys) == 0:
+        # typed as the non-empty case, so concatenating days keeps the dtypes
+        out = {c: np.empty(0) for c in bucket_columns}
+        out["start"] = np.empty(0, dtype="datetime64[ms]")
+        out["trades"] = np.empty(0, dtype=np.int64)
+        index = pd.DatetimeIndex(np.empty(0, dtype="datetime64[ms]"), name="time")
+        return pd.DataFrame(out, index=index)
+    starts = np.flatnonzero(np.diff(keys, prepend=keys[0] - 1))
+    ends = np.append(starts[1:], len(keys)) - 1
+    if clock == "time":
+        start = keys[starts]
+        close = qsec.time.interval_add(start, size, 1) - 1
+    else:
+        start, close = times[starts], times[ends]
+    signed = side * qty
+    out = {
+        "start": qsec.time.epoch_ms_to_datetime64(start),
+        "open": price[starts],
+        "high": np.maximum.reduceat(price, starts),
+        "low": np.minimum.reduceat(price, starts),
+        "close": price[ends],
+        "volume": np.add.reduceat(qty, starts),
+        "buy_volume": np.add.reduceat(np.where(side > 0, qty, 0.0), starts),
+        "signed_volume": np.add.reduceat(signed, starts),
+        "notional": np.add.reduceat(price * qty, starts),
+        "trades": np.diff(np.append(starts, len(keys))),
+    }
+    index = pd.DatetimeIndex(qsec.time.epoch_ms_to_datetime64(close), name="time")
+    return pd.DataFrame(out, index=index)
+
+
+def day_buckets(venue: str, assetid: str, date: dt.date, clock: str,
+                size, use_cache: bool = True) -> "pd.DataFrame":
+    """The buckets of a day's trades, from the cache when it is current"""
+    src = qsec.marketdata.item_filename(assetid, date, "trades", venue)
+    if not os.path.exists(src):
+        return None
+    st = os.stat(src)
+    stamp = [st.st_mtime_ns, st.st_size]
+    fn = bucket_filename(venue, assetid, date, clock, size)
+    if use_cache and os.path.exists(fn):
+        table = pq.read_table(fn)
+        meta = json.loads((table.schema.metadata or {}).get(b"qsec", b"{}"))
+        if meta.get("source_stamp") == stamp:
+            return table.to_pandas()
+    table = qsec.marketdata.read_item(src, ["price", "qty", "side"])
+    df = bucket(table, clock, size)
+    if use_cache:
+        table = pa.Table.from_pandas(df)
+        meta = dict(table.schema.metadata or {})
+        meta[b"qsec"] = json.dumps({"source_stamp": stamp}).encode()
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        tmp = f"{fn}.tmp.{os.getpid()}"
+        try:
+            pq.write_table(table.replace_schema_metadata(meta), tmp)
+            os.replace(tmp, fn)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return df
+
+
+def _as_date(date) -> dt.date:
+    return qsec.time.to_date(date) if isinstance(date, str) else date
+
+
+def load_buckets(assetid: str, from_date, upto_date, clock: str = "time",
+                 size="1m", venue: str = "binance", workers: int = 0,
+                 use_cache: bool = True) -> "pd.DataFrame":
+    """Buckets of an asset's trades for dates in [from, upto), with days
+    bucketed over `workers` processes (0 for in process)"""
+    dates = qsec.time.dates_in_range(_as_date(from_date), _as_date(upto_date))
+    args = [(venue, assetid, d, clock, size, use_cache) for d in dates]
+    if workers and len(dates) > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=qsec.logging.init_worker) as pool:
+            frames = list(pool.map(day_buckets, *zip(*args)))
+    else:
+        frames = [day_buckets(*a) for a in args]
+    frames = [f for f in frames if f is not None]
+    if not frames:
+        raise Exception(
+            f"no 'trades' data for '{assetid}' on '{venue}' from {from_date} "
+            f"upto {upto_date}"
+        )
+    logging.info("bucketed {} days of {} on a {} clock".format(
+        len(frames), assetid, clock_key(clock, size)))
+    return pd.concat(frames)
+
+
+# --- Kernels ---
+
+
+def rolling_sum(x: "np.ndarray", window: int) -> "np.ndarray":
+    """Sum over the last `window` values, NaN until there are that many"""
+    c = np.cumsum(np.concatenate([[0.0], np.asarray(x, dtype=np.float64)]))
+    out = np.full(len(x), np.nan)
+    if window <= len(x):
+        out[window - 1:] = c[window:] - c[:-window]
+    return out
+
+
+def _returns(b: "pd.DataFrame") -> "np.ndarray":
+    close = b["close"].to_numpy()
+    r = np.empty(len(close))
+    r[:1] = np.nan
+    r[1:] = np.log(close[1:] / close[:-1])
+    return r
+
+
+# --- Features ---
+
+
+@feature("volume")
+def _volume(b, window):
+    return b["volume"].to_numpy()
+
+
+@feature("trades")
+def _trades(b, window):
+    return b["trades"].to_numpy()
+
+
+@feature("vwap")
+def _vwap(b, window):
+    return b["notional"].to_numpy() / b["volume"].to_numpy()
+
+
+@feature("return")
+def _return(b, window):
+    return _returns(b)
+
+
+@feature("signed_volume")
+def _signed_volume(b, window):
+    return b["signed_volume"].to_numpy()
+
+
+@feature("imbalance")
+def _imbalance(b, window):
+    """signed over total volume, over the window"""
+    return (rolling_sum(b["signed_volume"].to_numpy(), window)
+            / rolling_sum(b["volume"].to_numpy(), window))
+
+
+@feature("intensity")
+def _intensity(b, window):
+    """trades per second, over the window"""
+    close = qsec.time.datetime64_to_epoch_ms(b.index.values)
+    start = qsec.time.datetime64_to_epoch_ms(b["start"].values)
+    # time since the previous bucket closed, or since the first one started
+    elapsed = np.empty(len(close))
+    elapsed[:1] = close[:1] - start[:1] + 1
+    elapsed[1:] = np.diff(close)
+    return (rolling_sum(b["trades"].to_numpy(), window)
+            / (rolling_sum(elapsed, window) / 1000.0))
+
+
+@feature("realised_vol")
+def _realised_vol(b, window):
+    """square root of the sum of squared log returns over the window"""
+    r = np.nan_to_num(_returns(b))
+    return np.sqrt(rolling_sum(r * r, window))
+
+
+@feature("kyle_lambda")
+def _kyle_lambda(b, window):
+    """slope of the least squares fit of return on signed volume, over the
+    window"""
+    r = np.nan_to_num(_returns(b))
+    q = b["signed_volume"].to_numpy().astype(np.float64)
+    n = float(window)
+    sq, sr = rolling_sum(q, window), rolling_sum(r, window)
+    cov = rolling_sum(q * r, window) - sq * sr / n
+    var = rolling_sum(q * q, window) - sq * sq / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(var > 0, cov / var, np.nan)
+
+
+def compute(assetid: str, from_date, upto_date, names: list = None,
+            clock: str = "time", size="1m", window: int = 60,
+            venue: str = "binance", workers: int = 0,
+            use_cache: bool = True) -> "pd.DataFrame":
+    """Features of an asset's trades for dates in [from, upto), one row per
+    bucket of the clock and one column per feature (default all)"""
+    names = names or list(features)
+    unknown = [n for n in names if n not in features]
+    if unknown:
+        raise Exception(f"unknown features {unknown}, known: {sorted(features)}")
+    b = load_buckets(assetid, from_date, upto_date, clock, size, venue,
+                     workers, use_cache)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return pd.DataFrame({n: features[n](b, window) for n in names},
+                            index=b.index)
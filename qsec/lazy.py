@@ -0,0 +1,31 @@
+import importlib
+import sys
+import types
+
+
+# Deferred imports for heavy dependencies (pandas, pyarrow, numpy, requests).
+#
+#   pd = qsec.lazy.lazy_import("pandas")
+#
+# binds a placeholder module; the real import happens on first attribute
+# access, so tool invocations that exit early (--help, argument errors) never
+# pay for it.  Note that annotations are evaluated at definition time, so
+# annotate with strings (e.g. "pd.DataFrame") rather than lazy attributes.
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        # cache the real module's namespace, so later lookups are direct
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+
+def lazy_import(name: str):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return _LazyModule(name)
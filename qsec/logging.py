@@ -1,6 +1,10 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import sys
+import time
 
 
 def log_script_start(logger=logging.getLogger()):
@@ -17,7 +21,7 @@ def log_script_start(logger=logging.getLogger()):
     )
 
 
-def init_logging(debug=False, preamble=True):
+def init_logging(debug=False, preamble=True, threaded=True):
     logger = logging.getLogger()
     if debug:
         logger.setLevel(logging.DEBUG)
@@ -29,6 +33,119 @@ def init_logging(debug=False, preamble=True):
         "%(asctime)s.%(msecs)03d;%(levelname)s;%(message)s", "%Y-%m-%d %H:%M:%S"
     )
     ch.setFormatter(formatter)
-    logger.addHandler(ch)
+    if threaded:
+        # Formatting and writing of records is done on a background thread,
+        # so the calling thread only pays for enqueuing the record.
+        q = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(q, ch)
+        listener.start()
+        atexit.register(listener.stop)
+        logger.addHandler(logging.handlers.QueueHandler(q))
+    else:
+        logger.addHandler(ch)
     if preamble:
         log_script_start()
+
+
+def init_worker():
+    """Initializer for forked pool workers, e.g.
+
+    ProcessPoolExecutor(initializer=qsec.logging.init_worker)
+
+    A forked worker inherits the queue handler, but not the thread that
+    writes its records out, so the worker logs directly instead.
+    """
+    logger = logging.getLogger()
+    if not any(isinstance(h, logging.handlers.QueueHandler)
+               for h in logger.handlers):
+        return
+    level = logger.level
+    logger.handlers.clear()
+    init_logging(preamble=False, threaded=False)
+    logger.setLevel(level)
+
+
+class lazy:
+    """Defer an expensive log argument until the record is actually formatted.
+
+    For example: logging.debug("time: %s", lazy(epoch_ms_to_dt, ms))
+    """
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self):
+        return str(self.fn(*self.args))
+
+
+def _fmt_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return "{:02d}:{:02d}:{:02d}".format(
+        seconds // 3600, (seconds // 60) % 60, seconds % 60
+    )
+
+
+class Progress:
+    """Rate-limited progress reporting for long running loops.
+
+    Rather than logging every iteration, update() is cheap and a summary line,
+    with rate and ETA, is logged at most once per `interval` seconds.
+    Progress is measured by `position` against `total` (e.g. milliseconds of
+    the day covered so far) while `count` tracks the items collected.  The
+    optional `describe` callable renders the position for the log line, and
+    is only called when a line is emitted.
+    """
+
+    def __init__(
+        self,
+        label: str,
+        total=None,
+        unit: str = "rows",
+        interval: float = 10.0,
+        describe=None,
+        logger=None,
+    ):
+        self.label = label
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.describe = describe
+        self.logger = logger or logging.getLogger()
+        self.position = 0
+        self.count = 0
+        self._t0 = time.monotonic()
+        self._last = self._t0
+
+    def update(self, position=None, count=None):
+        if position is not None:
+            self.position = position
+        if count is not None:
+            self.count = count
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self._report(now)
+
+    def done(self):
+        self._report(time.monotonic(), final=True)
+
+    def _report(self, now, final=False):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        elapsed = now - self._t0
+        parts = ["{}: {} {}".format(self.label, self.count, self.unit)]
+        if self.describe is not None:
+            parts.append("at {}".format(self.describe(self.position)))
+        if elapsed > 0:
+            parts.append("{:.0f} {}/s".format(self.count / elapsed, self.unit))
+        if final:
+            parts.append("done in {}".format(_fmt_duration(elapsed)))
+        elif self.total and self.position > 0:
+            fraction = min(self.position / self.total, 1.0)
+            remaining = elapsed * (1.0 - fraction) / fraction
+            parts.append("{:.1f}%".format(100.0 * fraction))
+            parts.append("eta {}".format(_fmt_duration(remaining)))
+        self.logger.info(", ".join(parts))
@@ -0,0 +1,314 @@
+import datetime as dt
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Union
+
+import qsec.lazy
+import qsec.time
+
+pa = qsec.lazy.lazy_import("pyarrow")
+pq = qsec.lazy.lazy_import("pyarrow.parquet")
+pd = qsec.lazy.lazy_import("pandas")
+np = qsec.lazy.lazy_import("numpy")
+pc = qsec.lazy.lazy_import("pyarrow.compute")
+
+
+# Loading of the market data stored under MDHOME by the fetch tools.  There is
+# one parquet file per asset, data type and UTC day:
+#
+#   ~/MDHOME/tickdata-parq/{dtype}/{venue}/{assetid}/{YYYYMMDD}/{file}
+#
+# where the file is '{assetid}-{YYYYMMDD}.parq' for trades, and for bars the
+# dtype (e.g. 'bars1m') is embedded: '{assetid}-bars1m-{YYYYMMDD}.parq'.
+#
+# Trade files are written with one row group per hour, and an index in the
+# parquet footer metadata, under 'qsec_index', holding for each minute of the
+# day the row of its first trade and that trade's id.  So an intraday window
+# or a range of trade ids is read by decoding only the row groups that hold
+# it, rather than the whole day.  The index is stored delta encoded:
+#
+#   {"start": day start epoch-ms, "minute_ms": 60000,
+#    "rows": [trades in each minute], "first_id": id of the day's first trade,
+#    "id_steps": [id increase from each minute's first trade to the next's]}
+
+index_key = b"qsec_index"
+
+# suffix of the Arrow IPC stream that follow mode appends the current day to,
+# next to the day's file
+live_suffix = ".live"
+
+# assetid under which files of many assets per day are stored, with an
+# 'assetid' column (see the bar tools' --layout day)
+universe_assetid = "UNIVERSE"
+
+row_group_ms = qsec.time.HOUR_MS
+
+index_step_ms = qsec.time.MINUTE_MS
+
+
+# cache used by load() and load_table() when none is passed; see
+# set_default_cache
+default_cache = None
+
+
+def set_default_cache(cache):
+    """Route all loads through a cache, e.g. qsec.cache.MemoryCache(), so
+    that code calling load() deep inside a parameter sweep benefits too"""
+    global default_cache
+    default_cache = cache
+
+
+def md_home() -> str:
+    return f"{Path.home()}/MDHOME/tickdata-parq"
+
+
+def item_filename(
+    assetid: str,
+    date: dt.date,
+    dtype: str,
+    venue: str,
+    interval: str = None,  # will be None for Trades
+) -> str:
+    date_str = date.strftime("%Y%m%d")
+    path = f"{md_home()}/{dtype}/{venue}/{assetid}/{date_str}"
+
+    # for bar data, we embedd the bar interval into the file path
+    interval_str = f"-{interval}" if interval is not None else ""
+    return f"{path}/{assetid}{interval_str}-{date_str}.parq"
+
+
+def _as_date(date: Union[dt.date, str]) -> dt.date:
+    return qsec.time.to_date(date) if isinstance(date, str) else date
+
+
+def item_filenames(
+    assetid: str,
+    from_date: Union[dt.date, str],
+    upto_date: Union[dt.date, str],
+    dtype: str = "trades",
+    venue: str = "binance",
+) -> list:
+    """Existing day files of an asset for dates in [from_date, upto_date)"""
+    interval = dtype if dtype.startswith("bars") else None
+    fns = []
+    for d in qsec.time.dates_in_range(_as_date(from_date), _as_date(upto_date)):
+        fn = item_filename(assetid, d, dtype, venue, interval)
+        if os.path.exists(fn):
+            fns.append(fn)
+        else:
+            logging.debug("no data file for %s @ %s", assetid, d)
+    return fns
+
+
+def read_item(fn: str, columns: list = None) -> "pa.Table":
+    # the pandas index (the 'time' column) is always read with the columns
+    return pq.read_table(fn, columns=columns, use_pandas_metadata=True)
+
+
+def read_live(fn: str) -> "pa.Table":
+    """The rows of a follow mode live stream, or None if it has no schema
+    yet; a batch cut short by a crash is dropped"""
+    batches = []
+    with pa.OSFile(fn, "rb") as f:
+        try:
+            reader = pa.ipc.open_stream(f)
+        except pa.ArrowInvalid:
+            return None
+        while True:
+            try:
+                batches.append(reader.read_next_batch())
+            except StopIteration:
+                break
+            except (pa.ArrowInvalid, OSError):
+                logging.warning(f"live file '{fn}' is truncated, recovered "
+                                f"{len(batches)} batches")
+                break
+    return pa.Table.from_batches(batches, schema=reader.schema)
+
+
+def _epoch_ms(table: "pa.Table") -> "np.ndarray":
+    return qsec.time.datetime64_to_epoch_ms(table.column("time").to_numpy())
+
+
+def _is_indexable(table: "pa.Table") -> bool:
+    names = table.column_names
+    return table.num_rows > 0 and "time" in names and "tradeId" in names
+
+
+def build_index(table: "pa.Table") -> dict:
+    """The minute index of a day's trades, sorted by time"""
+    times = _epoch_ms(table)
+    start = int(times[0]) // qsec.time.DAY_MS * qsec.time.DAY_MS
+    bounds = np.arange(start, start + qsec.time.DAY_MS + 1, index_step_ms)
+    rows = np.searchsorted(times, bounds)
+    ids = table.column("tradeId").to_numpy()
+    # a minute without trades takes the id of the next trade
+    ids = np.append(ids, ids[-1] + 1)[rows]
+    return {
+        "start": start,
+        "minute_ms": index_step_ms,
+        "rows": np.diff(rows).tolist(),
+        "first_id": int(ids[0]),
+        "id_steps": np.diff(ids).tolist(),
+    }
+
+
+def read_index(fn: str):
+    """(minute start times, rows, ids), each with one more element than there
+    are minutes, from a trade file's index, or None if it has none"""
+    meta = pq.read_schema(fn).metadata or {}
+    if index_key not in meta:
+        return None
+    index = json.loads(meta[index_key])
+    n = len(index["rows"])
+    times = index["start"] + index["minute_ms"] * np.arange(n + 1, dtype=np.int64)
+    rows = np.concatenate([[0], np.cumsum(index["rows"], dtype=np.int64)])
+    ids = index["first_id"] + np.concatenate(
+        [[0], np.cumsum(index["id_steps"], dtype=np.int64)])
+    return times, rows, ids
+
+
+def write_item(table: "pa.Table", fn: str):
+    """Write a day file; trades get hourly row groups and a minute index"""
+    # any index read with the table may no longer match its rows
+    meta = dict(table.schema.metadata or {})
+    meta.pop(index_key, None)
+    table = table.replace_schema_metadata(meta)
+    times = _epoch_ms(table) if _is_indexable(table) else None
+    if times is None or np.any(np.diff(times) < 0):
+        pq.write_table(table, fn, compression="GZIP")
+        return
+    meta[index_key] = json.dumps(build_index(table)).encode()
+    table = table.replace_schema_metadata(meta)
+    first = int(times[0]) // row_group_ms * row_group_ms
+    bounds = np.arange(first, int(times[-1]) + row_group_ms, row_group_ms)
+    offsets = np.append(np.searchsorted(times, bounds), table.num_rows)
+    with pq.ParquetWriter(fn, table.schema, compression="GZIP") as writer:
+        for lo, hi in zip(offsets[:-1], offsets[1:]):
+            if hi > lo:
+                writer.write_table(table.slice(lo, hi - lo), row_group_size=hi - lo)
+
+
+def _read_rows(fn: str, lo: int, hi: int, columns: list) -> "pa.Table":
+    # rows [lo, hi) of a file, decoding only the row groups holding them
+    pf = pq.ParquetFile(fn)
+    meta = pf.metadata
+    starts = np.cumsum([0] + [meta.row_group(i).num_rows
+                              for i in range(meta.num_row_groups)])
+    first = min(int(np.searchsorted(starts, lo, side="right")) - 1,
+                meta.num_row_groups - 1)
+    last = max(int(np.searchsorted(starts, hi, side="left")), first + 1)
+    table = pf.read_row_groups(range(first, last), columns=columns,
+                               use_pandas_metadata=True)
+    return table.slice(lo - int(starts[first]), max(hi - lo, 0))
+
+
+def read_time_window(fn: str, start_ms: int, end_ms: int,
+                     columns: list = None) -> "pa.Table":
+    """The rows of a trade file with a time in [start_ms, end_ms)"""
+    index = read_index(fn)
+    if index is None:
+        table = read_item(fn, columns)
+    else:
+        times, rows, _ = index
+        k0 = max(int(np.searchsorted(times, start_ms, side="right")) - 1, 0)
+        k1 = int(np.searchsorted(times, end_ms, side="left"))
+        lo, hi = int(rows[k0]), int(rows[min(k1, len(rows) - 1)])
+        table = _read_rows(fn, lo, hi, columns)
+    times = _epoch_ms(table)
+    lo, hi = np.searchsorted(times, [start_ms, end_ms])
+    return table.slice(lo, hi - lo)
+
+
+def read_id_range(fn: str, first_id: int, end_id: int,
+                  columns: list = None) -> "pa.Table":
+    """The rows of a trade file with a tradeId in [first_id, end_id)"""
+    read_columns = columns
+    if columns is not None and "tradeId" not in columns:
+        read_columns = list(columns) + ["tradeId"]
+    index = read_index(fn)
+    if index is None:
+        table = read_item(fn, read_columns)
+    else:
+        _, rows, ids = index
+        k0 = max(int(np.searchsorted(ids, first_id, side="right")) - 1, 0)
+        k1 = int(np.searchsorted(ids, end_id, side="left"))
+        lo, hi = int(rows[k0]), int(rows[min(k1, len(rows) - 1)])
+        table = _read_rows(fn, lo, hi, read_columns)
+    trade_ids = table.column("tradeId")
+    keep = pc.and_(pc.greater_equal(trade_ids, first_id),
+                   pc.less(trade_ids, end_id))
+    table = table.filter(keep)
+    if read_columns is not columns:
+        table = table.drop_columns(["tradeId"])
+    return table
+
+
+def load_table(
+    assetid: str,
+    from_date: Union[dt.date, str],
+    upto_date: Union[dt.date, str],
+    dtype: str = "trades",
+    venue: str = "binance",
+    columns: list = None,
+    cache=None,
+) -> "pa.Table":
+    """Load an asset's data for dates in [from_date, upto_date) as one table.
+
+    Missing days are skipped.  If a cache (see qsec.cache) is given, or a
+    default cache is set, each day file is read through it.
+    """
+    cache = cache if cache is not None else default_cache
+    fns = item_filenames(assetid, from_date, upto_date, dtype, venue)
+    if not fns:
+        raise Exception(
+            f"no '{dtype}' data for '{assetid}' on '{venue}' from {from_date} "
+            f"upto {upto_date}"
+        )
+    if cache is not None:
+        tables = [cache.read(fn, columns, read_item) for fn in fns]
+    else:
+        tables = [read_item(fn, columns) for fn in fns]
+    if len(tables) == 1:
+        return tables[0]
+    return pa.concat_tables(tables, promote_options="default")
+
+
+def load(
+    assetid: str,
+    from_date: Union[dt.date, str],
+    upto_date: Union[dt.date, str],
+    dtype: str = "trades",
+    venue: str = "binance",
+    columns: list = None,
+    cache=None,
+) -> "pd.DataFrame":
+    """As load_table, but as a DataFrame indexed by time"""
+    table = load_table(assetid, from_date, upto_date, dtype, venue, columns, cache)
+    # split_blocks avoids consolidating columns, so that for tables read from
+    # a memory mapped cache the numeric columns are not copied
+    return table.to_pandas(split_blocks=True)
+
+
+def load_window(
+    assetid: str,
+    start_ms: int,
+    end_ms: int,
+    venue: str = "binance",
+    columns: list = None,
+) -> "pd.DataFrame":
+    """An asset's trades with a time in [start_ms, end_ms), epoch-ms, reading
+    only the parts of each day file that hold them"""
+    from_date = qsec.time.epoch_ms_to_date(start_ms)
+    upto_date = qsec.time.epoch_ms_to_date(end_ms - 1) + dt.timedelta(days=1)
+    fns = item_filenames(assetid, from_date, upto_date, "trades", venue)
+    if not fns:
+        raise Exception(
+            f"no 'trades' data for '{assetid}' on '{venue}' from {from_date} "
+            f"upto {upto_date}"
+        )
+    tables = [read_time_window(fn, start_ms, end_ms, columns) for fn in fns]
+    table = pa.concat_tables(tables, promote_options="default")
+    return table.to_pandas(split_blocks=True)
@@ -0,0 +1,291 @@
+import datetime as dt
+import glob
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import qsec.catalog
+import qsec.lazy
+import qsec.logging
+import qsec.marketdata
+import qsec.time
+
+pa = qsec.lazy.lazy_import("pyarrow")
+pc = qsec.lazy.lazy_import("pyarrow.compute")
+pq = qsec.lazy.lazy_import("pyarrow.parquet")
+
+
+# Apply a registered transformation or check to every matching file under
+# MDHOME, in parallel over a process pool.
+#
+# A task is a function of (item, table) that returns a result dict.  A
+# 'rewrite' task returns {"table": new_table} when the file needs changing
+# (or nothing when it does not) and the file is then replaced atomically; a
+# 'check' task returns {"problems": [...]}.  Completed files are appended to
+# a journal, so an interrupted run skips them when restarted, unless they
+# have changed since.
+
+metadata_key = b"qsec"
+
+tasks = {}
+
+
+def task(name: str, kind: str, help: str):
+    """Decorator registering a task under `name`; kind is rewrite or check"""
+    if kind not in ("rewrite", "check"):
+        raise Exception(f"unknown task kind '{kind}'")
+
+    def register(fn):
+        tasks[name] = (fn, kind, help)
+        return fn
+
+    return register
+
+
+class Item:
+    """One data file, and what its path says about it"""
+
+    def __init__(self, fn: str, dtype: str, venue: str, assetid: str,
+                 date: dt.date):
+        self.fn = fn
+        self.dtype = dtype
+        self.venue = venue
+        self.assetid = assetid
+        self.date = date
+
+    @property
+    def interval(self):
+        # bar files are named by their dtype, e.g. 'bars1m'
+        return self.dtype[4:] if self.dtype.startswith("bars") else None
+
+
+def find_items(dtype: str = "*", venue: str = "*", assetid: str = "*",
+               from_date: dt.date = None, upto_date: dt.date = None) -> list:
+    """Data files matching the (glob) patterns, for dates in [from, upto)"""
+    root = qsec.marketdata.md_home()
+    items = []
+    # globbing each level lists only the directories that can match
+    pattern = os.path.join(glob.escape(root), dtype, venue, assetid, "*", "")
+    for dirpath in glob.glob(pattern):
+        dirpath = os.path.dirname(dirpath)
+        p_dtype, p_venue, p_assetid, p_date = os.path.relpath(
+            dirpath, root).split(os.sep)
+        try:
+            date = qsec.time.to_date(p_date)
+        except Exception:
+            continue
+        if from_date is not None and date < from_date:
+            continue
+        if upto_date is not None and date >= upto_date:
+            continue
+        for name in sorted(os.listdir(dirpath)):
+            if name.endswith(".parq"):
+                items.append(Item(os.path.join(dirpath, name), p_dtype,
+                                  p_venue, p_assetid, date))
+    items.sort(key=lambda i: i.fn)
+    return items
+
+
+def read_meta(table: "pa.Table") -> dict:
+    meta = (table.schema.metadata or {}).get(metadata_key)
+    return json.loads(meta) if meta else {}
+
+
+def with_meta(table: "pa.Table", meta: dict) -> "pa.Table":
+    combined = dict(table.schema.metadata or {})
+    combined[metadata_key] = json.dumps(meta).encode()
+    return table.replace_schema_metadata(combined)
+
+
+def _stamp(fn: str) -> list:
+    st = os.stat(fn)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def write_atomic(table: "pa.Table", fn: str):
+    tmp = f"{fn}.tmp.{os.getpid()}"
+    try:
+        qsec.marketdata.write_item(table, tmp)
+        os.replace(tmp, fn)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def apply(name: str, item: Item, dry_run: bool = False) -> dict:
+    """Run a task on one file; runs in the worker processes"""
+    fn, kind, _ = tasks[name]
+    result = {"file": item.fn}
+    try:
+        table = pq.read_table(item.fn)
+        outcome = fn(item, table) or {}
+        if kind == "rewrite" and outcome.get("table") is not None:
+            if not dry_run:
+                write_atomic(outcome["table"], item.fn)
+            result["status"] = "changed"
+        elif outcome.get("problems"):
+            result["status"] = "problem"
+            result["problems"] = outcome["problems"]
+        else:
+            result["status"] = "ok"
+    except Exception as err:
+        result["status"] = "failed"
+        result["error"] = str(err)
+    if result["status"] != "failed" and os.path.exists(item.fn):
+        result["stamp"] = _stamp(item.fn)
+    return result
+
+
+def load_journal(fn: str) -> dict:
+    """file -> stamp of each file completed, without failure or problem, by
+    a previous run"""
+    done = {}
+    if fn is None or not os.path.exists(fn):
+        return done
+    with open(fn) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if entry.get("status") in ("ok", "changed") and "stamp" in entry:
+                done[entry["file"]] = entry["stamp"]
+    return done
+
+
+def run(name: str, items: list, workers: int = None, journal: str = None,
+        dry_run: bool = False) -> dict:
+    """Apply a task to items over a process pool, returning status counts"""
+    if name not in tasks:
+        raise Exception(f"unknown task '{name}', known: {sorted(tasks)}")
+    done = load_journal(journal)
+    todo = [
+        i for i in items
+        if done.get(i.fn) is None or done[i.fn] != _stamp(i.fn)
+    ]
+    if len(todo) < len(items):
+        logging.info("skipping {} files completed by a previous run".format(
+            len(items) - len(todo)))
+    logging.info("running task '{}' on {} files".format(name, len(todo)))
+
+    counts = {"ok": 0, "changed": 0, "problem": 0, "failed": 0}
+    progress = qsec.logging.Progress(f"task {name}", total=len(todo),
+                                     unit="files")
+    out = None
+    if journal is not None and not dry_run:
+        os.makedirs(os.path.dirname(os.path.abspath(journal)), exist_ok=True)
+        out = open(journal, "a")
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=qsec.logging.init_worker) as pool:
+            futures = [pool.submit(apply, name, i, dry_run) for i in todo]
+            for n, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                counts[result["status"]] += 1
+                if result["status"] == "failed":
+                    logging.error("{}: {}".format(result["file"], result["error"]))
+                elif result["status"] == "problem":
+                    for problem in result["problems"]:
+                        logging.warning("{}: {}".format(result["file"], problem))
+                elif result["status"] == "changed" and dry_run:
+                    logging.info("would rewrite {}".format(result["file"]))
+                if out is not None:
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+                progress.update(position=n, count=n)
+    finally:
+        if out is not None:
+            out.close()
+    progress.done()
+    return counts
+
+
+# --- Tasks ---
+
+
+@task("sid-to-usid", "rewrite", "rename legacy 'sid' metadata to 'usid'")
+def _sid_to_usid(item: Item, table: "pa.Table"):
+    meta = read_meta(table)
+    if "sid" not in meta:
+        return None
+    sid = meta.pop("sid")
+    meta.setdefault("usid", sid)
+    return {"table": with_meta(table, meta)}
+
+
+@task("add-interval", "rewrite", "add missing interval metadata to bar files")
+def _add_interval(item: Item, table: "pa.Table"):
+    meta = read_meta(table)
+    if item.interval is None or "interval" in meta:
+        return None
+    # save_dateframe records the dtype, e.g. 'bars1m', as the interval
+    meta["interval"] = item.dtype
+    return {"table": with_meta(table, meta)}
+
+
+def _is_sorted(values: "pa.ChunkedArray") -> bool:
+    if len(values) < 2:
+        return True
+    values = values.combine_chunks()
+    return pc.all(pc.greater_equal(values[1:], values[:-1])).as_py()
+
+
+@task("sort", "rewrite", "sort rows by time")
+def _sort(item: Item, table: "pa.Table"):
+    if "time" not in table.column_names or _is_sorted(table["time"]):
+        return None
+    return {"table": table.sort_by("time")}
+
+
+@task("index", "rewrite",
+      "add hourly row groups and a minute index to trade files")
+def _index(item: Item, table: "pa.Table"):
+    if item.dtype != "trades" or qsec.marketdata.index_key in (
+            table.schema.metadata or {}):
+        return None
+    # write_item adds the index, when the trades are sorted by time
+    return {"table": table}
+
+
+@task("summarise", "rewrite", "store daily summary statistics with files")
+def _summarise(item: Item, table: "pa.Table"):
+    meta = read_meta(table)
+    key = "summaries" if "assetid" in table.column_names else "summary"
+    if key in meta:
+        return None
+    # a multi-asset file summarised as one asset is summarised again
+    meta.pop("summary", None)
+    meta.update(qsec.catalog.summary_meta(table, item.dtype))
+    return {"table": with_meta(table, meta)}
+
+
+@task("check-rows", "check",
+      "check bar counts per day, and trade ids are complete and ordered")
+def _check_rows(item: Item, table: "pa.Table"):
+    problems = []
+    if "time" in table.column_names and not _is_sorted(table["time"]):
+        problems.append("rows not sorted by time")
+    if item.interval is not None:
+        try:
+            expected = len(qsec.time.day_closed_bars_ms(
+                item.date, item.interval))
+        except Exception:
+            expected = None
+        if expected is not None and table.num_rows != expected:
+            problems.append("expected {} bars, found {}".format(
+                expected, table.num_rows))
+    elif "tradeId" in table.column_names and table.num_rows:
+        ids = table["tradeId"]
+        first, last = pc.min(ids).as_py(), pc.max(ids).as_py()
+        unique = pc.count_distinct(ids).as_py()
+        if unique != table.num_rows:
+            problems.append("{} duplicate tradeIds".format(
+                table.num_rows - unique))
+        if last - first + 1 != unique:
+            problems.append("{} missing tradeIds".format(
+                last - first + 1 - unique))
+    elif table.num_rows == 0:
+        problems.append("no rows")
+    return {"problems": problems}
@@ -0,0 +1,159 @@
+import datetime as dt
+import logging
+from typing import Union
+
+import qsec.lazy
+import qsec.marketdata
+
+pa = qsec.lazy.lazy_import("pyarrow")
+pc = qsec.lazy.lazy_import("pyarrow.compute")
+pq = qsec.lazy.lazy_import("pyarrow.parquet")
+
+
+# Replay of several assets' trades (or bars) in one global time order,
+# without loading them all.
+#
+# Each source reads its day files in order, a batch of rows at a time.  The
+# merge works a block at a time rather than a row at a time: the frontier is
+# the earliest of the sources' last buffered times; every row at or before the
+# frontier, which is a prefix of each source's buffer since day files are
+# sorted, is taken, the rows are sorted together, and emitted.  The source
+# that set the frontier is then drained, so it is refilled next round.  Memory
+# is bounded by the number of sources times `read_rows`, plus one output
+# batch.  Rows with equal times keep the order the assets were given in.
+
+time_column = "time"
+
+
+class _Source:
+    """Buffered, time ordered rows of one asset over its day files"""
+
+    def __init__(self, index: int, fns: list, columns: list, read_rows: int):
+        self.index = index
+        self.fns = fns
+        self.columns = columns
+        self.read_rows = read_rows
+        self.schema = None
+        self.buffer = None
+        self._batches = self._read()
+
+    def _read(self):
+        for fn in self.fns:
+            pf = pq.ParquetFile(fn)
+            for batch in pf.iter_batches(batch_size=self.read_rows,
+                                         columns=self.columns):
+                if batch.num_rows:
+                    yield batch
+
+    def fill(self) -> bool:
+        """Ensure rows are buffered; False once the source is exhausted"""
+        while self.buffer is None or self.buffer.num_rows == 0:
+            try:
+                batch = next(self._batches)
+            except StopIteration:
+                self.buffer = None
+                return False
+            table = pa.Table.from_batches([batch]).select(self.columns)
+            if self.schema is not None:
+                table = table.cast(self.schema)
+            self.buffer = table
+        return True
+
+    def last_time(self) -> int:
+        return self.buffer[time_column][-1].value
+
+    def take_upto(self, frontier: int) -> "pa.Table":
+        # the buffer is sorted, so the rows at or before the frontier are
+        # a prefix of it
+        times = self.buffer[time_column]
+        bound = pa.scalar(frontier, type=times.type)
+        n = pc.sum(pc.less_equal(times, bound)).as_py() or 0
+        taken = self.buffer.slice(0, n)
+        self.buffer = self.buffer.slice(n)
+        return taken
+
+
+def _with_asset(table: "pa.Table", index: int, labels: "pa.Array") -> "pa.Table":
+    indices = pa.array([index] * table.num_rows, type=pa.int32())
+    assets = pa.DictionaryArray.from_arrays(indices, labels)
+    return table.add_column(1, "assetid", assets)
+
+
+def iter_merged(
+    assets: list,
+    from_date: Union[dt.date, str],
+    upto_date: Union[dt.date, str],
+    dtype: str = "trades",
+    venue: str = "binance",
+    columns: list = None,
+    batch_size: int = 100_000,
+    read_rows: int = 65_536,
+):
+    """Yield record batches of up to `batch_size` rows from several assets
+    merged in time order, for dates in [from_date, upto_date).
+
+    `assets` lists assetids, or (venue, assetid) pairs to mix venues, e.g.
+    [("binance", "BTCUSDT_BNC"), ("binance_usdfut", "BTCUSDT_PF_BNC")].  The
+    batches have the time column, an 'assetid' (dictionary) column and the
+    requested columns, by default those of the first asset's first file.
+    Types are cast to those of the first asset.
+    """
+    keys = [(venue, a) if isinstance(a, str) else tuple(a) for a in assets]
+    files = []
+    for v, assetid in keys:
+        fns = qsec.marketdata.item_filenames(assetid, from_date, upto_date,
+                                             dtype, v)
+        if not fns:
+            logging.warning(f"no '{dtype}' data for '{assetid}' on '{v}'")
+        files.append(fns)
+    if not any(files):
+        raise Exception(f"no '{dtype}' data for {assets} from {from_date} "
+                        f"upto {upto_date}")
+
+    if columns is None:
+        first = next(fns for fns in files if fns)[0]
+        columns = [c for c in pq.read_schema(first).names
+                   if c != time_column and not c.startswith("__")]
+    columns = [time_column] + [c for c in columns if c != time_column]
+    labels = pa.array([assetid for _, assetid in keys])
+
+    sources = [
+        _Source(i, fns, columns, read_rows) for i, fns in enumerate(files) if fns
+    ]
+    active = [s for s in sources if s.fill()]
+    if not active:
+        return
+    schema = active[0].buffer.schema.remove_metadata()
+    for s in active:
+        s.schema = schema
+        s.buffer = s.buffer.cast(schema)
+
+    pending = []
+    pending_rows = 0
+    while active:
+        frontier = min(s.last_time() for s in active)
+        parts = [
+            _with_asset(s.take_upto(frontier), s.index, labels) for s in active
+        ]
+        # concatenated in asset order and sorted stably, so ties keep it
+        block = pa.concat_tables(parts).sort_by(time_column)
+        pending.append(block)
+        pending_rows += block.num_rows
+        while pending_rows >= batch_size:
+            out = pa.concat_tables(pending)
+            for batch in out.slice(0, batch_size).combine_chunks().to_batches():
+                yield batch
+            rest = out.slice(batch_size)
+            pending, pending_rows = [rest], rest.num_rows
+        active = [s for s in active if s.buffer.num_rows or s.fill()]
+
+    if pending_rows:
+        out = pa.concat_tables(pending).combine_chunks()
+        for batch in out.to_batches():
+            yield batch
+
+
+def iter_merged_frames(*args, **kwargs):
+    """As iter_merged, yielding DataFrames indexed by time"""
+    for batch in iter_merged(*args, **kwargs):
+        yield batch.to_pandas().set_index(time_column)
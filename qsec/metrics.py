@@ -0,0 +1,224 @@
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+# Lightweight in-process instrumentation: counters, gauges and histograms
+# keyed by name and labels, plus an optional JSON lines event log.  Metrics
+# can be exported as a Prometheus text file (e.g. for the node_exporter
+# textfile collector) or as JSON.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 2.5e5, 5e5, 1e6, 1e7)
+ROWS_BUCKETS = (0, 1, 10, 100, 250, 500, 750, 999, 1000, 1500)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": dict(zip([str(b) for b in self.buckets], self.counts)),
+            "overflow": self.counts[-1],
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def _scope_key(name: str, labels: dict) -> str:
+    return "_".join([name] + [str(v) for _, v in sorted(labels.items())])
+
+
+def _prom_labels(labels, extra=None) -> str:
+    items = list(labels) + (extra or [])
+    if not items:
+        return ""
+    text = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in items
+    )
+    return "{" + text + "}"
+
+
+class Registry:
+    def __init__(self, prefix: str = "qsec_"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._events = None
+
+    # --- recording ---
+
+    def inc(self, name: str, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._add_to_scopes(name, labels, value)
+
+    def gauge(self, name: str, value, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value, buckets=LATENCY_BUCKETS, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(buckets)
+            hist.observe(value)
+        self._add_to_scopes(name, labels, value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    # --- scopes: per-unit-of-work totals, e.g. one day of trades ---
+
+    def _add_to_scopes(self, name, labels, value):
+        for totals in getattr(self._local, "scopes", ()):
+            key = _scope_key(name, labels)
+            totals[key] = totals.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def scope(self, kind: str, **fields):
+        """Emit one event summarising all metrics recorded within the block.
+
+        The yielded dict can be used to attach further fields to the event.
+        """
+        scopes = getattr(self._local, "scopes", None)
+        if scopes is None:
+            scopes = self._local.scopes = []
+        totals = {}
+        extra = {}
+        scopes.append(totals)
+        t0 = time.perf_counter()
+        try:
+            yield extra
+        finally:
+            scopes.remove(totals)
+            self.event(kind, seconds=time.perf_counter() - t0, **fields,
+                       **extra, totals=totals)
+
+    # --- events ---
+
+    def open_event_log(self, fn: str):
+        self.close_event_log()
+        self._events = open(fn, "a")
+
+    def close_event_log(self):
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+
+    @property
+    def events_enabled(self) -> bool:
+        return self._events is not None
+
+    def event(self, kind: str, **fields):
+        if self._events is None:
+            return
+        record = {"ts": round(time.time(), 6), "event": kind, **fields}
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._events is not None:
+                self._events.write(line)
+
+    # --- export ---
+
+    def snapshot(self) -> dict:
+        def flat(items, fn):
+            return [
+                {"name": name, "labels": dict(labels), **fn(value)}
+                for (name, labels), value in sorted(items)
+            ]
+
+        with self._lock:
+            return {
+                "counters": flat(self._counters.items(), lambda v: {"value": v}),
+                "gauges": flat(self._gauges.items(), lambda v: {"value": v}),
+                "histograms": flat(self._histograms.items(),
+                                   lambda h: h.to_dict()),
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                name = self.prefix + name
+                header(name, "counter")
+                lines.append(f"{name}{_prom_labels(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                name = self.prefix + name
+                header(name, "gauge")
+                lines.append(f"{name}{_prom_labels(labels)} {value}")
+            for (name, labels), hist in sorted(self._histograms.items()):
+                name = self.prefix + name
+                header(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    le = _prom_labels(labels, [("le", bound)])
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                le = _prom_labels(labels, [("le", "+Inf")])
+                lines.append(f"{name}_bucket{le} {hist.count}")
+                lines.append(f"{name}_sum{_prom_labels(labels)} {hist.sum}")
+                lines.append(f"{name}_count{_prom_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, fn: str):
+        # write-then-rename, so a scraper never sees a partial file
+        tmp = f"{fn}.tmp.{os.getpid()}"
+        with open(tmp, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, fn)
+
+    def write_summary(self):
+        self.event("summary", **self.snapshot())
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+# The process-wide registry used by qsec and the tools
+registry = Registry()
+
+inc = registry.inc
+gauge = registry.gauge
+observe = registry.observe
+timer = registry.timer
+scope = registry.scope
+event = registry.event
@@ -0,0 +1,243 @@
+import datetime as dt
+import json
+import logging
+import math
+import os
+import threading
+from collections import deque
+
+import qsec.lazy
+import qsec.marketdata
+import qsec.time
+
+np = qsec.lazy.lazy_import("numpy")
+pd = qsec.lazy.lazy_import("pandas")
+
+
+# Online estimators of rolling statistics over bars, for data that grows
+# intraday (see follow mode), so each new bar costs O(1) rather than a
+# recomputation over the whole history.
+#
+# RollingStats consumes bars as written by the fetch tools' normalise_klines,
+# indexed by close time, and skips bars at or before the last one it has
+# seen.  Its state (the estimators, the rolling window's values and the last
+# bar seen) is a small JSON file kept next to the asset's day files,
+#
+#   ~/MDHOME/tickdata-parq/{dtype}/{venue}/{assetid}/rolling-w{window}-h{halflife}.json
+#
+# so that catch_up() reads only the bars stored since the previous update.
+
+
+class Ewma:
+    """Exponentially weighted mean and variance, with a halflife in updates"""
+
+    def __init__(self, halflife: float, state: dict = None):
+        self.alpha = 1.0 - 0.5 ** (1.0 / halflife)
+        state = state or {}
+        self.mean = state.get("mean")
+        self.var = state.get("var", 0.0)
+
+    def update(self, x: float):
+        if self.mean is None:
+            self.mean = x
+            return
+        d = x - self.mean
+        self.mean += self.alpha * d
+        self.var = (1.0 - self.alpha) * (self.var + self.alpha * d * d)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.var)
+
+    def state(self) -> dict:
+        return {"mean": self.mean, "var": self.var}
+
+
+class Rolling:
+    """Sum, mean and variance of the last n values, updated in O(1).
+
+    The running sums are recomputed from the window every n updates, so
+    rounding errors do not accumulate.
+    """
+
+    def __init__(self, n: int, state: dict = None):
+        self.n = n
+        self.values = deque((state or {}).get("values", []), maxlen=n)
+        self._resum()
+
+    def _resum(self):
+        self.total = math.fsum(self.values)
+        self.total_sq = math.fsum(v * v for v in self.values)
+        self._updates = 0
+
+    def update(self, x: float):
+        if len(self.values) == self.n:
+            old = self.values[0]
+            self.total -= old
+            self.total_sq -= old * old
+        self.values.append(x)
+        self.total += x
+        self.total_sq += x * x
+        self._updates += 1
+        if self._updates >= self.n:
+            self._resum()
+
+    @property
+    def full(self) -> bool:
+        return len(self.values) == self.n
+
+    @property
+    def mean(self) -> float:
+        return self.total / len(self.values) if self.values else math.nan
+
+    @property
+    def std(self) -> float:
+        k = len(self.values)
+        if k < 2:
+            return math.nan
+        var = (self.total_sq - self.total * self.total / k) / (k - 1)
+        return math.sqrt(max(var, 0.0))
+
+    def state(self) -> dict:
+        return {"values": list(self.values)}
+
+
+class RollingStats:
+    """Rolling return, volatility and z-score statistics of bars, updated
+    bar by bar.
+
+    For each new bar: its log return from the previous close; the EWMA mean
+    and volatility of returns (halflife in bars); the rolling mean and
+    standard deviation of returns and realised volatility (the root of the
+    sum of squared returns) over `window` bars; and the z-score of the close
+    against the rolling mean and standard deviation of closes.  Rolling
+    values are NaN until the window is full.
+    """
+
+    columns = ["close", "return", "ewm_mean", "ewm_vol", "mean", "std",
+               "realised_vol", "zscore"]
+
+    def __init__(self, window: int = 60, halflife: float = 30.0,
+                 state: dict = None):
+        state = state or {}
+        self.window = window
+        self.halflife = halflife
+        self.last_time = state.get("last_time")
+        self.last_close = state.get("last_close")
+        self.ewma = Ewma(halflife, state.get("ewma"))
+        self.returns = Rolling(window, state.get("returns"))
+        self.squares = Rolling(window, state.get("squares"))
+        self.closes = Rolling(window, state.get("closes"))
+
+    def update(self, bars: "pd.DataFrame") -> "pd.DataFrame":
+        """Statistics for the bars after the last seen, one row per bar"""
+        if bars.empty:
+            return pd.DataFrame(columns=self.columns)
+        times = qsec.time.datetime64_to_epoch_ms(bars.index.values)
+        keep = np.ones(len(times), dtype=bool)
+        if self.last_time is not None:
+            keep = times > self.last_time
+        times = times[keep]
+        closes = bars["close"].to_numpy(dtype=np.float64)[keep]
+        out = np.full((len(times), len(self.columns)), np.nan)
+        for i, close in enumerate(closes.tolist()):
+            row = out[i]
+            row[0] = close
+            if self.last_close is not None:
+                r = math.log(close / self.last_close)
+                self.ewma.update(r)
+                self.returns.update(r)
+                self.squares.update(r * r)
+                row[1] = r
+                row[2] = self.ewma.mean
+                row[3] = self.ewma.std
+                if self.returns.full:
+                    row[4] = self.returns.mean
+                    row[5] = self.returns.std
+                    row[6] = math.sqrt(self.squares.total)
+            self.closes.update(close)
+            if self.closes.full:
+                std = self.closes.std
+                row[7] = (close - self.closes.mean) / std if std > 0 else math.nan
+            self.last_close = close
+        if len(times):
+            self.last_time = int(times[-1])
+        index = pd.DatetimeIndex(qsec.time.epoch_ms_to_datetime64(times),
+                                 name="time")
+        return pd.DataFrame(out, index=index, columns=self.columns)
+
+    def state(self) -> dict:
+        return {
+            "window": self.window,
+            "halflife": self.halflife,
+            "last_time": self.last_time,
+            "last_close": self.last_close,
+            "ewma": self.ewma.state(),
+            "returns": self.returns.state(),
+            "squares": self.squares.state(),
+            "closes": self.closes.state(),
+        }
+
+
+def state_filename(assetid: str, venue: str, dtype: str, window: int,
+                   halflife: float) -> str:
+    return "{}/{}/{}/{}/rolling-w{}-h{:g}.json".format(
+        qsec.marketdata.md_home(), dtype, venue, assetid, window, halflife)
+
+
+def load(assetid: str, venue: str = "binance", dtype: str = "bars1m",
+         window: int = 60, halflife: float = 30.0) -> RollingStats:
+    """The persisted statistics of an asset's bars, or new ones"""
+    fn = state_filename(assetid, venue, dtype, window, halflife)
+    if not os.path.exists(fn):
+        return RollingStats(window, halflife)
+    with open(fn) as f:
+        return RollingStats(window, halflife, json.load(f))
+
+
+def save(stats: RollingStats, assetid: str, venue: str = "binance",
+         dtype: str = "bars1m"):
+    fn = state_filename(assetid, venue, dtype, stats.window, stats.halflife)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp = f"{fn}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(stats.state(), f)
+        os.replace(tmp, fn)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def catch_up(assetid: str, venue: str = "binance", dtype: str = "bars1m",
+             window: int = 60, halflife: float = 30.0,
+             from_date: dt.date = None) -> "pd.DataFrame":
+    """Update an asset's persisted statistics from the bars stored since
+    they were last updated, or since `from_date` if there are none, through
+    today's live file; returns the statistics of those bars"""
+    stats = load(assetid, venue, dtype, window, halflife)
+    if stats.last_time is not None:
+        from_date = qsec.time.epoch_ms_to_date(stats.last_time)
+    elif from_date is None:
+        raise Exception(f"no rolling statistics for '{assetid}' yet; give "
+                        "a date to start from")
+    today = qsec.time.epoch_ms_to_date(qsec.time.now_epoch_ms())
+    frames = []
+    for d in qsec.time.dates_in_range(from_date, today + dt.timedelta(days=1)):
+        fn = qsec.marketdata.item_filename(assetid, d, dtype, venue, dtype)
+        if os.path.exists(fn):
+            table = qsec.marketdata.read_item(fn, ["close"])
+        elif os.path.exists(fn + qsec.marketdata.live_suffix):
+            table = qsec.marketdata.read_live(fn + qsec.marketdata.live_suffix)
+        else:
+            continue
+        if table is not None and table.num_rows:
+            frames.append(stats.update(table.to_pandas()))
+    save(stats, assetid, venue, dtype)
+    if not frames:
+        return pd.DataFrame(columns=RollingStats.columns)
+    df = pd.concat(frames)
+    logging.info("rolling statistics of {} updated with {} bars".format(
+        assetid, len(df)))
+    return df
@@ -0,0 +1,140 @@
+import logging
+import queue
+import threading
+import time
+
+import qsec.metrics
+
+
+# A pipeline of stages, each run by one or more threads, connected by bounded
+# queues.  Work items pass from stage to stage; when a queue is full the stage
+# feeding it blocks, so a slow stage holds back those before it rather than
+# letting results pile up in memory (backpressure).  With a download split
+# into fetch -> decode -> write, the network wait for one day overlaps the
+# decoding and compression of the previous ones; those release the GIL for
+# much of their time (socket reads, zlib, parquet encoding).
+#
+# If any stage raises, the pipeline stops and run() re-raises the first error.
+
+_end = object()
+
+
+class _Stage:
+    def __init__(self, name: str, fn, workers: int):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.running = workers
+        self.items = 0
+
+
+class Pipeline:
+    def __init__(self, queue_size: int = 2):
+        self.queue_size = queue_size
+        self._stages = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error = None
+
+    def stage(self, name: str, fn, workers: int = 1):
+        """Add a stage calling `fn(item)` for each item; its result, unless
+        None, is passed to the next stage"""
+        if workers < 1:
+            raise Exception(f"stage '{name}' needs at least one worker")
+        self._stages.append(_Stage(name, fn, workers))
+        return self
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _end
+
+    def _fail(self, err: BaseException):
+        with self._lock:
+            if self._error is None:
+                self._error = err
+        self._stop.set()
+
+    def _feed(self, items, q: queue.Queue):
+        try:
+            for item in items:
+                if not self._put(q, item):
+                    return
+            for _ in range(self._stages[0].workers):
+                self._put(q, _end)
+        except BaseException as err:
+            self._fail(err)
+
+    def _work(self, index: int, inq: queue.Queue, outq: queue.Queue):
+        stage = self._stages[index]
+        try:
+            while True:
+                item = self._get(inq)
+                if item is _end:
+                    break
+                t0 = time.perf_counter()
+                result = stage.fn(item)
+                qsec.metrics.observe("pipeline_stage_seconds",
+                                     time.perf_counter() - t0, stage=stage.name)
+                with self._lock:
+                    stage.items += 1
+                if result is not None and outq is not None:
+                    t0 = time.perf_counter()
+                    if not self._put(outq, result):
+                        break
+                    # time blocked on a full queue is backpressure
+                    qsec.metrics.inc("pipeline_blocked_seconds",
+                                     time.perf_counter() - t0, stage=stage.name)
+                    qsec.metrics.gauge("pipeline_queue_depth", outq.qsize(),
+                                       stage=stage.name)
+        except BaseException as err:
+            self._fail(err)
+        finally:
+            with self._lock:
+                stage.running -= 1
+                last = stage.running == 0
+            # the last worker out tells each worker of the next stage
+            if last and outq is not None:
+                for _ in range(self._stages[index + 1].workers):
+                    self._put(outq, _end)
+
+    def run(self, items) -> dict:
+        """Pass items through all stages; returns items processed per stage"""
+        if not self._stages:
+            raise Exception("pipeline has no stages")
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self._stages]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]),
+                                    name="pipeline-feed", daemon=True)]
+        for i, stage in enumerate(self._stages):
+            outq = queues[i + 1] if i + 1 < len(self._stages) else None
+            for n in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(i, queues[i], outq),
+                    name=f"pipeline-{stage.name}-{n}", daemon=True))
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(0.5)
+        except BaseException:
+            # e.g. KeyboardInterrupt; let the workers wind down
+            self._stop.set()
+            raise
+        if self._error is not None:
+            raise self._error
+        counts = {s.name: s.items for s in self._stages}
+        logging.debug("pipeline processed %s", counts)
+        return counts
@@ -0,0 +1,413 @@
+import argparse
+import datetime as dt
+import glob
+import logging
+import os
+import threading
+from pathlib import Path
+
+import qsec.lazy
+import qsec.logging
+import qsec.time
+
+pd = qsec.lazy.lazy_import("pandas")
+
+
+# In-memory reference data service.  The latest asset snapshot installed under
+# MDHOME by bin/generate-refdata.sh is loaded once per process and indexed for
+# constant time lookups.  The loaded index is memoised and transparently
+# reloaded when the snapshot file (or the 'latest' symlink) changes.
+#
+# Snapshot history is kept as a single change-log table, one row per
+# (assetid, field) value with the half-open date range [valid_from, valid_to)
+# over which it applied, so point-in-time questions can be answered without
+# reading every dated snapshot.
+
+
+def refdata_home() -> str:
+    return f"{Path.home()}/MDHOME/ref/assets"
+
+
+def snapshot_filename(date_str: str) -> str:
+    return f"{refdata_home()}/{date_str}/assets-{date_str}.parq"
+
+
+def history_filename() -> str:
+    return f"{refdata_home()}/assets-history.parq"
+
+
+def latest_snapshot_filename() -> str:
+    # prefer parquet snapshots, but fall back to the legacy csv format
+    for ext in ["parq", "csv"]:
+        fn = f"{refdata_home()}/assets-latest.{ext}"
+        if os.path.exists(fn):
+            return fn
+    raise Exception(
+        "no reference data found under '{}'; run bin/generate-refdata.sh".format(
+            refdata_home()
+        )
+    )
+
+
+def read_snapshot(fn: str) -> "pd.DataFrame":
+    if fn.endswith(".csv"):
+        df = pd.read_csv(fn)
+    else:
+        df = pd.read_parquet(fn)
+    if "assetid" not in df.columns:
+        df = df.reset_index()
+    return df
+
+
+def write_snapshot(df: "pd.DataFrame", date_str: str) -> str:
+    """Install a snapshot for a date and repoint the 'latest' symlink to it"""
+    fn = snapshot_filename(date_str)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp = f"{fn}.tmp.{os.getpid()}"
+    df.to_parquet(tmp, index="assetid" in df.index.names)
+    os.replace(tmp, fn)
+    link = f"{refdata_home()}/assets-latest.parq"
+    tmp_link = f"{link}.tmp.{os.getpid()}"
+    os.symlink(fn, tmp_link)
+    os.replace(tmp_link, link)
+    logging.info("installed reference data snapshot '{}'".format(fn))
+    return fn
+
+
+class AssetIndex:
+    """Assets keyed by assetid, with secondary indexes.
+
+    Each asset is a plain dict of its reference data fields, e.g.
+    index.get("BTCUSDT_PF_BNC")["tickSize"].
+    """
+
+    def __init__(self, df: "pd.DataFrame"):
+        if "assetid" not in df.columns:
+            df = df.reset_index()
+        if not df["assetid"].is_unique:
+            raise Exception("reference data has duplicate assetids")
+        self.frame = df.set_index("assetid", drop=False)
+        self._assets = {}
+        self._by_symbol = {}
+        self._by_venue_symbol = {}
+        self._by_pair = {}
+        self._by_venue = {}
+        for row in df.to_dict("records"):
+            row = {k: (None if _isnull(v) else v) for k, v in row.items()}
+            assetid = row["assetid"]
+            self._assets[assetid] = row
+            symbol = row.get("symbol")
+            venue = row.get("venue")
+            self._by_venue_symbol[(venue, symbol)] = row
+            self._by_symbol.setdefault(symbol, []).append(row)
+            pair = (row.get("baseAsset"), row.get("quoteAsset"))
+            self._by_pair.setdefault(pair, []).append(row)
+            self._by_venue.setdefault(venue, []).append(row)
+
+    def __len__(self):
+        return len(self._assets)
+
+    def __contains__(self, assetid):
+        return assetid in self._assets
+
+    def __iter__(self):
+        return iter(self._assets.values())
+
+    def get(self, assetid: str) -> dict:
+        try:
+            return self._assets[assetid]
+        except KeyError:
+            raise Exception(f"unknown assetid '{assetid}'")
+
+    def lookup(self, symbol: str, venue: str = None) -> dict:
+        """Find an asset by its native exchange symbol"""
+        if venue is not None:
+            row = self._by_venue_symbol.get((venue, symbol))
+            if row is None:
+                raise Exception(f"unknown symbol '{symbol}' for venue '{venue}'")
+            return row
+        rows = self._by_symbol.get(symbol, [])
+        if len(rows) != 1:
+            raise Exception(
+                "symbol '{}' matches {} assets, specify a venue".format(
+                    symbol, len(rows)
+                )
+            )
+        return rows[0]
+
+    def assetid(self, symbol: str, venue: str = None) -> str:
+        return self.lookup(symbol, venue)["assetid"]
+
+    def by_pair(self, base: str, quote: str) -> list:
+        return list(self._by_pair.get((base, quote), []))
+
+    def by_venue(self, venue: str) -> list:
+        return list(self._by_venue.get(venue, []))
+
+    def venues(self) -> list:
+        return sorted(v for v in self._by_venue if v is not None)
+
+    def find(self, **fields) -> list:
+        """Assets matching all given field values, e.g. find(venue=.., status=..)"""
+        venue = fields.pop("venue", None)
+        rows = self._by_venue.get(venue, []) if venue is not None else self
+        return [r for r in rows if all(r.get(k) == v for k, v in fields.items())]
+
+    def tick_size(self, assetid: str):
+        return self.get(assetid).get("tickSize")
+
+    def lot_size(self, assetid: str):
+        return self.get(assetid).get("lotQty")
+
+
+def _isnull(value) -> bool:
+    return value is None or value is pd.NA or (
+        isinstance(value, float) and value != value
+    )
+
+
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+def _file_key(fn: str):
+    st = os.stat(fn)
+    return os.path.realpath(fn), st.st_mtime_ns, st.st_size
+
+
+def _load_cached(fn: str, loader):
+    key = _file_key(fn)
+    with _cache_lock:
+        cached = _cache.get(fn)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    logging.info("loading reference data from '{}'".format(key[0]))
+    value = loader(fn)
+    with _cache_lock:
+        _cache[fn] = (key, value)
+    return value
+
+
+def load_assets(fn: str = None) -> AssetIndex:
+    """Return the asset index for a snapshot file, by default the latest.
+
+    The index is built once and memoised; it is rebuilt only when the file's
+    resolved path, mtime or size change.
+    """
+    fn = fn or latest_snapshot_filename()
+    return _load_cached(fn, lambda f: AssetIndex(read_snapshot(f)))
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+# --- Point-in-time history ---
+
+history_columns = ["assetid", "field", "value", "valid_from", "valid_to"]
+
+
+def _value_str(value) -> str:
+    # Values are stored as strings, so that change detection is independent of
+    # the dtype pandas happened to infer for a column in a given snapshot.
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _snapshot_to_long(df: "pd.DataFrame") -> "pd.DataFrame":
+    if "assetid" not in df.columns:
+        df = df.reset_index()
+    long = df.melt(id_vars="assetid", var_name="field", value_name="value")
+    long = long[long["value"].notna()].copy()
+    long["value"] = long["value"].map(_value_str)
+    return long
+
+
+def _empty_history() -> "pd.DataFrame":
+    df = pd.DataFrame(columns=history_columns)
+    for col in ["valid_from", "valid_to"]:
+        df[col] = df[col].astype("datetime64[ns]")
+    return df
+
+
+def _read_history(fn: str) -> "pd.DataFrame":
+    df = pd.read_parquet(fn)
+    for col in ["valid_from", "valid_to"]:
+        df[col] = df[col].astype("datetime64[ns]")
+    return df
+
+
+def load_history(fn: str = None) -> "pd.DataFrame":
+    """The change-log table; memoised, and reloaded when the file changes"""
+    fn = fn or history_filename()
+    if not os.path.exists(fn):
+        return _empty_history()
+    return _load_cached(fn, _read_history)
+
+
+def apply_snapshot(history: "pd.DataFrame", snapshot: "pd.DataFrame",
+                   date: dt.date) -> "pd.DataFrame":
+    """Return the history updated with the asset snapshot taken on a date.
+
+    Values that changed, and assets missing from the snapshot, have their
+    open records closed at `date`; new values are opened from `date`.
+    """
+    ts = pd.Timestamp(date)
+    if len(history) and history["valid_from"].max() > ts:
+        raise Exception(
+            "snapshot date {} is before the end of the history".format(date)
+        )
+    is_open = history["valid_to"].isna()
+    closed = history[~is_open]
+    current = history[is_open]
+    new = _snapshot_to_long(snapshot)
+
+    merged = current.merge(new, on=["assetid", "field"], how="outer",
+                           suffixes=("_old", ""), indicator=True)
+    both = merged["_merge"] == "both"
+    unchanged = both & (merged["value_old"] == merged["value"])
+    ended = (merged["_merge"] == "left_only") | (both & ~unchanged)
+    started = (merged["_merge"] == "right_only") | (both & ~unchanged)
+
+    keep = merged[unchanged]
+    keep = keep.assign(value=keep["value_old"])[history_columns]
+    ending = merged[ended]
+    ending = ending.assign(value=ending["value_old"], valid_to=ts)[history_columns]
+    # a value replaced on the day it first appeared never applied to any date
+    ending = ending[ending["valid_from"] < ts]
+    starting = merged[started]
+    starting = starting.assign(valid_from=ts, valid_to=pd.NaT)[history_columns]
+
+    parts = [p for p in [closed, ending, keep, starting] if len(p)]
+    if not parts:
+        return _empty_history()
+    out = pd.concat(parts, ignore_index=True)
+    for col in ["valid_from", "valid_to"]:
+        out[col] = out[col].astype("datetime64[ns]")
+    return out.sort_values(["assetid", "field", "valid_from"], ignore_index=True)
+
+
+def write_history(history: "pd.DataFrame", fn: str = None):
+    fn = fn or history_filename()
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp = f"{fn}.tmp.{os.getpid()}"
+    history.to_parquet(tmp, index=False)
+    os.replace(tmp, fn)
+
+
+def update_history(snapshot: "pd.DataFrame", date: dt.date, fn: str = None):
+    fn = fn or history_filename()
+    history = load_history(fn)
+    history = apply_snapshot(history, snapshot, date)
+    write_history(history, fn)
+    logging.info("updated reference data history '{}'".format(fn))
+    return history
+
+
+def rebuild_history(fn: str = None) -> "pd.DataFrame":
+    """Rebuild the change-log from every dated snapshot installed in MDHOME"""
+    snapshots = {}
+    for path in glob.glob(f"{refdata_home()}/[0-9]*/assets-*.*"):
+        date_str = os.path.basename(os.path.dirname(path))
+        if path.endswith((".parq", ".csv")) and len(date_str) == 8:
+            # when both formats exist for a date, prefer parquet
+            if date_str not in snapshots or path.endswith(".parq"):
+                snapshots[date_str] = path
+    history = _empty_history()
+    for date_str in sorted(snapshots):
+        logging.info("applying snapshot '{}'".format(snapshots[date_str]))
+        date = dt.datetime.strptime(date_str, "%Y%m%d").date()
+        history = apply_snapshot(history, read_snapshot(snapshots[date_str]), date)
+    write_history(history, fn)
+    return history
+
+
+def as_of(date: dt.date, fields: list = None,
+          history: "pd.DataFrame" = None) -> "pd.DataFrame":
+    """Asset attributes in effect on a date, one row per assetid"""
+    h = load_history() if history is None else history
+    ts = pd.Timestamp(date)
+    live = (h["valid_from"] <= ts) & (h["valid_to"].isna() | (h["valid_to"] > ts))
+    if fields is not None:
+        live &= h["field"].isin(fields)
+    wide = h[live].pivot(index="assetid", columns="field", values="value")
+    wide.columns.name = None
+    return wide
+
+
+def universe_as_of(date: dt.date, history: "pd.DataFrame" = None,
+                   **fields) -> list:
+    """Assetids whose attributes matched all given values on a date, e.g.
+    universe_as_of(date, venue="binance_usdfut", type="perp", status="TRADING")
+    """
+    wide = as_of(date, list(fields.keys()), history)
+    mask = pd.Series(True, index=wide.index)
+    for field, value in fields.items():
+        if field not in wide.columns:
+            return []
+        mask &= wide[field] == _value_str(value)
+    return sorted(wide.index[mask])
+
+
+def as_of_join(panel: "pd.DataFrame", fields: list, date_col: str = "date",
+               assetid_col: str = "assetid",
+               history: "pd.DataFrame" = None) -> "pd.DataFrame":
+    """Add the attributes in effect on each row's date to a panel.
+
+    `panel` has one row per (assetid, date); the result has an extra column
+    per field, None where the attribute was not defined on that date.
+    """
+    h = load_history() if history is None else history
+    out = panel.copy()
+    out["_row"] = range(len(out))
+    dates = pd.to_datetime(out[date_col]).astype("datetime64[ns]")
+    left = out[["_row", assetid_col]].assign(_date=dates).sort_values("_date")
+    for field in fields:
+        right = h[h["field"] == field][["assetid", "value", "valid_from",
+                                        "valid_to"]]
+        right = right.sort_values("valid_from")
+        merged = pd.merge_asof(
+            left, right, left_on="_date", right_on="valid_from",
+            left_by=assetid_col, right_by="assetid", direction="backward",
+        )
+        expired = merged["valid_to"].notna() & (merged["_date"] >= merged["valid_to"])
+        values = merged["value"].where(~expired, None)
+        out[field] = pd.Series(values.values, index=merged["_row"].values).reindex(
+            out["_row"].values).values
+    return out.drop(columns="_row")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--snapshot", type=str, help="asset snapshot file to add to the history"
+    )
+    parser.add_argument(
+        "--date", type=str, help="snapshot date, as YYYYMMDD; default today"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="rebuild the history from all installed dated snapshots",
+    )
+    return parser.parse_args()
+
+
+def main():
+    qsec.logging.init_logging()
+    args = parse_args()
+    if args.rebuild:
+        history = rebuild_history()
+    elif args.snapshot:
+        date = (qsec.time.to_date(args.date) if args.date else
+                qsec.time.epoch_ms_to_date(qsec.time.now_epoch_ms()))
+        history = update_history(read_snapshot(args.snapshot), date)
+    else:
+        raise Exception("one of --snapshot or --rebuild is required")
+    logging.info("history has {} records".format(len(history)))
+
+
+if __name__ == "__main__":
+    main()
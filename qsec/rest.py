@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+
+import qsec.lazy
+import qsec.metrics
+
+requests = qsec.lazy.lazy_import("requests")
+
+
+# Instrumented HTTP GET for the Binance REST APIs.  Every request records its
+# latency, status, reply size and the exchange reported request weight.
+# Rate-limit replies (429/418) and transient server or connection errors are
+# retried, waiting for the period the exchange asks for via Retry-After.
+#
+# Callers that issue many concurrent requests can install a WeightBudget,
+# which paces requests client side to a request-weight per minute, so that
+# the exchange limits are not hit in the first place.
+
+retry_status_codes = {418, 429, 500, 502, 503, 504}
+rate_limit_status_codes = {418, 429}
+max_retries = 5
+request_timeout = 30
+
+
+def _backoff(attempt: int) -> float:
+    return min(2.0 ** attempt, 60.0)
+
+
+def _retry_after(reply, attempt: int) -> float:
+    try:
+        return float(reply.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return _backoff(attempt)
+
+
+def _record_weight(reply):
+    for header, value in reply.headers.items():
+        header = header.lower()
+        if header.startswith("x-mbx-used-weight-") or \
+           header.startswith("x-mbx-order-count-"):
+            try:
+                value = int(value)
+            except ValueError:
+                continue
+            qsec.metrics.gauge(header.replace("-", "_"), value)
+            if header == "x-mbx-used-weight-1m" and weight_budget is not None:
+                weight_budget.observe_used(value)
+
+
+class WeightBudget:
+    """Token bucket of request weight per minute, shared across threads"""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self._rate = per_minute / 60.0
+        self._available = float(per_minute)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._available = min(
+            self.per_minute, self._available + (now - self._last) * self._rate
+        )
+        self._last = now
+
+    def acquire(self, weight: int):
+        """Block until `weight` is available, then consume it"""
+        need = min(weight, self.per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._available >= need:
+                    self._available -= weight
+                    break
+                wait = (need - self._available) / self._rate
+            time.sleep(wait)
+            waited += wait
+        if waited:
+            qsec.metrics.inc("http_weight_wait_seconds_total", waited)
+
+    def observe_used(self, used: int):
+        """Account for the weight the exchange reports as used this minute,
+        which includes requests made by other processes on the same IP"""
+        with self._lock:
+            self._refill()
+            self._available = min(self._available, self.per_minute - used)
+
+
+weight_budget = None
+
+# one requests session, and so one connection pool, per thread
+_local = threading.local()
+
+
+def _session():
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def set_weight_budget(per_minute: int):
+    global weight_budget
+    weight_budget = WeightBudget(per_minute) if per_minute else None
+
+
+def get(url: str, params: dict = None, endpoint: str = None,
+        weight: int = None) -> str:
+    """Perform a GET request, returning the reply text"""
+    return request(url, params, endpoint, weight=weight).text
+
+
+def request(url: str, params: dict = None, endpoint: str = None,
+            headers: dict = None, weight: int = None):
+    """Perform a GET request, returning the reply; status is 200 or 304.
+
+    If a weight budget is installed, the request first waits for `weight`.
+    """
+    endpoint = endpoint or url
+    attempt = 0
+    while True:
+        if weight_budget is not None and weight:
+            weight_budget.acquire(weight)
+        t0 = time.perf_counter()
+        try:
+            reply = _session().get(url, params=params, headers=headers,
+                                 timeout=request_timeout)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            elapsed = time.perf_counter() - t0
+            qsec.metrics.inc("http_errors_total", endpoint=endpoint)
+            qsec.metrics.event("http", endpoint=endpoint, status=None,
+                               seconds=elapsed, attempt=attempt,
+                               error=str(err))
+            if attempt >= max_retries:
+                raise
+            wait = _backoff(attempt)
+            logging.warning(f"http request error, retrying in {wait}s: {err}")
+        else:
+            elapsed = time.perf_counter() - t0
+            size = len(reply.content)
+            status = reply.status_code
+            qsec.metrics.observe("http_request_seconds", elapsed,
+                                 endpoint=endpoint)
+            qsec.metrics.observe("http_response_bytes", size,
+                                 qsec.metrics.BYTES_BUCKETS, endpoint=endpoint)
+            qsec.metrics.inc("http_requests_total", endpoint=endpoint,
+                             status=status)
+            _record_weight(reply)
+            qsec.metrics.event("http", endpoint=endpoint, status=status,
+                               seconds=elapsed, bytes=size, attempt=attempt)
+
+            if status in (200, 304):
+                return reply
+
+            if status not in retry_status_codes or attempt >= max_retries:
+                raise Exception(
+                    "http request failed, error-code {}, msg: {}".format(
+                        status, reply.text
+                    )
+                )
+            wait = _retry_after(reply, attempt)
+            if status in rate_limit_status_codes:
+                qsec.metrics.inc("http_rate_limit_wait_seconds_total", wait,
+                                 endpoint=endpoint)
+            logging.warning(
+                f"http request failed with {status}, retrying in {wait}s"
+            )
+        qsec.metrics.inc("http_retries_total", endpoint=endpoint)
+        time.sleep(wait)
+        attempt += 1
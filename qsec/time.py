@@ -1,11 +1,54 @@
 import datetime as dt
-import pytz
+import functools
 import time
 from typing import Optional, Union
 
+import qsec.lazy
+
+np = qsec.lazy.lazy_import("numpy")
+
+
+# All helpers here work in UTC.  Epoch milliseconds are computed with integer
+# arithmetic, so round trips between datetimes and epoch-ms are exact.
+
+UTC = dt.timezone.utc
+EPOCH = dt.datetime(1970, 1, 1, tzinfo=UTC)
+EPOCH_DATE = dt.date(1970, 1, 1)
+
+ONE_MS = dt.timedelta(milliseconds=1)
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+DAY_MS = 24 * HOUR_MS
+WEEK_MS = 7 * DAY_MS
+
+# Binance weekly klines open on Monday; the epoch was a Thursday
+WEEK_OFFSET_MS = 4 * DAY_MS
+
+# Duration of each Binance kline interval.  The monthly interval, "1M", has
+# no fixed duration and is handled separately using calendar months.
+KLINE_INTERVAL_MS = {
+    "1s": 1000,
+    "1m": MINUTE_MS,
+    "3m": 3 * MINUTE_MS,
+    "5m": 5 * MINUTE_MS,
+    "15m": 15 * MINUTE_MS,
+    "30m": 30 * MINUTE_MS,
+    "1h": HOUR_MS,
+    "2h": 2 * HOUR_MS,
+    "4h": 4 * HOUR_MS,
+    "6h": 6 * HOUR_MS,
+    "8h": 8 * HOUR_MS,
+    "12h": 12 * HOUR_MS,
+    "1d": DAY_MS,
+    "3d": 3 * DAY_MS,
+    "1w": WEEK_MS,
+}
+
+KLINE_INTERVALS = list(KLINE_INTERVAL_MS.keys()) + ["1M"]
+
 
 def short_fmt(date: dt.date) -> str:
-    return dt.datetime.strftime(date, "%Y%m%d")
+    return "{:04d}{:02d}{:02d}".format(date.year, date.month, date.day)
 
 
 def date_to_datetime(
@@ -14,9 +57,7 @@ def date_to_datetime(
     minute: Optional[int] = 0,
     second: Optional[int] = 0,
 ) -> dt.datetime:
-    return dt.datetime(d.year, d.month, d.day, hour, minute, second).replace(
-        tzinfo=pytz.UTC
-    )
+    return dt.datetime(d.year, d.month, d.day, hour, minute, second, tzinfo=UTC)
 
 
 def date_range(lower: Union[dt.date, str], upper: Union[dt.date, str]):
@@ -30,53 +71,212 @@ def date_range(lower: Union[dt.date, str], upper: Union[dt.date, str]):
 
 
 def dates_in_range(lower: dt.date, upper: dt.date) -> list:
-    dates = []
-    date = lower
-    while date < upper:
-        dates.append(date)
-        date += dt.timedelta(days=1)
-    return dates
+    n = (upper - lower).days
+    return [lower + dt.timedelta(days=i) for i in range(max(n, 0))]
+
+
+def _parse_date(s: str) -> dt.date:
+    try:
+        if len(s) == 8 and s.isdigit():
+            return dt.date(int(s[0:4]), int(s[4:6]), int(s[6:8]))
+        if len(s) == 10 and s[4] == "-" and s[7] == "-":
+            return dt.date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+    except ValueError:
+        pass
+    return None
 
 
 def to_date(s: str) -> dt.date:
-    fmt = None
-    if len(s) == 8:
-        fmt = "%Y%m%d"
-    elif len(s) == 10:
-        fmt = "%Y-%m-%d"
-    else:
+    date = _parse_date(s)
+    if date is None:
         raise Exception("unknown date format for string '{}'".format(s))
-    return dt.datetime.strptime(s, fmt).replace(tzinfo=pytz.UTC).date()
+    return date
 
 
 # Convert a string like "2021-01-31 22:00:00" to a UTC datetime object
 def str_to_datetime_utc(s: str) -> dt.datetime:
-    fmt = None
-    if len(s) == 8:
-        fmt = "%Y%m%d"
-    elif len(s) == 10:
-        fmt = "%Y-%m-%d"
-    elif len(s) == 19:
-        fmt = "%Y-%m-%d %H:%M:%S"
-    else:
-        raise Exception("unknown timestamp format for string '{}'".format(s))
-    return dt.datetime.strptime(s, fmt).replace(tzinfo=pytz.UTC)
+    if len(s) == 19 and s[10] == " ":
+        date = _parse_date(s[0:10])
+        try:
+            hms = dt.time(int(s[11:13]), int(s[14:16]), int(s[17:19]))
+        except ValueError:
+            hms = None
+        if date is not None and hms is not None and s[13] == ":" and s[16] == ":":
+            return dt.datetime.combine(date, hms, tzinfo=UTC)
+    elif len(s) in (8, 10):
+        date = _parse_date(s)
+        if date is not None:
+            return date_to_datetime(date)
+    raise Exception("unknown timestamp format for string '{}'".format(s))
+
 
+# Convert a datetime object to epoch milliseconds.  Naive datetimes are taken
+# to be UTC.
+def datetime_to_epoch_ms(ts: dt.datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=UTC)
+    return (ts - EPOCH) // ONE_MS
 
-# Convert a datetime object to epoch milliseconds
-def datetime_to_epoch_ms(ts: dt.datetime):
-    return int(ts.timestamp() * 1000.0)
+
+def date_to_epoch_ms(date: dt.date) -> int:
+    return (date - EPOCH_DATE).days * DAY_MS
 
 
 # Get current UTC time in milliseconds since epoch
 def now_epoch_ms():
-    return int(time.time() * 1000.0)
+    return time.time_ns() // 1000000
 
 
 def epoch_ms_to_str(now):
-    ts = dt.datetime.fromtimestamp(now / 1000)
-    return ts.strftime("%Y-%m-%d %H:%M:%S.{:0>3d}".format(int(ts.microsecond / 1000)))
+    ts = epoch_ms_to_dt(now)
+    return ts.strftime("%Y-%m-%d %H:%M:%S.{:0>3d}".format(ts.microsecond // 1000))
 
 
 def epoch_ms_to_dt(epoch_ms) -> dt.datetime:
-    return dt.datetime.fromtimestamp(epoch_ms / 1000.0)
+    return EPOCH + dt.timedelta(milliseconds=int(epoch_ms))
+
+
+def epoch_ms_to_date(epoch_ms) -> dt.date:
+    return EPOCH_DATE + dt.timedelta(days=int(epoch_ms) // DAY_MS)
+
+
+# --- Day boundaries ---
+
+
+@functools.lru_cache(maxsize=4096)
+def day_bounds_ms(date: dt.date) -> tuple:
+    """Return the (start, end) epoch-ms of a UTC date, end exclusive"""
+    start = date_to_epoch_ms(date)
+    return start, start + DAY_MS
+
+
+@functools.lru_cache(maxsize=256)
+def _day_starts_ms(lower: dt.date, upper: dt.date) -> "np.ndarray":
+    start = date_to_epoch_ms(lower)
+    n = max((upper - lower).days, 0)
+    starts = start + DAY_MS * np.arange(n + 1, dtype=np.int64)
+    starts.setflags(write=False)
+    return starts
+
+
+def day_boundaries(lower: dt.date, upper: dt.date) -> "np.ndarray":
+    """Day start times, as datetime64[ms], for each date in [lower, upper].
+
+    The result has one more element than there are dates, so consecutive
+    pairs give the half-open range of each day.  Results are cached and
+    returned read-only.
+    """
+    return _day_starts_ms(lower, upper).view("datetime64[ms]")
+
+
+def day_boundaries_ms(lower: dt.date, upper: dt.date) -> "np.ndarray":
+    """As day_boundaries, but as int64 epoch milliseconds"""
+    return _day_starts_ms(lower, upper)
+
+
+def epoch_ms_to_datetime64(epoch_ms) -> "np.ndarray":
+    return np.asarray(epoch_ms, dtype=np.int64).view("datetime64[ms]")
+
+
+def datetime64_to_epoch_ms(values) -> "np.ndarray":
+    return np.asarray(values).astype("datetime64[ms]").view(np.int64)
+
+
+def epoch_ms_to_day(epoch_ms) -> "np.ndarray":
+    """Vectorised: the UTC date, as datetime64[D], of each epoch-ms value"""
+    return (np.asarray(epoch_ms, dtype=np.int64) // DAY_MS).astype("datetime64[D]")
+
+
+# --- Kline interval arithmetic ---
+
+
+def interval_ms(interval: str) -> int:
+    """Fixed duration of a kline interval; not defined for '1M'"""
+    try:
+        return KLINE_INTERVAL_MS[interval]
+    except KeyError:
+        raise Exception("no fixed duration for interval '{}'".format(interval))
+
+
+def _month_floor(epoch_ms: "np.ndarray") -> "np.ndarray":
+    months = epoch_ms.view("datetime64[ms]").astype("datetime64[M]")
+    return months.astype("datetime64[ms]").view(np.int64)
+
+
+def interval_floor(epoch_ms, interval: str) -> "np.ndarray":
+    """Vectorised: open time of the interval containing each epoch-ms value"""
+    values = np.asarray(epoch_ms, dtype=np.int64)
+    if interval == "1M":
+        return _month_floor(values)
+    step = interval_ms(interval)
+    offset = WEEK_OFFSET_MS if interval == "1w" else 0
+    return (values - offset) // step * step + offset
+
+
+def interval_ceil(epoch_ms, interval: str) -> "np.ndarray":
+    """Vectorised: first interval open time at or after each epoch-ms value"""
+    values = np.asarray(epoch_ms, dtype=np.int64)
+    floor = interval_floor(values, interval)
+    return np.where(floor == values, floor, interval_add(floor, interval, 1))
+
+
+def interval_add(epoch_ms, interval: str, n=1) -> "np.ndarray":
+    """Vectorised: advance interval-aligned open times by n intervals"""
+    values = np.asarray(epoch_ms, dtype=np.int64)
+    if interval == "1M":
+        months = values.view("datetime64[ms]").astype("datetime64[M]") + n
+        return months.astype("datetime64[ms]").view(np.int64)
+    return values + np.asarray(n, dtype=np.int64) * interval_ms(interval)
+
+
+def interval_range_ms(start_ms: int, end_ms: int, interval: str) -> "np.ndarray":
+    """Open times of all intervals starting within [start_ms, end_ms)"""
+    first = int(interval_ceil(start_ms, interval))
+    if interval == "1M":
+        lower = np.datetime64(first, "ms").astype("datetime64[M]")
+        upper = np.datetime64(end_ms - 1, "ms").astype("datetime64[M]") + 1
+        months = np.arange(lower, upper)
+        return months.astype("datetime64[ms]").view(np.int64)
+    return np.arange(first, end_ms, interval_ms(interval), dtype=np.int64)
+
+
+def epoch_ms_range(start_ms: int, end_ms: int, step_ms: int) -> "np.ndarray":
+    """Request windows: the start of each step_ms window covering the range"""
+    return np.arange(start_ms, end_ms, step_ms, dtype=np.int64)
+
+
+@functools.lru_cache(maxsize=4096)
+def _day_open_times(date: dt.date, interval: str) -> "np.ndarray":
+    start, end = day_bounds_ms(date)
+    times = interval_range_ms(start, end, interval)
+    times.setflags(write=False)
+    return times
+
+
+def day_open_times_ms(date: dt.date, interval: str) -> "np.ndarray":
+    """Open times of the bars of an interval that start on a UTC date"""
+    return _day_open_times(date, interval)
+
+
+def bars_per_day(date: dt.date, interval: str) -> int:
+    return len(_day_open_times(date, interval))
+
+
+@functools.lru_cache(maxsize=4096)
+def _day_closed_bars(date: dt.date, interval: str) -> "np.ndarray":
+    start, end = day_bounds_ms(date)
+    # bars closing in [start, end) are those whose successor opens in
+    # (start, end]
+    times = interval_add(interval_range_ms(start + 1, end + 1, interval),
+                         interval, -1)
+    times.setflags(write=False)
+    return times
+
+
+def day_closed_bars_ms(date: dt.date, interval: str) -> "np.ndarray":
+    """Open times of the bars of an interval that close on a UTC date.
+
+    Stored bars are indexed by close time, so these are the bars of a date's
+    file; for intervals of up to a day they are the bars opening on it.
+    """
+    return _day_closed_bars(date, interval)
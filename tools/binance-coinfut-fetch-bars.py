@@ -1,24 +1,33 @@
 import datetime as dt
-import requests
-import json
-import time
-import pandas as pd
 import logging
-import pyarrow as pa
-import pyarrow.parquet as pq
-import os
-import numpy as np
 import argparse
 
+import qsec.lazy
 import qsec.logging
+import qsec.metrics
+import qsec.rest
 import qsec.time
 import qsec.app
+import qsec.decode
 import common
+import follow
+import universe
+
+pd = qsec.lazy.lazy_import("pandas")
+np = qsec.lazy.lazy_import("numpy")
 
 api = "https://dapi.binance.com"
 
+# klines per request, and the request weight Binance charges for that limit
+kline_limit = 1500
+kline_weight = 10
+
 def call_http_fetch_klines(
-    symbol, startTime: int, endTime: int, interval: str = "1m", limit: int = 1500
+    symbol,
+    startTime: int,
+    endTime: int,
+    interval: str = "1m",
+    limit: int = kline_limit,
 ):
     path = "/dapi/v1/klines"
     options = {
@@ -29,15 +38,8 @@ def call_http_fetch_klines(
         "endTime": endTime,
     }
     url = f"{api}{path}"
-    logging.info("making URL request: {}, options: {}".format(url, options))
-    reply = requests.get(url, params=options)
-    if reply.status_code != 200:
-        raise Exception(
-            "http request failed, error-code {}, msg: {}".format(
-                reply.status_code, reply.text
-            )
-        )
-    return reply.text
+    logging.debug("making URL request: %s, options: %s", url, options)
+    return qsec.rest.get(url, options, endpoint=path, weight=kline_weight)
 
 
 def normalise_klines(df):
@@ -81,95 +83,140 @@ def normalise_klines(df):
     return df
 
 
-def fetch_klines_for_date(symbol: str, kline_date: dt.date, interval: str):
-    logging.info("fetching klines for date {}".format(kline_date))
-
-    # t0 and t1 and the start and end times of the date range
-    t0 = qsec.time.date_to_datetime(kline_date)
-    t1 = qsec.time.date_to_datetime(kline_date + dt.timedelta(days=1))
-
-    all_dfs = []
-    requestLimit = 1500  # binance constraint
+def fetch_kline_pages(symbol: str, kline_date: dt.date, interval: str) -> list:
+    """The raw replies of the klines requests covering a date, with the
+    request window of each"""
+    logging.info("fetching klines for {} @ {}".format(symbol, kline_date))
+    pages = []
+    windows = common.kline_request_windows(kline_date, interval, kline_limit)
+    for req_lower, req_upper in windows:
+        # make the request
+        # endTime is inclusive, so stop short of the next window
+        raw_json = call_http_fetch_klines(symbol, req_lower, req_upper - 1, interval)
+        pages.append((req_lower, req_upper, raw_json))
+    return pages
 
-    expected_rows = None
-    if interval == "1m":
-        expected_rows = 1440
 
-    lower = t0
-    while lower < t1:
-        # calc the upper range of the next request
-        upper = min(t1, lower + dt.timedelta(minutes=requestLimit))
+def decode_kline_pages(symbol: str, kline_date: dt.date, interval: str,
+                       pages: list):
+    # t0 and t1 and the start and end times of the date range
+    t0, t1 = qsec.time.day_bounds_ms(kline_date)
+
+    # rows outside each page's request window are dropped, just in case
+    # exchange has returned additional rows
+    with qsec.metrics.timer("stage_seconds", stage="decode"):
+        df, page_rows = qsec.decode.decode("klines", pages)
+    for reply_row_count in page_rows:
+        qsec.metrics.observe(
+            "page_rows", reply_row_count, qsec.metrics.ROWS_BUCKETS, endpoint="klines"
+        )
+    if df is None:
+        df = pd.DataFrame()
+    elif df.shape[0] != sum(page_rows):
+        logging.info(
+            "retained {} rows of {} within actual request ranges".format(
+                df.shape[0], sum(page_rows)
+            )
+        )
 
-        # make the request
-        req_lower = int(lower.timestamp() * 1000)
-        req_upper = int(upper.timestamp() * 1000)
-        raw_json = call_http_fetch_klines(symbol, req_lower, req_upper, interval)
-        df = pd.DataFrame(json.loads(raw_json))
-        reply_row_count = df.shape[0]
-        logging.debug(f"request returned {reply_row_count} rows")
-
-        # trim the returned dataframe to be within our request range, just in
-        # case exchange has returned additional rows
-        if not df.empty:
-            df = df.loc[(df[0] >= req_lower) & (df[0] < req_upper)]
-            if df.shape[0] != reply_row_count:
-                logging.info(
-                    "retained {} rows of {} within actual request range".format(
-                        df.shape[0], reply_row_count
-                    )
-                )
-        all_dfs.append(df)
-        lower = upper
-        del df, upper, req_lower, req_upper, raw_json, reply_row_count
-
-    df = pd.concat(all_dfs)
-    del all_dfs
-    df = normalise_klines(df)
+    with qsec.metrics.timer("stage_seconds", stage="normalise"):
+        df = normalise_klines(df)
     if df.empty:
         logging.warning(f"no data retrieved for {symbol} @ {kline_date}")
+        return df
 
     # retain only rows within user requested period
-    t0_ms = np.datetime64(int(t0.timestamp() * 1000), "ms")
-    t1_ms = np.datetime64(int(t1.timestamp() * 1000), "ms")
+    t0_ms = np.datetime64(t0, "ms")
+    t1_ms = np.datetime64(t1, "ms")
     df = df.loc[(df.index >= t0_ms) & (df.index < t1_ms)]
-
-    if expected_rows and df.shape[0] != expected_rows:
-        logging.warning(
-            "row count mismatch; expected {}, actual {}".format(
-                expected_rows, df.shape[0]
-            )
-        )
     return df
 
 
-def fetch(symbol: str, fromDt: dt.date, endDt: dt.date, sid: str, interval: str):
-    dates = qsec.time.dates_in_range(fromDt, endDt)
+def fetch_kline_window(symbol: str, lo: int, hi: int, interval: str):
+    """The normalised bars opening in [lo, hi), in one request"""
+    raw_json = call_http_fetch_klines(symbol, lo, hi - 1, interval)
+    df, _ = qsec.decode.decode("klines", [(lo, hi, raw_json)])
+    return normalise_klines(pd.DataFrame() if df is None else df)
+
+
+def repair_klines(symbol: str, kline_date: dt.date, interval: str, df):
+    return common.refetch_bar_gaps(
+        df, kline_date, interval, kline_limit,
+        lambda lo, hi: fetch_kline_window(symbol, lo, hi, interval),
+    )
+
+
+def fetch_klines_for_date(symbol: str, kline_date: dt.date, interval: str):
+    pages = fetch_kline_pages(symbol, kline_date, interval)
+    df = decode_kline_pages(symbol, kline_date, interval, pages)
+    return repair_klines(symbol, kline_date, interval, df)
+
+
+def fetch(symbol: str, fromDt: dt.date, endDt: dt.date, sid: str, interval: str,
+          fetchers: int = 1, queue_size: int = 2, archive=None):
     venue = "binance_coinfut"
-    for d in dates:
-        fn = common.build_md_item_filename(sid, d, f"bars{interval}", venue, f"bars{interval}")
-        if os.path.exists(fn):
-            logging.info("data item exists, skipping: '{}'".format(fn))
-            continue
-        df = fetch_klines_for_date(symbol, d, interval)
-        common.save_dateframe(
-            symbol, d, df, sid, venue, f"bars{interval}", f"bars{interval}"
-        )
+    dtype = f"bars{interval}"
+    dates = common.incomplete_days(
+        qsec.time.dates_in_range(fromDt, endDt), sid, venue, dtype
+    )
+
+    def decode(d, pages):
+        df = decode_kline_pages(symbol, d, interval, pages)
+        return repair_klines(symbol, d, interval, df)
+
+    def write(d, df):
+        info, _ = common.bar_completeness(df, d, interval)
+        with qsec.metrics.timer("stage_seconds", stage="write"):
+            common.save_dateframe(symbol, d, df, sid, venue, dtype, dtype,
+                                  meta=info)
+
+    common.fetch_days(
+        symbol,
+        dates,
+        common.archiving(
+            lambda d: fetch_kline_pages(symbol, d, interval),
+            archive, venue, dtype, symbol, sid,
+        ),
+        decode,
+        write,
+        fetchers,
+        queue_size,
+    )
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--sym", type=str, help="symbol", required=True)
-    parser.add_argument(
-        "--from", dest="fromDt", type=str, help="begin date", required=True
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--sym", type=str, help="symbol")
+    group.add_argument(
+        "--universe",
+        action="store_true",
+        help="fetch all assets of the venue listed in the reference data",
     )
+    parser.add_argument("--from", dest="fromDt", type=str, help="begin date")
+    parser.add_argument("--upto", dest="uptoDt", type=str, help="to date")
     parser.add_argument(
-        "--upto", dest="uptoDt", type=str, help="to date", required=True
+        "--interval",
+        dest="interval",
+        type=str,
+        help="interval time",
+        required=False,
+        default="1m",
+        choices=[i for i in qsec.time.KLINE_INTERVALS if i != "1s"],
     )
+    universe.add_universe_args(parser)
+    follow.add_follow_args(parser)
+    follow.add_rolling_args(parser)
+    common.add_pipeline_args(parser)
+    common.add_metrics_args(parser)
     return parser.parse_args()
 
 
 def process_args(args):
     try:
+        follow.check_follow_args(args)
+        if args.follow:
+            return None, None
         fromDt = qsec.time.to_date(args.fromDt)
         uptoDt = qsec.time.to_date(args.uptoDt)
         if fromDt >= uptoDt:
@@ -182,10 +229,26 @@ def process_args(args):
 def main():
     qsec.logging.init_logging()
     args = parse_args()
+    common.init_metrics(args)
+    qsec.decode.set_workers(args.decode_workers)
     fromDt, uptoDt = process_args(args)
+    interval = args.interval
+    if args.universe:
+        universe.run(
+            args, "binance_coinfut", fetch_klines_for_date, interval, fromDt, uptoDt,
+            kline_limit, kline_weight,
+        )
+        return
     sid = common.build_assetid(args.sym, "BNC")
-    interval = "1m"
-    fetch(args.sym, fromDt, uptoDt, sid, interval)
+    if args.follow:
+        follow.follow_bars(
+            args.sym, sid, "binance_coinfut", interval, call_http_fetch_klines,
+            normalise_klines, kline_limit, args.poll_seconds, args.flush_seconds,
+            args.rolling_window, args.rolling_halflife,
+        )
+        return
+    fetch(args.sym, fromDt, uptoDt, sid, interval, args.fetchers,
+          args.queue_size, common.open_archive(args))
 
 
 if __name__ == "__main__":
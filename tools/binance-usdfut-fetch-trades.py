@@ -1,17 +1,21 @@
 import datetime as dt
-import requests
 import json
 import time
-import pandas as pd
 import logging
-import pyarrow as pa
-import pyarrow.parquet as pq
 import argparse
-import os
 
+import qsec.lazy
 import qsec.logging
+import qsec.metrics
+import qsec.rest
 import qsec.time
+import qsec.app
+import qsec.decode
 import common
+import follow
+import timewindows
+
+pd = qsec.lazy.lazy_import("pandas")
 
 api = "https://fapi.binance.com"
 
@@ -34,17 +38,8 @@ def call_http_trade(symbol, start_time=None, end_time=None, fromId=None):
         options["fromId"] = fromId
 
     url = f"{api}{path}"
-    logging.info("making URL request: {}, options: {}".format(url, options))
-    reply = requests.get(url, params=options)
-
-    if reply.status_code != 200:
-        raise Exception(
-            "http request failed, error-code {}, msg: {}".format(
-                reply.status_code, reply.text
-            )
-        )
-
-    return reply.text
+    logging.debug("making URL request: %s, options: %s", url, options)
+    return qsec.rest.get(url, options, endpoint=path)
 
 
 def normalise(df):
@@ -118,46 +113,74 @@ def find_earliest_trade(symbol, beg_ms, end_ms, seek_trade_id):
     return earliest_trade_id
 
 
-def fetch_all_trades(symbol: str, beg_ms: int, end_ms: int, from_id: int):
+def find_first_trade_id(symbol: str, beg_ms: int, end_ms: int):
+    seek_trade_id = find_any_trade_in_period(symbol, beg_ms, end_ms)
+    if seek_trade_id is None:
+        return None
+    return find_earliest_trade(symbol, beg_ms, end_ms, seek_trade_id)
+
+
+def fetch_trade_pages(symbol: str, beg_ms: int, end_ms: int, from_id: int):
     logging.info("fetching all trades for window")
-    all_dfs = []
+    progress = qsec.logging.Progress(
+        "trades",
+        total=end_ms - beg_ms,
+        unit="trades",
+        describe=lambda pos: qsec.time.epoch_ms_to_dt(beg_ms + pos),
+    )
+    pages = []
     cursor = from_id
     count = 0
     while True:
         # fetch trades for current ID range
         raw_json = call_http_trade(symbol, fromId=cursor)
         time.sleep(0.5)
-        trades = pd.DataFrame(json.loads(raw_json))
-        trades = trades[trades["T"] >= beg_ms]
-        trades = trades[trades["T"] <= end_ms]
-        if len(trades) == 0:
-            break
-        all_dfs.append(trades)
-        count += len(trades)
-        cursor = max(trades["a"]) + 1
-        highest_time = max(trades["T"])
-        logging.info(
-            "trades: {}, time: {}".format(count, qsec.time.epoch_ms_to_dt(highest_time))
+        # only the first and last trades are decoded here; the decode
+        # stage decodes the whole page
+        n, first, last = qsec.decode.peek_agg_trades(raw_json)
+        qsec.metrics.observe(
+            "page_rows", n, qsec.metrics.ROWS_BUCKETS, endpoint="aggTrades"
         )
-
-    df = pd.concat(all_dfs)
-    del all_dfs
-    df = normalise(df)
+        # trades are in id, and so time, order
+        if n == 0 or first["T"] > end_ms:
+            break
+        pages.append((beg_ms, end_ms + 1, raw_json))
+        count += n
+        cursor = last["a"] + 1
+        progress.update(last["T"] - beg_ms, count)
+    progress.done()
+    return pages
+
+
+def decode_trade_pages(pages: list):
+    """Decode the raw pages of fetch_trade_pages, keeping the trades within
+    each page's window"""
+    with qsec.metrics.timer("stage_seconds", stage="decode"):
+        df, _ = qsec.decode.decode("aggTrades", pages)
+    del pages
+    if df is None:
+        df = pd.DataFrame(columns=["a", "p", "q", "f", "l", "T", "m"])
+    with qsec.metrics.timer("stage_seconds", stage="normalise"):
+        df = normalise(df)
     return df
 
 
+def fetch_all_trades(symbol: str, beg_ms: int, end_ms: int, from_id: int):
+    return decode_trade_pages(fetch_trade_pages(symbol, beg_ms, end_ms, from_id))
+
+
 def list_missing_ids(df):
     if df.shape[0] == 0:
         return []
 
-    if df.shape[0] == 1 + min(df["tradeId"]) - max(df["tradeId"]):
+    if df.shape[0] == 1 + max(df["tradeId"]) - min(df["tradeId"]):
         return []
 
     missing = []
-    expected = df["tradeId"][0]
+    expected = df["tradeId"].iloc[0]
     for x in df["tradeId"]:
         while expected != x:
-            missing.append(x)
+            missing.append(expected)
             expected += 1
         expected += 1
     return missing
@@ -166,17 +189,20 @@ def list_missing_ids(df):
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--sym", type=str, help="symbol", required=True)
-    parser.add_argument(
-        "--from", dest="fromDt", type=str, help="begin date", required=True
-    )
-    parser.add_argument(
-        "--upto", dest="uptoDt", type=str, help="to date", required=True
-    )
+    parser.add_argument("--from", dest="fromDt", type=str, help="begin date")
+    parser.add_argument("--upto", dest="uptoDt", type=str, help="to date")
+    timewindows.add_engine_args(parser)
+    follow.add_follow_args(parser)
+    common.add_pipeline_args(parser)
+    common.add_metrics_args(parser)
     return parser.parse_args()
 
 
 def process_args(args):
     try:
+        follow.check_follow_args(args)
+        if args.follow:
+            return None, None
         fromDt = qsec.time.to_date(args.fromDt)
         uptoDt = qsec.time.to_date(args.uptoDt)
         if fromDt >= uptoDt:
@@ -186,38 +212,77 @@ def process_args(args):
         raise qsec.app.EasyError(f"{e}")
 
 
-def fetch_trades_for_date(symbol: str, kline_date: dt.date):
+def fetch_trade_pages_for_date(symbol: str, kline_date: dt.date,
+                               engine: str = "id", window_workers: int = 4) -> list:
     logging.info("fetching trades for date {}".format(kline_date))
-    t0 = qsec.time.date_to_datetime(kline_date)
-    t1 = qsec.time.date_to_datetime(kline_date + dt.timedelta(days=1))
-    t0 = int(t0.timestamp() * 1000)
-    t1 = int(t1.timestamp() * 1000)
+    t0, t1 = qsec.time.day_bounds_ms(kline_date)
+    if engine == "auto":
+        engine = timewindows.choose_engine(symbol, t0, call_http_trade)
+    if engine == "time":
+        return timewindows.fetch_pages(symbol, t0, t1, call_http_trade,
+                                       window_workers)
 
     seek_trade_id = find_any_trade_in_period(symbol, t0, t1)
     logging.info(f"initial seek tradeId: {seek_trade_id}")
     earliest_trade_id = find_earliest_trade(symbol, t0, t1, seek_trade_id)
     logging.info(f"window earliest tradeId: {earliest_trade_id}")
-    df = fetch_all_trades(symbol, t0, t1, earliest_trade_id)
+    # the end of fetch_trade_pages' period is inclusive
+    return fetch_trade_pages(symbol, t0, t1 - 1, earliest_trade_id)
+
+
+def decode_trades_for_date(symbol: str, kline_date: dt.date, pages: list):
+    df = decode_trade_pages(pages)
     missingIds = list_missing_ids(df)
     if len(missingIds) == 0:
         logging.info("no missing tradeIds detected")
     return df
 
 
-def fetch(symbol: str, fromDt: dt.date, endDt: dt.date, sid: str):
+def fetch_trades_for_date(symbol: str, kline_date: dt.date):
+    pages = fetch_trade_pages_for_date(symbol, kline_date)
+    return decode_trades_for_date(symbol, kline_date, pages)
+
+
+def fetch(symbol: str, fromDt: dt.date, endDt: dt.date, sid: str,
+          fetchers: int = 1, queue_size: int = 2, archive=None,
+          engine: str = "id", window_workers: int = 4):
     dates = qsec.time.dates_in_range(fromDt, endDt)
-    for d in dates:
-        df = fetch_trades_for_date(symbol, d)
-        common.save_dateframe(symbol, d, df, sid, "binance_usdfut", "trades")
+
+    def write(d, df):
+        with qsec.metrics.timer("stage_seconds", stage="write"):
+            common.save_dateframe(symbol, d, df, sid, "binance_usdfut", "trades")
+
+    common.fetch_days(
+        symbol,
+        dates,
+        common.archiving(
+            lambda d: fetch_trade_pages_for_date(symbol, d, engine,
+                                                 window_workers),
+            archive, "binance_usdfut", "trades", symbol, sid,
+        ),
+        lambda d, pages: decode_trades_for_date(symbol, d, pages),
+        write,
+        fetchers,
+        queue_size,
+    )
 
 
 def main():
     qsec.logging.init_logging()
     args = parse_args()
+    common.init_metrics(args)
+    qsec.decode.set_workers(args.decode_workers)
     fromDt, uptoDt = process_args(args)
     sid = common.build_assetid(args.sym, "BNC")
-    fetch(args.sym, fromDt, uptoDt, sid)
+    if args.follow:
+        follow.follow_trades(
+            args.sym, sid, "binance_usdfut", call_http_trade, normalise,
+            find_first_trade_id, args.poll_seconds, args.flush_seconds,
+        )
+        return
+    fetch(args.sym, fromDt, uptoDt, sid, args.fetchers, args.queue_size,
+          common.open_archive(args), args.engine, args.window_workers)
 
 
 if __name__ == "__main__":
-    main()
+    qsec.app.main(main)
@@ -0,0 +1,85 @@
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import qsec.app
+import qsec.features
+import qsec.logging
+import qsec.mdmap
+import qsec.time
+
+
+# Fill the qsec.features bucket cache for stored trades, across a pool of
+# processes, so that later feature computations over the same days and
+# clock read only the small bucket files.
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Bucket stored trades for qsec.features, in bulk")
+    parser.add_argument("--venue", type=str, default="*", help="venue (glob)")
+    parser.add_argument("--assetid", type=str, default="*",
+                        help="asset id, e.g. BTCUSDT_BNC (glob)")
+    parser.add_argument("--from", dest="fromDt", type=str, help="begin date")
+    parser.add_argument("--upto", dest="uptoDt", type=str, help="to date")
+    parser.add_argument("--clock", choices=qsec.features.clocks, default="time",
+                        help="sample trades by time or by traded volume")
+    parser.add_argument(
+        "--size",
+        type=str,
+        default="1m",
+        help="bucket size: an interval, e.g. 1m, for the time clock, or a "
+        "quantity for the volume clock",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes")
+    return parser.parse_args()
+
+
+def main():
+    qsec.logging.init_logging()
+    args = parse_args()
+    from_date = qsec.time.to_date(args.fromDt) if args.fromDt else None
+    upto_date = qsec.time.to_date(args.uptoDt) if args.uptoDt else None
+    size = args.size
+    try:
+        if args.clock == "volume":
+            size = float(size)
+        qsec.features.clock_key(args.clock, size)
+    except ValueError:
+        raise qsec.app.EasyError(
+            f"volume clock size must be a number, not '{size}'")
+    except Exception as err:
+        raise qsec.app.EasyError(str(err))
+
+    items = qsec.mdmap.find_items("trades", args.venue, args.assetid,
+                                  from_date, upto_date)
+    if not items:
+        raise qsec.app.EasyError("no trade files match")
+    logging.info("bucketing {} days of trades".format(len(items)))
+
+    progress = qsec.logging.Progress("features", total=len(items), unit="days")
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             initializer=qsec.logging.init_worker) as pool:
+        futures = {
+            pool.submit(qsec.features.day_buckets, i.venue, i.assetid, i.date,
+                        args.clock, size): i
+            for i in items
+        }
+        for n, future in enumerate(as_completed(futures), 1):
+            item = futures[future]
+            try:
+                future.result()
+            except Exception as err:
+                failed += 1
+                logging.error(f"{item.fn}: {err}")
+            progress.update(position=n, count=n)
+    progress.done()
+    if failed:
+        raise qsec.app.EasyError(f"{failed} of {len(items)} days failed")
+
+
+if __name__ == "__main__":
+    qsec.app.main(main)
@@ -1,12 +1,23 @@
 import datetime as dt
-import pyarrow as pa
-import pyarrow.parquet as pq
-import pandas as pd
 import logging
 import os
 import json
+import atexit
 from pathlib import Path
 
+import qsec.archive
+import qsec.catalog
+import qsec.lazy
+import qsec.marketdata
+import qsec.metrics
+import qsec.pipeline
+import qsec.time
+
+pa = qsec.lazy.lazy_import("pyarrow")
+pq = qsec.lazy.lazy_import("pyarrow.parquet")
+pd = qsec.lazy.lazy_import("pandas")
+np = qsec.lazy.lazy_import("numpy")
+
 
 def build_md_item_filename(
         assetid: str,
@@ -15,24 +26,30 @@ def build_md_item_filename(
         venue: str,
         interval: str = None, # will be None for Trades
 ):
-    date_str = date.strftime("%Y%m%d")
-    home = str(Path.home())
-    path = f"{home}/MDHOME/tickdata-parq/{dtype}/{venue}/{assetid}/{date_str}"
+    return qsec.marketdata.item_filename(assetid, date, dtype, venue, interval)
 
-    # for bar data, we embedd the bar interval into the file path
-    interval_str = f"-{interval}" if interval is not None else ""
-    fn = f"{path}/{assetid}{interval_str}-{date_str}.parq"
-    return fn
+
+def kline_request_windows(date: dt.date, interval: str, limit: int) -> list:
+    """Split a UTC day into [lower, upper) epoch-ms windows of at most `limit`
+    bars each, one per klines request"""
+    t0, t1 = qsec.time.day_bounds_ms(date)
+    if interval in qsec.time.KLINE_INTERVAL_MS:
+        step = qsec.time.interval_ms(interval) * limit
+    else:
+        step = t1 - t0
+    return [(int(lower), min(int(lower) + step, t1))
+            for lower in qsec.time.epoch_ms_range(t0, t1, step)]
 
 
 def save_dateframe(
     symbol: str,
     date: dt.date,
-    df: pd.core.frame.DataFrame,
+    df: "pd.DataFrame",
     sid: str,
     venue: str,
     dtype: str,
-    interval: str = None # will be None for Trades
+    interval: str = None, # will be None for Trades
+    meta: dict = None,  # further 'qsec' metadata, e.g. bar completeness
 ):
     fn = build_md_item_filename(sid, date, dtype, venue, interval)
     dirname = os.path.dirname(fn)
@@ -47,8 +64,11 @@ def save_dateframe(
                    dtype}
     if interval is not None:
         custom_meta["interval"] = interval
+    if meta:
+        custom_meta.update(meta)
     custom_meta_key = "qsec"
     table = pa.Table.from_pandas(df)
+    custom_meta.update(qsec.catalog.summary_meta(table, dtype))
     custom_meta_json = json.dumps(custom_meta)
     existing_meta = table.schema.metadata
     combined_meta = {
@@ -57,7 +77,94 @@ def save_dateframe(
     }
     table = table.replace_schema_metadata(combined_meta)
     logging.info("writing parquet file '{}'".format(fn))
-    pq.write_table(table, fn, compression="GZIP")
+    qsec.marketdata.write_item(table, fn)
+
+
+def read_item_meta(fn: str) -> dict:
+    """The 'qsec' metadata of a stored file, without reading its data"""
+    meta = pq.read_schema(fn).metadata or {}
+    return json.loads(meta.get(b"qsec", b"{}"))
+
+
+def bar_completeness(df: "pd.DataFrame", date: dt.date, interval: str) -> tuple:
+    """Compare a day's bars with those expected for the interval.
+
+    Returns (info, missing): info is the metadata stored with the file
+    (expected, missing and duplicate bar counts, and 'complete'), and missing
+    the open times, epoch-ms, of the absent bars.
+    """
+    expected = qsec.time.day_closed_bars_ms(date, interval)
+    if len(df):
+        opens = qsec.time.datetime64_to_epoch_ms(df["openTime"].values)
+    else:
+        opens = np.empty(0, dtype=np.int64)
+    unique = np.unique(opens)
+    missing = np.setdiff1d(expected, unique, assume_unique=True)
+    duplicates = len(opens) - len(unique)
+    info = {
+        "expected_bars": int(len(expected)),
+        "missing_bars": int(len(missing)),
+        "duplicate_bars": int(duplicates),
+        "complete": bool(len(missing) == 0 and duplicates == 0),
+    }
+    return info, missing
+
+
+def bar_gap_windows(date: dt.date, interval: str, missing, limit: int) -> list:
+    """[lo, hi) request windows covering runs of missing bars, of at most
+    `limit` bars each"""
+    expected = qsec.time.day_closed_bars_ms(date, interval)
+    index = np.searchsorted(expected, missing)
+    # runs of consecutive expected bars
+    breaks = np.flatnonzero(np.diff(index) != 1) + 1
+    windows = []
+    for run in np.split(index, breaks):
+        for i in range(0, len(run), limit):
+            chunk = run[i:i + limit]
+            lo = int(expected[chunk[0]])
+            hi = int(qsec.time.interval_add(expected[chunk[-1]], interval, 1))
+            windows.append((lo, hi))
+    return windows
+
+
+def refetch_bar_gaps(df: "pd.DataFrame", date: dt.date, interval: str,
+                     limit: int, fetch_window) -> "pd.DataFrame":
+    """Refetch the windows of any bars missing from a day.
+
+    `fetch_window(lo, hi)` returns the normalised bars opening in [lo, hi).
+    Gaps that remain, e.g. where the exchange was down, are left, and are
+    reported by bar_completeness.
+    """
+    info, missing = bar_completeness(df, date, interval)
+    if not len(missing):
+        return df
+    windows = bar_gap_windows(date, interval, missing, limit)
+    logging.info("{} of {} bars missing for {}, refetching {} windows".format(
+        info["missing_bars"], info["expected_bars"], date, len(windows)))
+    qsec.metrics.inc("bars_refetch_windows_total", len(windows))
+    parts = [df] + [fetch_window(lo, hi) for lo, hi in windows]
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return df
+    df = pd.concat(parts)
+    df = df[~df.index.duplicated(keep="first")].sort_index()
+    info, missing = bar_completeness(df, date, interval)
+    if len(missing):
+        logging.warning("{} of {} bars still missing for {}".format(
+            info["missing_bars"], info["expected_bars"], date))
+    return df
+
+
+def incomplete_days(dates: list, sid: str, venue: str, dtype: str) -> list:
+    """The dates whose bar files are absent, or were stored incomplete"""
+    todo = []
+    for d in dates:
+        fn = build_md_item_filename(sid, d, dtype, venue, dtype)
+        if os.path.exists(fn) and read_item_meta(fn).get("complete"):
+            logging.info("data item complete, skipping: '{}'".format(fn))
+        else:
+            todo.append(d)
+    return todo
 
 
 def short_contract_date(date: str) -> str:
@@ -85,3 +192,116 @@ def build_assetid(symbol, shortExch="BNC", is_cash=False):
             return "_".join([base, short_contract_date(date), shortExch])
     else:
         raise Exception(f"invalid format for symbol, '{symbol}'")
+
+
+def add_metrics_args(parser):
+    parser.add_argument(
+        "--metrics-jsonl",
+        dest="metrics_jsonl",
+        type=str,
+        help="append per-request and per-day metrics events to a JSON lines file",
+        required=False,
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        dest="metrics_prom",
+        type=str,
+        help="write final metrics to a Prometheus text file",
+        required=False,
+    )
+
+
+def init_metrics(args):
+    if args.metrics_jsonl:
+        qsec.metrics.registry.open_event_log(args.metrics_jsonl)
+
+    def on_exit():
+        if args.metrics_jsonl:
+            qsec.metrics.registry.write_summary()
+            qsec.metrics.registry.close_event_log()
+        if args.metrics_prom:
+            qsec.metrics.registry.write_prometheus(args.metrics_prom)
+
+    atexit.register(on_exit)
+
+
+def add_pipeline_args(parser):
+    parser.add_argument(
+        "--fetchers",
+        type=int,
+        default=1,
+        help="number of days fetched concurrently",
+    )
+    parser.add_argument(
+        "--queue-size",
+        dest="queue_size",
+        type=int,
+        default=2,
+        help="days held between pipeline stages, bounding memory",
+    )
+    parser.add_argument(
+        "--decode-workers",
+        dest="decode_workers",
+        type=int,
+        default=0,
+        help="processes decoding replies, for CPU-bound backfills; 0 "
+        "decodes in the tool's own process",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="also keep the raw replies under MDHOME/raw, so days can be "
+        "rebuilt without fetching them again",
+    )
+
+
+def open_archive(args):
+    return qsec.archive.RawArchive() if args.archive else None
+
+
+def archiving(fetch_day, archive, venue: str, dtype: str, symbol: str,
+              sid: str):
+    """Wrap fetch_day(date) to also store each day's raw pages in the
+    archive, if there is one"""
+    if archive is None:
+        return fetch_day
+
+    def fetch_and_store(d):
+        pages = fetch_day(d)
+        archive.store(venue, dtype, symbol, d, pages, sid=sid)
+        return pages
+
+    return fetch_and_store
+
+
+def fetch_days(symbol: str, dates: list, fetch_day, decode_day, write_day,
+               fetchers: int = 1, queue_size: int = 2):
+    """Download days through a fetch -> decode -> write pipeline, so that
+    fetching a day overlaps decoding and writing the previous ones.
+
+    fetch_day(date) returns the raw pages, decode_day(date, pages) the day's
+    DataFrame and write_day(date, df) stores it.  Each stage emits a 'day'
+    metrics event.
+    """
+
+    def fetch_stage(d):
+        with qsec.metrics.scope("day", symbol=symbol, date=d, stage="fetch"):
+            return d, fetch_day(d)
+
+    def decode_stage(item):
+        d, pages = item
+        with qsec.metrics.scope("day", symbol=symbol, date=d, stage="decode") as day:
+            df = decode_day(d, pages)
+            day["rows"] = len(df)
+        return d, df
+
+    def write_stage(item):
+        d, df = item
+        with qsec.metrics.scope("day", symbol=symbol, date=d, stage="write"):
+            write_day(d, df)
+
+    pipeline = qsec.pipeline.Pipeline(queue_size=queue_size)
+    pipeline.stage("fetch", fetch_stage, workers=fetchers)
+    pipeline.stage("decode", decode_stage)
+    pipeline.stage("write", write_stage)
+    return pipeline.run(dates)
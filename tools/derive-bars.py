@@ -0,0 +1,177 @@
+import argparse
+import datetime as dt
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import qsec.app
+import qsec.bars
+import qsec.lazy
+import qsec.logging
+import qsec.marketdata
+import qsec.mdmap
+import qsec.time
+import common
+
+np = qsec.lazy.lazy_import("numpy")
+
+
+# Build bars of coarser intervals (5m, 1h, 1d, ...) from the stored 1m bars,
+# written to the same MDHOME layout as the fetch tools write them, so that
+# only 1m bars need fetching.
+#
+# Dates are processed in blocks.  A block's 1m bars are loaded once, with
+# enough earlier days for the multi-day bars closing in it, and rolled up
+# into a pyramid of intervals, each from the coarsest already built that
+# divides it.  Each derived day records in its metadata whether it is
+# complete: all its expected bars present, none built from missing 1m bars.
+
+source = "1m"
+
+block_days = 92
+
+
+def first_source_date(date: dt.date, interval: str) -> dt.date:
+    """The first date of 1m bars needed for the bars closing on a date"""
+    opens = qsec.time.day_closed_bars_ms(date, interval)
+    return qsec.time.epoch_ms_to_date(opens[0]) if len(opens) else date
+
+
+def derive_days(venue: str, assetid: str, intervals: list, dates: list,
+                force: bool) -> int:
+    source_dtype = f"bars{source}"
+    todo = {}
+    for interval in intervals:
+        dtype = f"bars{interval}"
+        todo[interval] = (dates if force else
+                          common.incomplete_days(dates, assetid, venue, dtype))
+    todo = {k: v for k, v in todo.items() if v}
+    if not todo:
+        return 0
+
+    first = min(first_source_date(d[0], i) for i, d in todo.items())
+    upto = dates[-1] + dt.timedelta(days=1)
+    fns = qsec.marketdata.item_filenames(assetid, first, upto, source_dtype,
+                                         venue)
+    if not fns:
+        logging.warning(f"no 1m bars for {assetid} from {first} upto {upto}")
+        return 0
+    have = {qsec.time.to_date(os.path.basename(os.path.dirname(fn)))
+            for fn in fns}
+    symbol = common.read_item_meta(fns[-1]).get("symbol", assetid)
+    bars = qsec.marketdata.load(assetid, first, upto, source_dtype, venue)
+    bars = bars.loc[~bars.index.duplicated(keep="first")].sort_index()
+
+    levels = {source: bars}
+    for interval in qsec.bars.derived_intervals:
+        if interval in intervals:
+            from_interval = qsec.bars.source_interval(interval, levels)
+            levels[interval] = qsec.bars.rollup(levels[from_interval], interval)
+
+    written = 0
+    for interval, interval_dates in todo.items():
+        dtype = f"bars{interval}"
+        df = levels[interval]
+        close_ms = qsec.time.datetime64_to_epoch_ms(df.index.values)
+        for d in interval_dates:
+            needed = qsec.time.dates_in_range(first_source_date(d, interval),
+                                              d + dt.timedelta(days=1))
+            absent = [n for n in needed if n not in have]
+            if absent:
+                logging.warning("no 1m bars for {} @ {}, skipping {} {}".format(
+                    assetid, absent[0], dtype, d))
+                continue
+            t0, t1 = qsec.time.day_bounds_ms(d)
+            lo, hi = np.searchsorted(close_ms, [t0, t1])
+            day = df.iloc[lo:hi]
+            info, _ = common.bar_completeness(day, d, interval)
+            partial = qsec.bars.missing_source_bars(day, bars, source)
+            info["partial_bars"] = int(np.count_nonzero(partial))
+            info["complete"] = info["complete"] and not info["partial_bars"]
+            info["source"] = source_dtype
+            common.save_dateframe(symbol, d, day, assetid, venue, dtype,
+                                  dtype, meta=info)
+            written += 1
+    return written
+
+
+def derive_asset(venue: str, assetid: str, intervals: list,
+                 dates: list, force: bool) -> int:
+    # runs in the worker processes
+    written = 0
+    for i in range(0, len(dates), block_days):
+        written += derive_days(venue, assetid, intervals,
+                               dates[i:i + block_days], force)
+    return written
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Derive coarser bar intervals from stored 1m bars")
+    parser.add_argument("--venue", type=str, default="*", help="venue (glob)")
+    parser.add_argument("--assetid", type=str, default="*",
+                        help="asset id, e.g. BTCUSDT_BNC (glob)")
+    parser.add_argument("--from", dest="fromDt", type=str, help="begin date")
+    parser.add_argument("--upto", dest="uptoDt", type=str, help="to date")
+    parser.add_argument(
+        "--intervals",
+        type=str,
+        default=",".join(qsec.bars.derived_intervals),
+        help="comma separated intervals to derive, default all",
+    )
+    parser.add_argument("--force", action="store_true",
+                        help="rewrite days already stored complete")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes")
+    return parser.parse_args()
+
+
+def main():
+    qsec.logging.init_logging()
+    args = parse_args()
+    intervals = [i for i in args.intervals.split(",") if i]
+    for interval in intervals:
+        if interval not in qsec.bars.derived_intervals:
+            raise qsec.app.EasyError(f"cannot derive interval '{interval}'")
+    from_date = qsec.time.to_date(args.fromDt) if args.fromDt else None
+    upto_date = qsec.time.to_date(args.uptoDt) if args.uptoDt else None
+
+    items = qsec.mdmap.find_items(f"bars{source}", args.venue, args.assetid,
+                                  from_date, upto_date)
+    if not items:
+        raise qsec.app.EasyError("no 1m bar files match")
+    assets = {}
+    for item in items:
+        assets.setdefault((item.venue, item.assetid), []).append(item.date)
+    logging.info("deriving {} for {} assets".format(",".join(intervals),
+                                                    len(assets)))
+
+    progress = qsec.logging.Progress("derive", total=len(assets), unit="assets")
+    failed = 0
+    written = 0
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             initializer=qsec.logging.init_worker) as pool:
+        futures = {}
+        for (venue, assetid), dates in assets.items():
+            first = from_date or min(dates)
+            upto = upto_date or max(dates) + dt.timedelta(days=1)
+            dates = qsec.time.dates_in_range(first, upto)
+            future = pool.submit(derive_asset, venue, assetid, intervals,
+                                 dates, args.force)
+            futures[future] = (venue, assetid)
+        for n, future in enumerate(as_completed(futures), 1):
+            venue, assetid = futures[future]
+            try:
+                written += future.result()
+            except Exception as err:
+                failed += 1
+                logging.error(f"{venue} {assetid}: {err}")
+            progress.update(position=n, count=n)
+    progress.done()
+    logging.info("wrote {} day files".format(written))
+    if failed:
+        raise qsec.app.EasyError(f"{failed} of {len(assets)} assets failed")
+
+
+if __name__ == "__main__":
+    qsec.app.main(main)
@@ -0,0 +1,360 @@
+import datetime as dt
+import json
+import logging
+import os
+import time
+
+import qsec.app
+import qsec.lazy
+import qsec.marketdata
+import qsec.metrics
+import qsec.online
+import qsec.time
+import common
+
+pa = qsec.lazy.lazy_import("pyarrow")
+pq = qsec.lazy.lazy_import("pyarrow.parquet")
+pd = qsec.lazy.lazy_import("pandas")
+
+
+# Follow mode: keep one asset's trades or bars current by polling the REST
+# API from the last stored point, rather than rerunning whole-day downloads.
+#
+# Rows for the current UTC day are appended, every few seconds, as record
+# batches to an Arrow IPC stream next to the day's usual file, named
+# '<file>.live'.  A stream, unlike parquet, is readable while it is being
+# written and survives a crash up to the last complete batch.  When the first
+# row of the next day arrives, or the exchange is caught up past midnight, the
+# day is rolled over: its stream is written out as the standard parquet file
+# under MDHOME and removed.  A restarted follower resumes from the last row of
+# the live stream, or of the latest finished file.
+
+live_suffix = qsec.marketdata.live_suffix
+
+
+def add_follow_args(parser):
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="run continuously, appending new data for the current day",
+    )
+    parser.add_argument(
+        "--poll-seconds",
+        dest="poll_seconds",
+        type=float,
+        default=2.0,
+        help="follow mode: wait between polls once caught up",
+    )
+    parser.add_argument(
+        "--flush-seconds",
+        dest="flush_seconds",
+        type=float,
+        default=5.0,
+        help="follow mode: longest time new rows are held before being "
+        "appended to the live file",
+    )
+
+
+def add_rolling_args(parser):
+    parser.add_argument(
+        "--rolling-window",
+        dest="rolling_window",
+        type=int,
+        default=0,
+        help="follow mode: maintain rolling statistics over this many "
+        "bars, updated as bars arrive (see qsec.online)",
+    )
+    parser.add_argument(
+        "--rolling-halflife",
+        dest="rolling_halflife",
+        type=float,
+        help="follow mode: halflife in bars of the EWMA statistics, "
+        "default half the rolling window",
+    )
+
+
+def check_follow_args(args):
+    if args.follow:
+        if getattr(args, "universe", False):
+            raise qsec.app.EasyError("--follow requires a single --sym")
+    elif args.fromDt is None or args.uptoDt is None:
+        raise qsec.app.EasyError("--from and --upto are required, unless --follow")
+
+
+def today() -> dt.date:
+    return qsec.time.epoch_ms_to_date(qsec.time.now_epoch_ms())
+
+
+class LiveStore:
+    """Appends one asset's rows to the live stream of their UTC day"""
+
+    def __init__(self, symbol: str, sid: str, venue: str, dtype: str,
+                 interval: str = None, flush_seconds: float = 5.0):
+        self.symbol = symbol
+        self.sid = sid
+        self.venue = venue
+        self.dtype = dtype
+        self.interval = interval
+        self.flush_seconds = flush_seconds
+        self.date = None
+        self._schema = None
+        self._sink = None
+        self._writer = None
+        self._pending = []
+        self._last_flush = time.monotonic()
+        # set once the current day's finished file has been written
+        self._rolled = False
+
+    def filename(self, date: dt.date) -> str:
+        return common.build_md_item_filename(
+            self.sid, date, self.dtype, self.venue, self.interval
+        )
+
+    def live_filename(self, date: dt.date) -> str:
+        return self.filename(date) + live_suffix
+
+    def resume(self) -> "pd.DataFrame":
+        """Reopen the latest live stream, if any, and return the last stored
+        rows: from that stream or else the latest finished file of the last
+        two days.  Returns None if nothing is stored."""
+        d1 = today()
+        for d in [d1, d1 - dt.timedelta(days=1)]:
+            fn = self.live_filename(d)
+            if os.path.exists(fn):
+                table = qsec.marketdata.read_live(fn)
+                logging.info("resuming live file '{}', {} rows".format(
+                    fn, 0 if table is None else table.num_rows))
+                self.date = d
+                if table is not None and table.num_rows:
+                    self._open(table.schema)
+                    self._writer.write_table(table)
+                    return table.slice(table.num_rows - 1).to_pandas()
+                os.remove(fn)
+                return None
+            fn = self.filename(d)
+            if os.path.exists(fn):
+                logging.info("resuming after finished file '{}'".format(fn))
+                self.date = d
+                table = pq.read_table(fn)
+                self._rolled = True
+                if table.num_rows:
+                    return table.slice(table.num_rows - 1).to_pandas()
+                return None
+        return None
+
+    def _open(self, schema: "pa.Schema"):
+        # (re)write the live stream from scratch; existing rows, if any, are
+        # written by the caller
+        os.makedirs(os.path.dirname(self.live_filename(self.date)), exist_ok=True)
+        self._schema = schema
+        self._sink = pa.OSFile(self.live_filename(self.date), "wb")
+        self._writer = pa.ipc.new_stream(self._sink, schema)
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+        self._writer = None
+        self._sink = None
+
+    def append(self, df: "pd.DataFrame"):
+        if df.empty:
+            return
+        days = df.index.normalize()
+        for day in days.unique():
+            d = day.date()
+            rows = df[days == day]
+            if self.date is not None and d < self.date:
+                logging.warning(
+                    "dropping {} rows for {}, day already rolled over".format(
+                        len(rows), d))
+                continue
+            if self.date is not None and d > self.date:
+                self.roll()
+            if self.date is None or d != self.date:
+                self.date = d
+                self._rolled = False
+            self._pending.append(rows)
+        last = qsec.time.datetime64_to_epoch_ms(df.index.values[-1:])[0]
+        qsec.metrics.gauge("follow_lag_seconds",
+                           (qsec.time.now_epoch_ms() - int(last)) / 1000.0,
+                           dtype=self.dtype)
+        qsec.metrics.inc("follow_rows_total", len(df), dtype=self.dtype)
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        df = pd.concat(self._pending)
+        self._pending = []
+        if self._rolled:
+            logging.warning("dropping {} rows for {}, finished file "
+                            "exists".format(len(df), self.date))
+            return
+        if self._writer is None:
+            table = pa.Table.from_pandas(df)
+            self._open(table.schema)
+        else:
+            table = pa.Table.from_pandas(df, schema=self._schema)
+        self._writer.write_table(table)
+        logging.debug("appended %d rows to live file", len(df))
+
+    def roll(self):
+        """Finish the current day: write its standard file, drop the stream"""
+        self.flush()
+        self._close_writer()
+        if self.date is None or self._rolled:
+            return
+        fn = self.live_filename(self.date)
+        if os.path.exists(fn):
+            table = qsec.marketdata.read_live(fn)
+            df = table.to_pandas() if table is not None else pd.DataFrame()
+            logging.info("rolling over {} with {} rows".format(self.date, len(df)))
+            meta = None
+            if self.dtype.startswith("bars"):
+                # so that batch fetches skip the day only if nothing is missing
+                meta, _ = common.bar_completeness(df, self.date,
+                                                  self.dtype[len("bars"):])
+            common.save_dateframe(self.symbol, self.date, df, self.sid,
+                                  self.venue, self.dtype, self.interval,
+                                  meta=meta)
+            os.remove(fn)
+        self._rolled = True
+
+    def roll_if_due(self, now_ms: int):
+        # only call once caught up, so no rows for the current day are pending
+        if self.date is not None and qsec.time.epoch_ms_to_date(now_ms) > self.date:
+            self.roll()
+
+    def close(self):
+        self.flush()
+        self._close_writer()
+
+
+def _initial_trade_id(symbol, call_http_trade, find_first_id):
+    t0, t1 = qsec.time.day_bounds_ms(today())
+    first_id = find_first_id(symbol, t0, t1)
+    if first_id is not None:
+        return first_id
+    # no trade in the first hour of today; start from the latest trades
+    trades = pd.DataFrame(json.loads(call_http_trade(symbol)))
+    if trades.empty:
+        raise Exception(f"no trades found for '{symbol}'")
+    today_trades = trades[trades["T"] >= t0]
+    if len(today_trades):
+        return int(today_trades["a"].min())
+    return int(trades["a"].max()) + 1
+
+
+def follow_trades(symbol: str, sid: str, venue: str, call_http_trade,
+                  normalise, find_first_id, poll_seconds: float = 2.0,
+                  flush_seconds: float = 5.0, limit: int = 1000):
+    """Poll aggTrades by fromId, from the last stored trade, indefinitely.
+
+    `find_first_id(symbol, t0, t1)` returns the id of the earliest trade in a
+    period, or None; it is used when nothing is stored yet.
+    """
+    store = LiveStore(symbol, sid, venue, "trades", None, flush_seconds)
+    last = store.resume()
+    if last is not None:
+        cursor = int(last["tradeId"].iloc[-1]) + 1
+    else:
+        cursor = _initial_trade_id(symbol, call_http_trade, find_first_id)
+    logging.info(f"following trades for {symbol} from tradeId {cursor}")
+    try:
+        while True:
+            raw_json = call_http_trade(symbol, fromId=cursor)
+            with qsec.metrics.timer("stage_seconds", stage="decode"):
+                trades = pd.DataFrame(json.loads(raw_json))
+            if len(trades):
+                cursor = int(trades["a"].max()) + 1
+                with qsec.metrics.timer("stage_seconds", stage="normalise"):
+                    df = normalise(trades)
+                store.append(df)
+            if len(trades) < limit:
+                store.roll_if_due(qsec.time.now_epoch_ms())
+                store.maybe_flush()
+                time.sleep(poll_seconds)
+            else:
+                store.maybe_flush()
+    finally:
+        store.close()
+
+
+def _update_stats(stats, df, sid, venue, dtype):
+    rows = stats.update(df)
+    qsec.online.save(stats, sid, venue, dtype)
+    if len(rows):
+        last = rows.iloc[-1]
+        logging.info("{} close {:g}, return vol {:.3g} (ewm {:.3g}), "
+                     "zscore {:.2f}".format(rows.index[-1], last["close"],
+                                            last["std"], last["ewm_vol"],
+                                            last["zscore"]))
+
+
+def follow_bars(symbol: str, sid: str, venue: str, interval: str,
+                call_http_fetch_klines, normalise_klines, limit: int,
+                poll_seconds: float = 2.0, flush_seconds: float = 5.0,
+                rolling_window: int = 0, rolling_halflife: float = None):
+    """Poll klines by startTime for bars closed since the last stored bar.
+
+    With a rolling_window, qsec.online rolling statistics of the bars are
+    brought up to date from the stored bars, then updated with each new bar.
+    """
+    dtype = f"bars{interval}"
+    store = LiveStore(symbol, sid, venue, dtype, dtype, flush_seconds)
+    last = store.resume()
+    stats = None
+    if rolling_window:
+        halflife = rolling_halflife or rolling_window / 2
+        qsec.online.catch_up(sid, venue, dtype, rolling_window, halflife,
+                             from_date=today())
+        stats = qsec.online.load(sid, venue, dtype, rolling_window, halflife)
+    if last is not None:
+        last_open = qsec.time.datetime64_to_epoch_ms(last["openTime"].values)
+        cursor = int(qsec.time.interval_add(last_open[-1], interval, 1))
+    else:
+        cursor = int(qsec.time.interval_ceil(
+            qsec.time.day_bounds_ms(today())[0], interval))
+    logging.info("following {} bars for {} from {}".format(
+        interval, symbol, qsec.time.epoch_ms_to_str(cursor)))
+    try:
+        while True:
+            now = qsec.time.now_epoch_ms()
+            # bars opening before the current one are closed
+            closed_upto = int(qsec.time.interval_floor(now, interval))
+            full_page = False
+            if cursor < closed_upto:
+                raw_json = call_http_fetch_klines(
+                    symbol, cursor, closed_upto - 1, interval, limit
+                )
+                with qsec.metrics.timer("stage_seconds", stage="decode"):
+                    df = pd.DataFrame(json.loads(raw_json))
+                full_page = len(df) >= limit
+                if not df.empty:
+                    df = df.loc[(df[0] >= cursor) & (df[0] < closed_upto)]
+                if not df.empty:
+                    cursor = int(qsec.time.interval_add(int(df[0].max()),
+                                                        interval, 1))
+                    with qsec.metrics.timer("stage_seconds", stage="normalise"):
+                        df = normalise_klines(df)
+                    store.append(df)
+                    store.flush()
+                    if stats is not None:
+                        _update_stats(stats, df, sid, venue, dtype)
+                elif not full_page:
+                    # no bars were traded in the range, e.g. trading halted
+                    cursor = closed_upto
+            if full_page:
+                continue
+            store.roll_if_due(now)
+            # sleep until shortly after the current bar closes
+            next_close = int(qsec.time.interval_add(closed_upto, interval, 1))
+            wait = (next_close - qsec.time.now_epoch_ms()) / 1000.0 + 1.0
+            time.sleep(max(wait, poll_seconds))
+    finally:
+        store.close()
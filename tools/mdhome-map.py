@@ -0,0 +1,75 @@
+import argparse
+import logging
+import os
+
+import qsec.app
+import qsec.logging
+import qsec.marketdata
+import qsec.mdmap
+import qsec.time
+
+
+def parse_args():
+    tasks = "\n".join(
+        f"  {name:14} {help} ({kind})"
+        for name, (_, kind, help) in sorted(qsec.mdmap.tasks.items())
+    )
+    parser = argparse.ArgumentParser(
+        description="Apply a transformation or check to MDHOME data files",
+        epilog=f"tasks:\n{tasks}",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("task", type=str, choices=sorted(qsec.mdmap.tasks))
+    parser.add_argument("--dtype", type=str, default="*",
+                        help="data type, e.g. trades or bars1m (glob)")
+    parser.add_argument("--venue", type=str, default="*", help="venue (glob)")
+    parser.add_argument("--assetid", type=str, default="*",
+                        help="asset id, e.g. BTCUSDT_BNC (glob)")
+    parser.add_argument("--from", dest="fromDt", type=str, help="begin date")
+    parser.add_argument("--upto", dest="uptoDt", type=str, help="to date")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument(
+        "--journal",
+        type=str,
+        help="file recording completed files, so a restarted run resumes; "
+        "default is under MDHOME/mdmap",
+    )
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the journal of a previous run")
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true",
+                        help="report the files that would be rewritten")
+    return parser.parse_args()
+
+
+def main():
+    qsec.logging.init_logging()
+    args = parse_args()
+    from_date = qsec.time.to_date(args.fromDt) if args.fromDt else None
+    upto_date = qsec.time.to_date(args.uptoDt) if args.uptoDt else None
+    if from_date and upto_date and from_date >= upto_date:
+        raise qsec.app.EasyError("'from' date must be before 'upto' date")
+
+    journal = args.journal or "{}/../mdmap/{}.jsonl".format(
+        qsec.marketdata.md_home(), args.task)
+    journal = os.path.normpath(journal)
+    if args.restart and os.path.exists(journal):
+        os.remove(journal)
+
+    items = qsec.mdmap.find_items(args.dtype, args.venue, args.assetid,
+                                  from_date, upto_date)
+    if not items:
+        raise qsec.app.EasyError("no data files match")
+    counts = qsec.mdmap.run(args.task, items, args.workers, journal,
+                            args.dry_run)
+    logging.info("task '{}': {}".format(
+        args.task, ", ".join(f"{n} {status}" for status, n in counts.items())))
+    if counts["failed"] or counts["problem"]:
+        raise qsec.app.EasyError(
+            "{} files failed, {} with problems; see log{}".format(
+                counts["failed"], counts["problem"],
+                "" if args.dry_run else f" and '{journal}'"))
+
+
+if __name__ == "__main__":
+    qsec.app.main(main)
@@ -0,0 +1,114 @@
+import argparse
+import importlib.util
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import qsec.app
+import qsec.archive
+import qsec.logging
+import qsec.time
+import common
+
+
+# Rebuild stored days from the raw replies kept by the fetch tools' --archive
+# option, re-running the current decoding and normalisation of the tool that
+# fetched them, without fetching again.
+
+tools_dir = os.path.dirname(os.path.abspath(__file__))
+
+tool_prefixes = {
+    "binance": "binance",
+    "binance_usdfut": "binance-usdfut",
+    "binance_coinfut": "binance-coinfut",
+}
+
+_tools = {}
+
+
+def load_tool(venue: str, dtype: str):
+    kind = "trades" if dtype == "trades" else "bars"
+    if venue not in tool_prefixes:
+        raise Exception(f"no fetch tool for venue '{venue}'")
+    name = f"{tool_prefixes[venue]}-fetch-{kind}"
+    if name not in _tools:
+        fn = os.path.join(tools_dir, f"{name}.py")
+        spec = importlib.util.spec_from_file_location(name.replace("-", "_"), fn)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _tools[name] = module
+    return _tools[name]
+
+
+def rebuild_day(root: str, manifest: dict) -> int:
+    # runs in the worker processes
+    venue, dtype, symbol = manifest["venue"], manifest["dtype"], manifest["symbol"]
+    date = qsec.time.to_date(manifest["date"])
+    tool = load_tool(venue, dtype)
+    pages = qsec.archive.RawArchive(root).load(manifest)
+    meta = None
+    if dtype == "trades":
+        df = tool.decode_trades_for_date(symbol, date, pages)
+        interval = None
+    else:
+        df = tool.decode_kline_pages(symbol, date, dtype[len("bars"):], pages)
+        interval = dtype
+        # bars refetched into gaps are not archived, so such a day is
+        # recorded as incomplete and fetched again by the next run
+        meta, _ = common.bar_completeness(df, date, dtype[len("bars"):])
+    common.save_dateframe(symbol, date, df, manifest["sid"], venue, dtype,
+                          interval, meta=meta)
+    return len(df)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Rebuild MDHOME days from archived raw replies")
+    parser.add_argument("--venue", type=str, default="*", help="venue (glob)")
+    parser.add_argument("--dtype", type=str, default="*",
+                        help="data type, e.g. trades or bars1m (glob)")
+    parser.add_argument("--sym", type=str, default="*", help="symbol (glob)")
+    parser.add_argument("--from", dest="fromDt", type=str, help="begin date")
+    parser.add_argument("--upto", dest="uptoDt", type=str, help="to date")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument("--archive-root", dest="archive_root", type=str,
+                        help="archive location, default MDHOME/raw")
+    return parser.parse_args()
+
+
+def main():
+    qsec.logging.init_logging()
+    args = parse_args()
+    from_date = qsec.time.to_date(args.fromDt) if args.fromDt else None
+    upto_date = qsec.time.to_date(args.uptoDt) if args.uptoDt else None
+    archive = qsec.archive.RawArchive(args.archive_root)
+    manifests = archive.days(args.venue, args.dtype, args.sym, from_date,
+                             upto_date)
+    if not manifests:
+        raise qsec.app.EasyError(f"no archived days match under '{archive.root}'")
+    logging.info("rebuilding {} days".format(len(manifests)))
+
+    progress = qsec.logging.Progress("rebuild", total=len(manifests), unit="days")
+    failed = 0
+    rows = 0
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             initializer=qsec.logging.init_worker) as pool:
+        futures = {pool.submit(rebuild_day, archive.root, m): m for m in manifests}
+        for n, future in enumerate(as_completed(futures), 1):
+            m = futures[future]
+            try:
+                rows += future.result()
+            except Exception as err:
+                failed += 1
+                logging.error("{} {} {} @ {}: {}".format(
+                    m["venue"], m["dtype"], m["symbol"], m["date"], err))
+            progress.update(position=n, count=n)
+    progress.done()
+    logging.info("rebuilt {} rows".format(rows))
+    if failed:
+        raise qsec.app.EasyError(f"{failed} of {len(manifests)} days failed")
+
+
+if __name__ == "__main__":
+    qsec.app.main(main)
@@ -0,0 +1,139 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import qsec.decode
+import qsec.logging
+import qsec.metrics
+
+
+# Time-window trade fetching: an alternative to walking a day by trade id.
+#
+# The day is covered by [lo, hi) windows, requested by startTime/endTime and
+# fetched concurrently.  Binance accepts windows of at most an hour, so a day
+# takes at least 24 requests, but they run in parallel and need no search for
+# the day's first trade id, which suits sparse symbols.
+#
+# A reply holding the full 1000 trades may have been cut short, part way
+# through the trades of its last millisecond.  Its trades before that
+# millisecond are kept, and the rest of the window is re-split into windows
+# sized by the trade density just observed.  A single millisecond with more
+# than 1000 trades is completed by id, from its last trade.  Every trade thus
+# falls in exactly one window, and none are lost at window boundaries.
+
+# Binance rejects aggTrades windows longer than an hour
+max_window_ms = 60 * 60 * 1000
+
+# most windows a dense remainder is split into at once; windows that come
+# back full are split again
+max_split = 16
+
+engines = ["id", "time", "auto"]
+
+
+def add_engine_args(parser):
+    parser.add_argument(
+        "--engine",
+        choices=engines,
+        default="id",
+        help="walk each day by trade id, fetch it in concurrent time "
+        "windows (suits sparse symbols), or choose per day from the trades "
+        "in its first hour",
+    )
+    parser.add_argument(
+        "--window-workers",
+        dest="window_workers",
+        type=int,
+        default=4,
+        help="time engine: concurrent window requests",
+    )
+
+
+def _split(lo: int, hi: int, density: float, target_rows: int) -> list:
+    """Split [lo, hi) into windows expected to hold about target_rows trades
+    each, at a density of trades per ms"""
+    n = int(density * (hi - lo) / target_rows) + 1 if density > 0 else 1
+    size = -(-(hi - lo) // min(n, max_split))
+    size = max(1, min(size, max_window_ms))
+    return [(s, min(s + size, hi)) for s in range(lo, hi, size)]
+
+
+def choose_engine(symbol: str, beg_ms: int, call_http_trade,
+                  limit: int = 1000) -> str:
+    """'time' if the first hour from beg_ms has fewer trades than fit in one
+    reply, otherwise 'id'"""
+    raw = call_http_trade(symbol, start_time=beg_ms,
+                          end_time=beg_ms + max_window_ms - 1)
+    n, _, _ = qsec.decode.peek_agg_trades(raw)
+    engine = "time" if n < limit else "id"
+    logging.info(f"{n} trades in first hour, using {engine} engine")
+    return engine
+
+
+def fetch_pages(symbol: str, beg_ms: int, end_ms: int, call_http_trade,
+                workers: int = 4, limit: int = 1000,
+                target_rows: int = None) -> list:
+    """Raw aggTrades pages, as (lo, hi, raw), holding every trade with a time
+    in [beg_ms, end_ms) once, within the windows of the pages they are in"""
+    target_rows = target_rows or limit * 8 // 10
+    progress = qsec.logging.Progress(
+        "trades",
+        total=end_ms - beg_ms,
+        unit="trades",
+        describe=lambda pos: "{:.0f}% of period".format(
+            100.0 * pos / max(end_ms - beg_ms, 1)),
+    )
+    pages = []  # (lo, first trade id, hi, raw)
+    covered = 0
+    count = 0
+
+    def fetch_window(lo, hi):
+        return lo, hi, None, call_http_trade(symbol, start_time=lo, end_time=hi - 1)
+
+    def fetch_ids(ms, from_id):
+        return ms, ms + 1, from_id, call_http_trade(symbol, fromId=from_id)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {
+            pool.submit(fetch_window, lo, hi)
+            for lo, hi in _split(beg_ms, end_ms, 0, target_rows)
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                lo, hi, from_id, raw = future.result()
+                n, first, last = qsec.decode.peek_agg_trades(raw)
+                if from_id is not None:
+                    # walking the trades of one millisecond by id
+                    if n and first["T"] == lo:
+                        pages.append((lo, first["a"], hi, raw))
+                        count += n
+                    if n >= limit and last["T"] == lo:
+                        pending.add(pool.submit(fetch_ids, lo, last["a"] + 1))
+                    continue
+                qsec.metrics.inc("trade_windows_total",
+                                 outcome="full" if n >= limit else "complete")
+                if n < limit:
+                    if n:
+                        pages.append((lo, first["a"], hi, raw))
+                    covered += hi - lo
+                    count += n
+                    progress.update(covered, count)
+                    continue
+                # a full reply: trades of its last millisecond may be missing
+                cut = last["T"]
+                if cut == lo:
+                    pages.append((lo, first["a"], lo + 1, raw))
+                    pending.add(pool.submit(fetch_ids, lo, last["a"] + 1))
+                    cut = lo + 1
+                    density = float(n)
+                else:
+                    pages.append((lo, first["a"], cut, raw))
+                    density = n / (cut - lo)
+                covered += cut - lo
+                count += n
+                progress.update(covered, count)
+                for w_lo, w_hi in _split(cut, hi, density, target_rows):
+                    pending.add(pool.submit(fetch_window, w_lo, w_hi))
+    progress.done()
+    pages.sort(key=lambda p: (p[0], p[1]))
+    return [(lo, hi, raw) for lo, _, hi, raw in pages]
@@ -0,0 +1,207 @@
+import datetime as dt
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import qsec.app
+import qsec.lazy
+import qsec.logging
+import qsec.marketdata
+import qsec.metrics
+import qsec.refdata
+import qsec.rest
+import qsec.time
+import common
+
+pd = qsec.lazy.lazy_import("pandas")
+
+
+# Universe mode for the kline tools: fetch the same bars for every asset of a
+# venue listed in the reference data, rather than for a single --sym.  All
+# (symbol, window) requests are planned up front, then each (symbol, date) is
+# fetched on a thread pool, with qsec.rest pacing requests to stay within a
+# request-weight-per-minute budget.  Output is either the usual per-symbol
+# files, or one multi-symbol file per day.
+
+# Binance allows 6000 (spot) and 2400 (futures) request weight per minute per
+# IP; by default take half, leaving room for other clients.
+default_weight_budget = {
+    "binance": 3000,
+    "binance_usdfut": 1200,
+    "binance_coinfut": 1200,
+}
+
+universe_assetid = qsec.marketdata.universe_assetid
+
+
+def add_universe_args(parser):
+    parser.add_argument(
+        "--status",
+        type=str,
+        default="TRADING",
+        help="universe mode: only assets with this status, '' for all",
+    )
+    parser.add_argument(
+        "--layout",
+        type=str,
+        choices=["symbol", "day"],
+        default="symbol",
+        help="universe mode: write a file per symbol, or one multi-symbol "
+        "file per day",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="universe mode: number of concurrent requests",
+    )
+    parser.add_argument(
+        "--weight-budget",
+        dest="weight_budget",
+        type=int,
+        default=None,
+        help="universe mode: request weight per minute (default: half the "
+        "exchange limit)",
+    )
+    parser.add_argument(
+        "--refdata",
+        type=str,
+        default=None,
+        help="universe mode: reference data snapshot (default: latest)",
+    )
+
+
+def load_universe(venue: str, status: str = None, fn: str = None) -> list:
+    """Return sorted (symbol, assetid) pairs of a venue's assets"""
+    assets = qsec.refdata.load_assets(fn)
+    fields = {"venue": venue}
+    if status:
+        fields["status"] = status
+    rows = assets.find(**fields)
+    if not rows:
+        raise qsec.app.EasyError(
+            f"no '{venue}' assets with status '{status}' in reference data"
+        )
+    return sorted((row["symbol"], row["assetid"]) for row in rows)
+
+
+def log_plan(symbols: list, dates: list, interval: str, limit: int,
+             weight: int, budget: int):
+    requests = len(symbols) * sum(
+        len(common.kline_request_windows(d, interval, limit)) for d in dates
+    )
+    total_weight = requests * weight
+    logging.info(
+        "universe plan: {} symbols x {} days, {} requests of weight {}, "
+        "at {}/min takes at least {:.1f} min".format(
+            len(symbols), len(dates), requests, weight, budget,
+            total_weight / budget,
+        )
+    )
+
+
+def _fetch_one(fetch_day, symbol, assetid, date, venue, interval, layout):
+    dtype = f"bars{interval}"
+    with qsec.metrics.scope("day", symbol=symbol, date=date) as day:
+        df = fetch_day(symbol, date, interval)
+        day["rows"] = len(df)
+        if layout == "symbol":
+            info, _ = common.bar_completeness(df, date, interval)
+            with qsec.metrics.timer("stage_seconds", stage="write"):
+                common.save_dateframe(symbol, date, df, assetid, venue, dtype,
+                                      dtype, meta=info)
+            return None
+    return df
+
+
+def _combine(frames: dict) -> "pd.DataFrame":
+    # stack per-symbol bars into one frame, ordered by time then assetid
+    frames = {k: v for k, v in frames.items() if not v.empty}
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, names=["assetid", "time"]).reset_index()
+    df.sort_values(["time", "assetid"], inplace=True, kind="stable")
+    df.set_index("time", inplace=True)
+    return df
+
+
+def run(args, venue: str, fetch_day, interval: str, from_date: dt.date,
+        upto_date: dt.date, request_limit: int, request_weight: int):
+    """Fetch bars for every asset of `venue` for each date in the range.
+
+    `fetch_day(symbol, date, interval)` is the tool's per-day fetch.  Existing
+    output is skipped, so an interrupted run can be restarted.  Failures of
+    individual symbols are logged and reported at the end.
+    """
+    symbols = load_universe(venue, args.status, args.refdata)
+    dates = qsec.time.dates_in_range(from_date, upto_date)
+    budget = args.weight_budget or default_weight_budget[venue]
+    qsec.rest.set_weight_budget(budget)
+    log_plan(symbols, dates, interval, request_limit, request_weight, budget)
+
+    dtype = f"bars{interval}"
+    failures = []
+    progress = qsec.logging.Progress(
+        "universe", total=len(symbols) * len(dates), unit="symbol-days"
+    )
+    done = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for d in dates:
+            if args.layout == "day":
+                day_fn = common.build_md_item_filename(
+                    universe_assetid, d, dtype, venue, dtype
+                )
+                if os.path.exists(day_fn):
+                    logging.info("data item exists, skipping: '{}'".format(day_fn))
+                    done += len(symbols)
+                    continue
+                todo = symbols
+            else:
+                todo = [
+                    (symbol, assetid)
+                    for symbol, assetid in symbols
+                    if common.incomplete_days([d], assetid, venue, dtype)
+                ]
+                done += len(symbols) - len(todo)
+
+            futures = {
+                pool.submit(_fetch_one, fetch_day, symbol, assetid, d, venue,
+                            interval, args.layout): assetid
+                for symbol, assetid in todo
+            }
+            frames = {}
+            day_failures = 0
+            for future in as_completed(futures):
+                assetid = futures[future]
+                try:
+                    df = future.result()
+                except Exception as err:
+                    logging.error(f"failed to fetch {assetid} @ {d}: {err}")
+                    failures.append((assetid, d))
+                    day_failures += 1
+                else:
+                    if df is not None:
+                        frames[assetid] = df
+                done += 1
+                progress.update(position=done, count=done)
+
+            if args.layout == "day":
+                if day_failures:
+                    logging.error(
+                        f"not writing universe file for {d}, "
+                        f"{day_failures} symbols failed"
+                    )
+                    continue
+                df = _combine(frames)
+                del frames
+                with qsec.metrics.timer("stage_seconds", stage="write"):
+                    common.save_dateframe(universe_assetid, d, df,
+                                          universe_assetid, venue, dtype, dtype)
+    progress.done()
+
+    if failures:
+        raise qsec.app.EasyError(
+            "failed to fetch {} of {} symbol-days, rerun to retry".format(
+                len(failures), len(symbols) * len(dates)
+            )
+        )